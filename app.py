@@ -1,15 +1,27 @@
-from flask import Flask, request, abort
-from linebot import LineBotApi, WebhookHandler
+from flask import Flask, request, abort, jsonify
+from linebot import LineBotApi, WebhookParser
 from linebot.exceptions import InvalidSignatureError
-from linebot.models import MessageEvent, TextMessage, LocationMessage, FollowEvent
 import os
+import queue
+import random
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
 from config import Config
 from recommender import RestaurantRecommender
+from cache import SingleFlight
+from categories import category_key
+from dispatcher import WebhookDispatcher, EventBatchRunner, event_handler_name
+from idempotency import create_event_deduplicator
+from prefetch import CandidatePrefetcher
+from refresher import POIRefresher
+from session_store import create_session_store
+from metrics import registry, timed, service_samples, UPSTREAM_ERRORS, WEBHOOK_REQUESTS
 from message_templates import (
     create_welcome_message, create_category_selection_message,
     create_carousel_message, create_location_request_message,
-    create_error_message, create_searching_message
+    create_error_message, create_searching_message,
+    column_cache
 )
 from utils import validate_location, logger
 
@@ -24,51 +36,186 @@ except ValueError as e:
     raise
 
 # Initialize LINE Bot API
-line_bot_api = LineBotApi(Config.LINE_CHANNEL_ACCESS_TOKEN)
-handler = WebhookHandler(Config.LINE_CHANNEL_SECRET)
+line_bot_api = LineBotApi(Config.LINE_CHANNEL_ACCESS_TOKEN, endpoint=Config.LINE_API_ENDPOINT)
+parser = WebhookParser(Config.LINE_CHANNEL_SECRET)
 
 # Initialize recommender
 recommender = RestaurantRecommender()
 
-# Store user sessions (in production, use Redis or database)
-user_sessions = {}
+# Candidate sets fetched after a location share (used for later category taps)
+prefetcher = CandidatePrefetcher.from_config(recommender) if Config.PREFETCH_ENABLED else None
+
+# Hot regions kept in a local snapshot, loaded now for a warm start
+refresher = POIRefresher.from_config(recommender) if Config.POI_REFRESH_ENABLED else None
+
+# Events of one payload run concurrently per user
+event_runner = EventBatchRunner(lambda event: dispatch_event(event), workers=Config.EVENT_WORKERS)
+
+# Concurrent recommender searches for the same location and category share one lookup
+search_flights = SingleFlight()
+
+# Searches that may outlive REPLY_DEADLINE run here and are pushed when done
+search_executor = ThreadPoolExecutor(max_workers=Config.PUSH_WORKERS, thread_name_prefix='search')
+
+# Background webhook processing (used when ASYNC_WEBHOOK is enabled)
+dispatcher = WebhookDispatcher(
+    event_runner.run,
+    workers=Config.WEBHOOK_WORKERS,
+    queue_size=Config.WEBHOOK_QUEUE_SIZE,
+    enqueue_timeout=Config.WEBHOOK_ENQUEUE_TIMEOUT
+)
+
+# Store user sessions (category preference and last location)
+user_sessions = create_session_store()
+
+# Redelivered webhook events (same webhookEventId) are dropped before any work
+deduplicator = create_event_deduplicator() if Config.WEBHOOK_DEDUP_ENABLED else None
+
+def collect_metrics():
+    """Cache, queue and upstream counters read at scrape time"""
+    samples = service_samples(recommender, recommender.flights, recommender.client, column_cache,
+                              prefetcher, refresher, deduplicator)
+    webhook = dispatcher.stats()
+    samples.append(('food_bot_webhook_queue_depth', 'gauge',
+                    "Webhook payloads waiting for a worker", {}, webhook['queue_depth']))
+    samples.append(('food_bot_webhook_rejected_total', 'counter',
+                    "Webhook payloads rejected because the queue was full", {}, webhook['rejected']))
+    return samples
+
+registry.add_collector(collect_metrics)
 
 @app.route("/")
 def home():
     """Health check endpoint"""
     return "LINE Restaurant Bot is running! 🍴", 200
 
+@app.route("/metrics")
+def metrics():
+    """Prometheus metrics of this worker process"""
+    return registry.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
 @app.route("/callback", methods=['POST'])
 def callback():
     """LINE webhook callback endpoint"""
     # Get X-Line-Signature header value
     signature = request.headers.get('X-Line-Signature')
     if not signature:
+        WEBHOOK_REQUESTS.inc('400')
         abort(400)
 
     # Get request body as text
     body = request.get_data(as_text=True)
-    logger.info(f"Request body: {body}")
+    if Config.LOG_WEBHOOK_BODY_SAMPLE_RATE and random.random() < Config.LOG_WEBHOOK_BODY_SAMPLE_RATE:
+        logger.info(f"Request body: {body}")
+
+    # The refresh thread is started per worker, after gunicorn forks
+    if refresher is not None:
+        refresher.ensure_started()
 
     # Handle webhook body
     try:
-        handler.handle(body, signature)
+        with timed('signature'):
+            events = parser.parse(body, signature)
+        
+        if deduplicator is not None:
+            events = deduplicator.filter(events)
+        
+        if Config.ASYNC_WEBHOOK:
+            # Handle events off the request thread
+            if events:
+                dispatcher.submit(events)
+        else:
+            event_runner.run(events)
     except InvalidSignatureError:
         logger.error("Invalid signature")
+        WEBHOOK_REQUESTS.inc('400')
         abort(400)
+    except queue.Full:
+        logger.warning("Webhook queue is full, rejecting request")
+        # LINE redelivers the payload; let the redelivery through
+        if deduplicator is not None:
+            deduplicator.release(events)
+        WEBHOOK_REQUESTS.inc('503')
+        return 'Busy', 503
 
+    WEBHOOK_REQUESTS.inc('200')
     return 'OK'
 
-@handler.add(FollowEvent)
+@app.route("/stats")
+def stats():
+    """Webhook queue depth, cache and upstream coalescing counters"""
+    return jsonify({
+        'webhook': dispatcher.stats(),
+        'overpass': recommender.client.stats(),
+        'overpass_singleflight': recommender.flights.stats(),
+        'tile_cache': recommender.tile_cache.stats() if recommender.tile_cache else None,
+        'recommendation_cache': (recommender.recommendation_cache.stats()
+                                 if recommender.recommendation_cache else None),
+        'prefetch': prefetcher.stats() if prefetcher else None,
+        'webhook_dedup': deduplicator.stats() if deduplicator else None,
+        'poi_snapshot': refresher.stats() if refresher else None,
+    }), 200
+
+def dispatch_event(event):
+    """
+    Run the handler for a single event
+
+    Events parsed in callback() are handled inline or later by the
+    dispatcher.
+
+    Args:
+        event: Parsed webhook event
+    """
+    func = HANDLERS.get(event_handler_name(event))
+    if func is None:
+        logger.info(f"No handler for {type(event).__name__}")
+    else:
+        func(event)
+
+def reply_message(reply_token, messages):
+    """
+    Send a reply, recording its latency and failures
+
+    Args:
+        reply_token: LINE reply token
+        messages: Message or list of messages
+
+    Raises:
+        linebot.exceptions.LineBotApiError: If LINE rejects the reply
+    """
+    try:
+        with timed('reply_message'):
+            line_bot_api.reply_message(reply_token, messages)
+    except Exception:
+        UPSTREAM_ERRORS.inc('line')
+        raise
+
+def push_message(user_id, messages):
+    """
+    Send a push message, recording its latency and failures
+
+    Args:
+        user_id: LINE user ID
+        messages: Message or list of messages
+
+    Raises:
+        linebot.exceptions.LineBotApiError: If LINE rejects the message
+    """
+    try:
+        with timed('push_message'):
+            line_bot_api.push_message(user_id, messages)
+    except Exception:
+        UPSTREAM_ERRORS.inc('line')
+        raise
+
 def handle_follow(event):
     """Handle when user follows the bot"""
     logger.info(f"New follower: {event.source.user_id}")
     
     # Send welcome message
     welcome_msg = create_welcome_message()
-    line_bot_api.reply_message(event.reply_token, welcome_msg)
+    reply_message(event.reply_token, welcome_msg)
 
-@handler.add(MessageEvent, message=TextMessage)
 def handle_text_message(event):
     """Handle text messages"""
     user_id = event.source.user_id
@@ -79,31 +226,30 @@ def handle_text_message(event):
     # Check if it's a category selection
     if text in Config.CATEGORIES:
         # Store user's category preference
-        if user_id not in user_sessions:
-            user_sessions[user_id] = {}
-        user_sessions[user_id]['category'] = text
+        session = user_sessions.get(user_id)
+        session['category'] = text
+        user_sessions.save(user_id, session)
         
         # Check if user has shared location
-        if 'location' in user_sessions[user_id]:
+        if 'location' in session:
             # User has location, search restaurants
-            location = user_sessions[user_id]['location']
+            location = session['location']
             search_and_reply(event.reply_token, user_id, location['latitude'], location['longitude'], text)
         else:
             # Request location
             location_msg = create_location_request_message()
-            line_bot_api.reply_message(event.reply_token, location_msg)
+            reply_message(event.reply_token, location_msg)
     
     elif text == "選擇類別":
         # Show category selection
         category_msg = create_category_selection_message()
-        line_bot_api.reply_message(event.reply_token, category_msg)
+        reply_message(event.reply_token, category_msg)
     
     else:
         # Default response - show welcome message
         welcome_msg = create_welcome_message()
-        line_bot_api.reply_message(event.reply_token, welcome_msg)
+        reply_message(event.reply_token, welcome_msg)
 
-@handler.add(MessageEvent, message=LocationMessage)
 def handle_location_message(event):
     """Handle location messages - this is the key feature!"""
     user_id = event.source.user_id
@@ -115,27 +261,115 @@ def handle_location_message(event):
     # Validate location
     if not validate_location(latitude, longitude):
         error_msg = create_error_message()
-        line_bot_api.reply_message(event.reply_token, error_msg)
+        reply_message(event.reply_token, error_msg)
         return
     
     # Store user's location
-    if user_id not in user_sessions:
-        user_sessions[user_id] = {}
-    user_sessions[user_id]['location'] = {
+    session = user_sessions.get(user_id)
+    session['location'] = {
         'latitude': latitude,
         'longitude': longitude
     }
+    user_sessions.save(user_id, session)
+    
+    # Fetch every category around the new location for later category taps
+    if prefetcher is not None:
+        prefetcher.prefetch(user_id, latitude, longitude)
     
     # Get user's category preference (if any)
-    category = user_sessions[user_id].get('category', '全部')
+    category = session.get('category', '全部')
     
     # Search and reply with recommendations
     search_and_reply(event.reply_token, user_id, latitude, longitude, category)
 
+# Handler of each event the bot handles (see dispatcher.EVENT_HANDLERS)
+HANDLERS = {
+    'follow': handle_follow,
+    'text': handle_text_message,
+    'location': handle_location_message,
+}
+
+def find_recommendations(user_id, latitude, longitude, category=None):
+    """
+    Get recommendations, from the user's prefetched candidates if possible
+    
+    The prefetched candidates belong to one user, so only the recommender
+    search that follows a miss is shared between concurrent searches.
+    
+    Args:
+        user_id: LINE user ID
+        latitude: User's latitude
+        longitude: User's longitude
+        category: Restaurant category filter
+    
+    Returns:
+        List of recommended restaurants
+    """
+    if refresher is not None:
+        refresher.record_query(latitude, longitude)
+    
+    if prefetcher is not None:
+        recommendations = prefetcher.recommend(user_id, latitude, longitude, category)
+        if recommendations is not None:
+            return recommendations
+    
+    return search_flights.do(
+        (latitude, longitude, category_key(category)),
+        lambda: recommender.get_recommendations(latitude, longitude, category)
+    )
+
+def build_search_reply(user_id, latitude, longitude, category=None):
+    """
+    Search for restaurants and build the reply messages
+    
+    Args:
+        user_id: LINE user ID
+        latitude: User's latitude
+        longitude: User's longitude
+        category: Restaurant category filter
+    
+    Returns:
+        List of messages (carousel and category selection)
+    """
+    with timed('recommend'):
+        recommendations = find_recommendations(user_id, latitude, longitude, category)
+    
+    with timed('templates'):
+        # Create carousel message
+        carousel_msg = create_carousel_message(recommendations)
+        
+        # Create category selection for next search
+        category_msg = create_category_selection_message()
+    
+    return [carousel_msg, category_msg]
+
+def push_search_result(user_id, future):
+    """
+    Push the result of a search that missed the reply deadline
+    
+    Args:
+        user_id: LINE user ID
+        future: Future of build_search_reply
+    """
+    try:
+        messages = future.result()
+    except Exception as e:
+        logger.error(f"Error in background search: {e}")
+        messages = create_error_message()
+    
+    try:
+        push_message(user_id, messages)
+    except Exception as e:
+        logger.error(f"Error pushing search result to {user_id}: {e}")
+
 def search_and_reply(reply_token, user_id, latitude, longitude, category=None):
     """
     Search for restaurants and reply with recommendations
     
+    With REPLY_DEADLINE set, a search that is not done in time is answered
+    with the searching message, and the results are pushed to the user
+    when they are ready.
+    
     Args:
         reply_token: LINE reply token
         user_id: LINE user ID (for push messages)
@@ -145,22 +379,26 @@ def search_and_reply(reply_token, user_id, latitude, longitude, category=None):
     """
     try:
         # Get recommendations (do this first to avoid wasting reply_token)
-        recommendations = recommender.get_recommendations(latitude, longitude, category)
-        
-        # Create carousel message
-        carousel_msg = create_carousel_message(recommendations)
-        
-        # Create category selection for next search
-        category_msg = create_category_selection_message()
+        if Config.REPLY_DEADLINE > 0 and user_id:
+            future = search_executor.submit(build_search_reply, user_id, latitude, longitude, category)
+            try:
+                messages = future.result(timeout=Config.REPLY_DEADLINE)
+            except FutureTimeoutError:
+                logger.info(f"Search for {user_id} missed the reply deadline, pushing results later")
+                reply_message(reply_token, create_searching_message(category))
+                future.add_done_callback(lambda f: push_search_result(user_id, f))
+                return
+        else:
+            messages = build_search_reply(user_id, latitude, longitude, category)
         
         # Reply with both messages
-        line_bot_api.reply_message(reply_token, [carousel_msg, category_msg])
+        reply_message(reply_token, messages)
         
     except Exception as e:
         logger.error(f"Error in search_and_reply: {e}")
         error_msg = create_error_message()
         try:
-            line_bot_api.reply_message(reply_token, error_msg)
+            reply_message(reply_token, error_msg)
         except:
             pass
 
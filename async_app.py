@@ -0,0 +1,393 @@
+"""
+asyncio webhook app
+
+Same bot as app.py, served by aiohttp: Overpass and LINE calls are
+coroutines on shared aiohttp sessions, so one worker keeps many searches and
+replies in flight without a thread per event. Run with
+
+    gunicorn async_app:app --worker-class aiohttp.GunicornWebWorker
+
+or `python async_app.py`.
+"""
+import asyncio
+import os
+import random
+
+import aiohttp
+from aiohttp import web
+from linebot import AsyncLineBotApi, WebhookParser
+from linebot.aiohttp_async_http_client import AiohttpAsyncHttpClient
+from linebot.exceptions import InvalidSignatureError
+
+from config import Config
+from async_recommender import AsyncRestaurantRecommender
+from cache import AsyncSingleFlight
+from categories import category_key
+from dispatcher import group_events, event_handler_name
+from idempotency import create_event_deduplicator
+from prefetch import CandidatePrefetcher
+from refresher import POIRefresher
+from session_store import create_session_store
+from metrics import registry, timed, service_samples, UPSTREAM_ERRORS, WEBHOOK_REQUESTS
+from message_templates import (
+    create_welcome_message, create_category_selection_message,
+    create_carousel_message, create_location_request_message,
+    create_error_message, create_searching_message,
+    column_cache
+)
+from utils import validate_location, logger
+
+# Validate configuration
+try:
+    Config.validate()
+except ValueError as e:
+    logger.error(f"Configuration error: {e}")
+    raise
+
+parser = WebhookParser(Config.LINE_CHANNEL_SECRET)
+
+# Created in on_startup, inside the worker's event loop
+line_session = None
+line_bot_api = None
+
+# Initialize recommender (caches and scoring shared with the sync engine)
+async_recommender = AsyncRestaurantRecommender()
+recommender = async_recommender.recommender
+
+# Hot regions kept in a local snapshot, loaded now for a warm start
+refresher = POIRefresher.from_config(recommender) if Config.POI_REFRESH_ENABLED else None
+
+# Candidate sets fetched after a location share, on the prefetcher's threads
+prefetcher = CandidatePrefetcher.from_config(recommender) if Config.PREFETCH_ENABLED else None
+
+# Concurrent recommender searches for the same location and category share one lookup
+search_flights = AsyncSingleFlight()
+
+# Events being handled and searches being pushed (awaited on shutdown)
+background_tasks = set()
+events_in_flight = 0
+
+# Store user sessions (category preference and last location)
+user_sessions = create_session_store()
+
+# Redelivered webhook events (same webhookEventId) are dropped before any work
+deduplicator = create_event_deduplicator() if Config.WEBHOOK_DEDUP_ENABLED else None
+
+# Redis-backed sessions and event log block on the network
+STORES_BLOCK = Config.SESSION_BACKEND == 'redis'
+
+def collect_metrics():
+    """Cache, in-flight and upstream counters read at scrape time"""
+    samples = service_samples(recommender, async_recommender.flights, async_recommender.client, column_cache,
+                              prefetcher, refresher, deduplicator)
+    samples.append(('food_bot_webhook_events_in_flight', 'gauge',
+                    "Webhook events being handled", {}, events_in_flight))
+    return samples
+
+registry.add_collector(collect_metrics)
+
+def spawn(coro):
+    """Run a coroutine in the background, keeping a reference until it is done"""
+    task = asyncio.ensure_future(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+async def run_blocking(func, *args):
+    """Run a blocking call in the event loop's thread pool"""
+    return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+async def call_store(func, *args):
+    """Call a session store or deduplicator method, off the loop if it blocks"""
+    if STORES_BLOCK:
+        return await run_blocking(func, *args)
+    return func(*args)
+
+async def home(request):
+    """Health check endpoint"""
+    return web.Response(text="LINE Restaurant Bot is running! 🍴")
+
+async def metrics(request):
+    """Prometheus metrics of this worker process"""
+    return web.Response(body=registry.render().encode(),
+                        headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+async def callback(request):
+    """LINE webhook callback endpoint"""
+    global events_in_flight
+
+    # Get X-Line-Signature header value
+    signature = request.headers.get('X-Line-Signature')
+    if not signature:
+        WEBHOOK_REQUESTS.inc('400')
+        raise web.HTTPBadRequest()
+
+    # Get request body as text
+    body = await request.text()
+    if Config.LOG_WEBHOOK_BODY_SAMPLE_RATE and random.random() < Config.LOG_WEBHOOK_BODY_SAMPLE_RATE:
+        logger.info(f"Request body: {body}")
+
+    # The refresh thread is started per worker, after gunicorn forks
+    if refresher is not None:
+        refresher.ensure_started()
+
+    try:
+        with timed('signature'):
+            events = parser.parse(body, signature)
+    except InvalidSignatureError:
+        logger.error("Invalid signature")
+        WEBHOOK_REQUESTS.inc('400')
+        raise web.HTTPBadRequest()
+
+    if deduplicator is not None:
+        events = await call_store(deduplicator.filter, events)
+
+    if events and events_in_flight + len(events) > Config.ASYNC_MAX_EVENTS:
+        logger.warning("Too many webhook events in flight, rejecting request")
+        # LINE redelivers the payload; let the redelivery through
+        if deduplicator is not None:
+            await call_store(deduplicator.release, events)
+        WEBHOOK_REQUESTS.inc('503')
+        return web.Response(status=503, text='Busy')
+
+    # Handle events after answering; each user's events in order
+    for group in group_events(events):
+        events_in_flight += len(group)
+        spawn(run_group(group))
+
+    WEBHOOK_REQUESTS.inc('200')
+    return web.Response(text='OK')
+
+async def stats(request):
+    """In-flight events, cache and upstream coalescing counters"""
+    return web.json_response({
+        'webhook': {'events_in_flight': events_in_flight, 'tasks': len(background_tasks)},
+        'overpass': async_recommender.client.stats(),
+        'overpass_singleflight': async_recommender.flights.stats(),
+        'tile_cache': recommender.tile_cache.stats() if recommender.tile_cache else None,
+        'recommendation_cache': (recommender.recommendation_cache.stats()
+                                 if recommender.recommendation_cache else None),
+        'webhook_dedup': deduplicator.stats() if deduplicator else None,
+        'prefetch': prefetcher.stats() if prefetcher else None,
+        'poi_snapshot': refresher.stats() if refresher else None,
+    })
+
+async def run_group(events):
+    """
+    Handle one user's events in order
+
+    Args:
+        events: Parsed webhook events of one user
+    """
+    global events_in_flight
+    for event in events:
+        try:
+            await dispatch_event(event)
+        except Exception as e:
+            logger.error(f"Error handling webhook event: {e}")
+        finally:
+            events_in_flight -= 1
+
+async def dispatch_event(event):
+    """
+    Run the handler for a single event
+
+    Args:
+        event: Parsed webhook event
+    """
+    func = HANDLERS.get(event_handler_name(event))
+    if func is None:
+        logger.info(f"No handler for {type(event).__name__}")
+    else:
+        await func(event)
+
+async def reply_message(reply_token, messages):
+    """Send a reply (see app.reply_message)"""
+    try:
+        with timed('reply_message'):
+            await line_bot_api.reply_message(reply_token, messages)
+    except Exception:
+        UPSTREAM_ERRORS.inc('line')
+        raise
+
+async def push_message(user_id, messages):
+    """Send a push message (see app.push_message)"""
+    try:
+        with timed('push_message'):
+            await line_bot_api.push_message(user_id, messages)
+    except Exception:
+        UPSTREAM_ERRORS.inc('line')
+        raise
+
+async def handle_follow(event):
+    """Handle when user follows the bot"""
+    logger.info(f"New follower: {event.source.user_id}")
+    await reply_message(event.reply_token, create_welcome_message())
+
+async def handle_text_message(event):
+    """Handle text messages"""
+    user_id = event.source.user_id
+    text = event.message.text.strip()
+
+    logger.info(f"User {user_id} sent: {text}")
+
+    if text in Config.CATEGORIES:
+        # Store user's category preference
+        session = await call_store(user_sessions.get, user_id)
+        session['category'] = text
+        await call_store(user_sessions.save, user_id, session)
+
+        if 'location' in session:
+            location = session['location']
+            await search_and_reply(event.reply_token, user_id, location['latitude'], location['longitude'], text)
+        else:
+            await reply_message(event.reply_token, create_location_request_message())
+
+    elif text == "選擇類別":
+        await reply_message(event.reply_token, create_category_selection_message())
+
+    else:
+        await reply_message(event.reply_token, create_welcome_message())
+
+async def handle_location_message(event):
+    """Handle location messages"""
+    user_id = event.source.user_id
+    latitude = event.message.latitude
+    longitude = event.message.longitude
+
+    logger.info(f"User {user_id} shared location: ({latitude}, {longitude})")
+
+    if not validate_location(latitude, longitude):
+        await reply_message(event.reply_token, create_error_message())
+        return
+
+    # Store user's location
+    session = await call_store(user_sessions.get, user_id)
+    session['location'] = {
+        'latitude': latitude,
+        'longitude': longitude
+    }
+    await call_store(user_sessions.save, user_id, session)
+
+    # Fetch every category around the new location for later category taps
+    if prefetcher is not None:
+        prefetcher.prefetch(user_id, latitude, longitude)
+
+    category = session.get('category', '全部')
+    await search_and_reply(event.reply_token, user_id, latitude, longitude, category)
+
+# Handler of each event the bot handles (see dispatcher.EVENT_HANDLERS)
+HANDLERS = {
+    'follow': handle_follow,
+    'text': handle_text_message,
+    'location': handle_location_message,
+}
+
+async def find_recommendations(user_id, latitude, longitude, category=None):
+    """Get recommendations, from the user's prefetched candidates if possible (see app.find_recommendations)"""
+    if refresher is not None:
+        refresher.record_query(latitude, longitude)
+
+    if prefetcher is not None:
+        # May wait up to PREFETCH_WAIT for the user's prefetch to finish
+        recommendations = await run_blocking(prefetcher.recommend, user_id, latitude, longitude, category)
+        if recommendations is not None:
+            return recommendations
+
+    return await search_flights.do(
+        (latitude, longitude, category_key(category)),
+        lambda: async_recommender.get_recommendations(latitude, longitude, category)
+    )
+
+async def build_search_reply(user_id, latitude, longitude, category=None):
+    """Search for restaurants and build the reply messages (see app.build_search_reply)"""
+    with timed('recommend'):
+        recommendations = await find_recommendations(user_id, latitude, longitude, category)
+
+    with timed('templates'):
+        carousel_msg = create_carousel_message(recommendations)
+        category_msg = create_category_selection_message()
+
+    return [carousel_msg, category_msg]
+
+async def push_search_result(user_id, search):
+    """
+    Push the result of a search that missed the reply deadline
+
+    Args:
+        user_id: LINE user ID
+        search: Task of build_search_reply
+    """
+    try:
+        messages = await search
+    except Exception as e:
+        logger.error(f"Error in background search: {e}")
+        messages = create_error_message()
+
+    try:
+        await push_message(user_id, messages)
+    except Exception as e:
+        logger.error(f"Error pushing search result to {user_id}: {e}")
+
+async def search_and_reply(reply_token, user_id, latitude, longitude, category=None):
+    """Search for restaurants and reply with recommendations (see app.search_and_reply)"""
+    try:
+        if Config.REPLY_DEADLINE > 0 and user_id:
+            search = asyncio.ensure_future(build_search_reply(user_id, latitude, longitude, category))
+            try:
+                messages = await asyncio.wait_for(asyncio.shield(search), Config.REPLY_DEADLINE)
+            except asyncio.TimeoutError:
+                logger.info(f"Search for {user_id} missed the reply deadline, pushing results later")
+                spawn(push_search_result(user_id, search))
+                await reply_message(reply_token, create_searching_message(category))
+                return
+        else:
+            messages = await build_search_reply(user_id, latitude, longitude, category)
+
+        await reply_message(reply_token, messages)
+
+    except Exception as e:
+        logger.error(f"Error in search_and_reply: {e}")
+        try:
+            await reply_message(reply_token, create_error_message())
+        except Exception:
+            pass
+
+async def on_startup(app):
+    global line_session, line_bot_api
+    line_session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=Config.ASYNC_CONNECTION_LIMIT)
+    )
+    line_bot_api = AsyncLineBotApi(
+        Config.LINE_CHANNEL_ACCESS_TOKEN,
+        AiohttpAsyncHttpClient(line_session),
+        endpoint=Config.LINE_API_ENDPOINT
+    )
+
+async def on_shutdown(app):
+    # Let replies and pushes of accepted events go out
+    while background_tasks:
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+
+async def on_cleanup(app):
+    await async_recommender.close()
+    if line_session is not None:
+        await line_session.close()
+
+def create_app():
+    """Build the aiohttp application"""
+    application = web.Application()
+    application.router.add_get('/', home)
+    application.router.add_get('/metrics', metrics)
+    application.router.add_get('/stats', stats)
+    application.router.add_post('/callback', callback)
+    application.on_startup.append(on_startup)
+    application.on_shutdown.append(on_shutdown)
+    application.on_cleanup.append(on_cleanup)
+    return application
+
+app = create_app()
+
+if __name__ == "__main__":
+    port = int(os.environ.get('PORT', 5000))
+    web.run_app(app, host='0.0.0.0', port=port)
@@ -0,0 +1,214 @@
+"""
+asyncio variant of the recommender
+
+AsyncRestaurantRecommender answers the same searches as
+RestaurantRecommender.get_recommendations, with Overpass calls made through
+one shared aiohttp session so a single process can keep many searches in
+flight. Caches, the local index, scoring and ranking are shared with the
+wrapped synchronous recommender, which stays usable on its own.
+"""
+import asyncio
+
+import aiohttp
+
+from cache import AsyncSingleFlight
+from overpass import AsyncOverpassClient, merge_counts, is_truncated
+from places import Place
+from recommender import RestaurantRecommender, tile_item
+from utils import logger, geohash_cells_for_radius
+
+class AsyncRestaurantRecommender:
+    """Restaurant recommendation engine for asyncio applications"""
+
+    def __init__(self, recommender=None, client=None):
+        """
+        Args:
+            recommender: RestaurantRecommender holding caches and settings
+                (default: a new one from Config)
+            client: AsyncOverpassClient (default: from Config)
+        """
+        self.recommender = recommender or RestaurantRecommender()
+        self.client = client or AsyncOverpassClient.from_config()
+        self.flights = AsyncSingleFlight()
+
+    async def close(self):
+        """Close the Overpass session"""
+        await self.client.close()
+
+    async def fetch_restaurants(self, query):
+        """
+        Run an Overpass query and collect its named places
+
+        Args:
+            query: Overpass QL query string
+
+        Returns:
+            Tuple of (list of Place, raw elements per type)
+
+        Raises:
+            aiohttp.ClientError, asyncio.TimeoutError or ValueError: If the Overpass call fails
+        """
+        return await self.client.fetch(query, Place.from_element)
+
+    async def search_tiles(self, latitude, longitude, radius, category):
+        """
+        Search through the geohash tile cache (see RestaurantRecommender.search_tiles)
+
+        Returns:
+            Tuple of (list of restaurant data in the tiles covering the
+            radius, highest raw element count per type of the tile queries)
+        """
+        recommender = self.recommender
+        cells = geohash_cells_for_radius(latitude, longitude, radius, recommender.tile_precision)
+        restaurants, missing = recommender.cached_tiles(cells, category)
+        counts = {}
+
+        if missing:
+            try:
+                fetched, counts = await self.fetch_tiles(missing, category)
+                for tile in fetched.values():
+                    restaurants.extend(tile)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                if len(missing) == len(cells):
+                    raise
+                logger.error(f"Error fetching tiles, using cached tiles only: {e}")
+
+        logger.info(f"{len(cells) - len(missing)}/{len(cells)} tiles cached")
+        return restaurants, counts
+
+    async def fetch_tiles(self, cells, category):
+        """
+        Fetch and cache tiles (see RestaurantRecommender.fetch_tiles)
+
+        Returns:
+            Tuple of (dict mapping each cell to its list of restaurants,
+            highest raw element count per type of the cell outputs)
+        """
+        recommender = self.recommender
+        items, _ = await self.client.fetch(recommender.tiles_query(cells, category), tile_item)
+        return recommender.store_tiles(cells, category, items)
+
+    async def nearby_restaurants(self, latitude, longitude, category=None, radius=None, counts=None):
+        """
+        Find nearby restaurants (see RestaurantRecommender.stream_nearby_restaurants)
+
+        Concurrent searches snapped to the same grid point share one fetch.
+        Restaurants may lie slightly outside the search radius.
+
+        Args:
+            latitude: User's latitude
+            longitude: User's longitude
+            category: Restaurant category filter (optional)
+            radius: Search radius in meters (default: SEARCH_RADIUS)
+            counts: Dict updated with the highest raw element count per type
+                of the Overpass outputs (optional)
+
+        Returns:
+            Tuple of (list of restaurant data, False if the Overpass call failed)
+        """
+        recommender = self.recommender
+        radius = radius or recommender.search_radius
+        logger.info(f"Searching restaurants near ({latitude}, {longitude}) "
+                    f"within {radius}m with category: {category}")
+
+        index = recommender.index_for(latitude, longitude, radius)
+        if index is not None:
+            return recommender.search_local(latitude, longitude, category, radius, index), True
+
+        key, center_lat, center_lon, fetch_radius, category_name = recommender.flight_plan(
+            latitude, longitude, category, radius
+        )
+
+        try:
+            if recommender.tile_cache is not None:
+                restaurants, fetched = await self.flights.do(
+                    key, lambda: self.search_tiles(center_lat, center_lon, fetch_radius, category_name)
+                )
+            else:
+                query = recommender.build_overpass_query(center_lat, center_lon, category_name, radius=fetch_radius)
+                restaurants, fetched = await self.flights.do(key, lambda: self.fetch_restaurants(query))
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.error(f"Error calling Overpass API: {e!r}")
+            return [], False
+        except Exception as e:
+            logger.error(f"Error processing Overpass data: {e}")
+            return [], False
+
+        if counts is not None:
+            merge_counts(counts, fetched)
+        return restaurants, True
+
+    async def score_nearby(self, latitude, longitude, category, radius):
+        """
+        Score nearby restaurants, shrinking the radius while the fetch is cut
+
+        See RestaurantRecommender.score_nearby.
+
+        Returns:
+            Tuple of (TopKScorer holding the best restaurants, False if the
+            Overpass call failed or its result may still be cut, radius
+            searched)
+        """
+        recommender = self.recommender
+
+        while True:
+            scorer = recommender.new_scorer(latitude, longitude, category, radius)
+            counts = {}
+            restaurants, found = await self.nearby_restaurants(latitude, longitude, category, radius, counts)
+            scorer.extend(restaurants)
+            scorer.flush()
+            cut = is_truncated(counts, recommender.max_elements)
+            if not found or not cut or radius <= recommender.radius_min:
+                break
+            radius = max(radius // 2, recommender.radius_min)
+            logger.info(f"Search reached the element limit, retrying within {radius}m")
+
+        return scorer, found and not cut, radius
+
+    async def score_adaptive(self, latitude, longitude, category=None):
+        """
+        Score nearby restaurants, growing the radius until enough are found
+
+        See RestaurantRecommender.score_adaptive.
+
+        Returns:
+            Tuple of (TopKScorer holding the best restaurants, False if the
+            Overpass call failed or its result may be cut)
+        """
+        recommender = self.recommender
+        area, radius = recommender.adaptive_start(latitude, longitude, category)
+
+        while True:
+            scorer, complete, searched = await self.score_nearby(latitude, longitude, category, radius)
+            # Stop on upstream errors and cut results rather than retrying with a larger radius
+            if (not complete or searched < radius or scorer.matched >= recommender.max_results
+                    or radius >= recommender.radius_max):
+                break
+            radius = min(radius * 2, recommender.radius_max)
+
+        recommender.remember_radius(area, searched, scorer, complete)
+        return scorer, complete
+
+    async def get_recommendations(self, latitude, longitude, category=None):
+        """
+        Get top restaurant recommendations
+
+        Args:
+            latitude: User's latitude
+            longitude: User's longitude
+            category: Restaurant category filter
+
+        Returns:
+            List of recommended restaurants with scores
+        """
+        recommender = self.recommender
+        cache_key, cached = recommender.cached_recommendations(latitude, longitude, category)
+        if cached is not None:
+            return cached
+
+        if recommender.adaptive_radius:
+            scorer, complete = await self.score_adaptive(latitude, longitude, category)
+        else:
+            scorer, complete, _ = await self.score_nearby(latitude, longitude, category, recommender.search_radius)
+
+        return recommender.finish_recommendations(scorer, complete, cache_key)
@@ -0,0 +1 @@
+"""Benchmarks for the recommendation pipeline (see bench/pipeline.py)"""
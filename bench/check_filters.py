@@ -0,0 +1,90 @@
+"""
+Check that local category matching agrees with the Overpass tag filters
+
+The local index, the hot-region snapshot and prefetched candidates are
+filtered with CategoryMatcher.matches, live searches with the tag_filter
+sent to Overpass. This evaluates each tag_filter string the way Overpass
+does and compares it with matches() on the benchmark fixtures and on tag
+combinations where the two have disagreed before (values under the other
+key, semicolon lists, spaces).
+
+Usage:
+    python -m bench.check_filters
+"""
+import json
+import re
+import sys
+
+from bench import fixtures
+from categories import ALL_FOOD, MATCHERS
+
+# ["key"~"regex"] and [~"key regex"~"value regex"]
+KEY_FILTER = re.compile(r'^\["(?P<key>[^"]+)"~"(?P<value>[^"]*)"\]$')
+KEY_REGEX_FILTER = re.compile(r'^\[~"(?P<keys>[^"]+)"~"(?P<value>[^"]*)"\]$')
+
+EDGE_CASES = [
+    {'amenity': 'restaurant', 'cuisine': 'chinese'},
+    {'amenity': 'restaurant', 'cuisine': 'noodle;chinese'},
+    {'amenity': 'restaurant', 'cuisine': 'noodle; chinese'},
+    {'amenity': 'restaurant', 'cuisine': 'taiwanese_hot_pot'},
+    {'amenity': 'cafe;bar'},
+    {'amenity': 'bar;cafe'},
+    {'amenity': 'fast_food', 'cuisine': 'burger;chicken'},
+    {'amenity': 'restaurant', 'cuisine': 'fast_food'},
+    {'amenity': 'pizza'},
+    {'amenity': 'ice_cream'},
+    {'amenity': 'bar', 'cuisine': 'coffee_shop'},
+    {'amenity': 'pub', 'cuisine': 'Chinese'},
+    {'cuisine': 'sushi'},
+    {'amenity': 'restaurant'},
+    {},
+]
+
+def overpass_filter(tag_filter):
+    """
+    Build a predicate evaluating an Overpass tag filter
+
+    Returns:
+        Function taking a tags dict and returning True if the filter matches
+    """
+    match = KEY_FILTER.match(tag_filter)
+    if match:
+        key, value = re.compile(f"^{re.escape(match['key'])}$"), re.compile(match['value'])
+    else:
+        match = KEY_REGEX_FILTER.match(tag_filter)
+        if not match:
+            raise ValueError(f"Unsupported tag filter {tag_filter}")
+        key, value = re.compile(match['keys']), re.compile(match['value'])
+
+    return lambda tags: any(key.search(k) and value.search(v) for k, v in tags.items())
+
+def load_tags():
+    """Get the tags of every fixture element plus the edge cases"""
+    tags = [dict(case) for case in EDGE_CASES]
+    for name in fixtures.SCENARIOS:
+        body, _ = fixtures.load(name)
+        tags += [element.get('tags', {}) for element in json.loads(body)['elements']]
+    return tags
+
+def check(tags):
+    """
+    Compare matches() with the tag filter of every category
+
+    Returns:
+        Number of disagreements
+    """
+    mismatches = 0
+    for matcher in list(MATCHERS.values()) + [ALL_FOOD]:
+        expected = overpass_filter(matcher.tag_filter)
+        wrong = [t for t in tags if bool(expected(t)) != matcher.matches(t)]
+        wrong += [t for t in tags
+                  if matcher.matches_values(t.get('amenity', ''), t.get('cuisine', '')) != matcher.matches(t)]
+        for t in wrong[:5]:
+            print(f"{matcher.name}: {t} (Overpass {bool(expected(t))}, local {matcher.matches(t)})")
+        mismatches += len(wrong)
+
+    print(f"{mismatches} disagreement(s) over {len(tags)} tag sets and {len(MATCHERS) + 1} filters")
+    return mismatches
+
+if __name__ == '__main__':
+    sys.exit(1 if check(load_tags()) else 0)
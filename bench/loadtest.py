@@ -0,0 +1,413 @@
+"""
+Load test of the webhook endpoint under gunicorn
+
+Starts `gunicorn app:app` (or async_app:app) for each worker configuration with Overpass and
+the LINE Messaging API replaced by local stand-ins (see bench/stub_server.py;
+Overpass answers each query with the fixture elements in its area, up to the
+query's limits), then drives /callback with validly signed synthetic LINE
+events (follow, category text, location) from concurrent clients and reports
+throughput, latency percentiles and error rates.
+
+A configuration is WORKERSxTHREADS, optionally with ':async' to enable
+ASYNC_WEBHOOK (e.g. 2x8:async), or WORKERS:aiohttp to run async_app on
+aiohttp workers (e.g. 2:aiohttp). Any other setting can be passed with --env.
+
+Usage:
+    python -m bench.loadtest run [--config 1x8 --config 2x8:async --config 2:aiohttp ...]
+                                 [--duration SECONDS] [--clients N]
+                                 [--overpass-latency SECONDS] [--line-latency SECONDS]
+                                 [--env KEY=VALUE ...] [--output FILE]
+    python -m bench.loadtest compare BASELINE.json CANDIDATE.json [--threshold PCT]
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import itertools
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from bench import fixtures
+from bench.pipeline import git_revision, percentile
+from bench.stub_server import StubLine, StubOverpass
+from config import Config
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CHANNEL_SECRET = 'loadtest-channel-secret'
+CHANNEL_TOKEN = 'loadtest-channel-token'
+
+# Relative frequency of each event type
+EVENT_MIX = {'follow': 1, 'text': 4, 'location': 3}
+
+def sign(body):
+    """Compute the X-Line-Signature of a webhook body"""
+    digest = hmac.new(CHANNEL_SECRET.encode('utf-8'), body, hashlib.sha256).digest()
+    return base64.b64encode(digest).decode('utf-8')
+
+class EventFactory:
+    """Synthetic LINE webhook events from a fixed pool of users"""
+
+    def __init__(self, latitude, longitude, users=200, spread_m=1000, seed=0):
+        """
+        Args:
+            latitude: Center of the shared locations
+            longitude: Center of the shared locations
+            users: Number of distinct user IDs
+            spread_m: Maximum distance of a shared location from the center
+            seed: Random seed
+        """
+        self.latitude = latitude
+        self.longitude = longitude
+        self.users = [f"U{i:032x}" for i in range(users)]
+        self.spread_m = spread_m
+        self.categories = list(Config.CATEGORIES)
+        self.kinds = [kind for kind, weight in EVENT_MIX.items() for _ in range(weight)]
+        self._ids = itertools.count()
+        self._rnd = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def event(self):
+        """Build one event dict as LINE sends it"""
+        with self._lock:
+            n = next(self._ids)
+            kind = self._rnd.choice(self.kinds)
+            user_id = self._rnd.choice(self.users)
+            category = self._rnd.choice(self.categories)
+            dlat, dlon = (self._rnd.uniform(-1, 1) * self.spread_m / 111320 for _ in range(2))
+
+        event = {
+            'replyToken': f"{n:032x}",
+            'source': {'type': 'user', 'userId': user_id},
+            'timestamp': int(time.time() * 1000),
+            'mode': 'active',
+            'webhookEventId': f"LT{n:024d}",
+            'deliveryContext': {'isRedelivery': False},
+        }
+        if kind == 'follow':
+            event['type'] = 'follow'
+        elif kind == 'text':
+            event.update(type='message', message={'type': 'text', 'id': str(n), 'text': category})
+        else:
+            event.update(type='message', message={
+                'type': 'location', 'id': str(n), 'title': None, 'address': '',
+                'latitude': self.latitude + dlat, 'longitude': self.longitude + dlon,
+            })
+        return event
+
+    def payload(self, events_per_payload=1):
+        """Build a signed webhook request body"""
+        body = json.dumps({
+            'destination': 'Uloadtest',
+            'events': [self.event() for _ in range(events_per_payload)],
+        }).encode('utf-8')
+        return body, sign(body)
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def parse_config(spec):
+    """
+    Parse 'WORKERSxTHREADS[:async]' or 'WORKERS:aiohttp'
+
+    Returns:
+        Tuple of (workers, threads, mode), mode being '', 'async' or 'aiohttp'
+    """
+    sizes, _, mode = spec.partition(':')
+    if mode not in ('', 'async', 'aiohttp'):
+        raise ValueError(f"Unknown mode in {spec!r}")
+    workers, _, threads = sizes.partition('x')
+    return int(workers), int(threads or 1), mode
+
+class AppServer:
+    """gunicorn running app:app (or async_app:app) against the stand-ins"""
+
+    def __init__(self, workers, threads, mode, overpass_url, line_url, env=None):
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        if mode == 'aiohttp':
+            app, worker_options = 'async_app:app', ['--worker-class', 'aiohttp.GunicornWebWorker']
+        else:
+            app, worker_options = 'app:app', ['--threads', str(threads), '--worker-class', 'gthread']
+        self.command = [
+            sys.executable, '-m', 'gunicorn', app,
+            '--bind', f"127.0.0.1:{self.port}",
+            '--workers', str(workers), *worker_options, '--log-level', 'warning',
+        ]
+        self.env = dict(os.environ)
+        self.env.update({
+            'LINE_CHANNEL_SECRET': CHANNEL_SECRET,
+            'LINE_CHANNEL_ACCESS_TOKEN': CHANNEL_TOKEN,
+            'LINE_API_ENDPOINT': line_url,
+            'OVERPASS_API_URL': overpass_url,
+            'OVERPASS_MIRRORS': '',
+            'ASYNC_WEBHOOK': 'true' if mode == 'async' else 'false',
+            'POI_REFRESH_ENABLED': 'false',
+        })
+        self.env.update(env or {})
+        self.process = None
+        self.log = None
+
+    def start(self, timeout=30):
+        self.log = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(
+            self.command, cwd=REPO_DIR, env=self.env, stdout=self.log, stderr=subprocess.STDOUT
+        )
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                break
+            try:
+                if requests.get(self.url + '/', timeout=1).status_code == 200:
+                    return self
+            except requests.exceptions.RequestException:
+                pass
+            time.sleep(0.2)
+        self.stop()
+        raise RuntimeError(f"gunicorn did not start:\n{self.output()}")
+
+    def output(self):
+        self.log.seek(0)
+        return self.log.read().decode('utf-8', 'replace')[-4000:]
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+def drive(url, factory, clients, duration, events_per_payload, timeout):
+    """
+    Send webhook requests from concurrent clients for a fixed time
+
+    Each client sends its next request as soon as the previous one returns.
+
+    Returns:
+        Tuple of (latencies in ms of answered requests, status counts,
+        client errors, elapsed seconds)
+    """
+    latencies = []
+    statuses = {}
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client():
+        session = requests.Session()
+        own_latencies = []
+        own_statuses = {}
+        own_errors = 0
+        while time.monotonic() < deadline:
+            body, signature = factory.payload(events_per_payload)
+            start = time.perf_counter()
+            try:
+                response = session.post(
+                    url + '/callback', data=body, timeout=timeout,
+                    headers={'Content-Type': 'application/json', 'X-Line-Signature': signature}
+                )
+            except requests.exceptions.RequestException:
+                own_errors += 1
+                continue
+            own_latencies.append((time.perf_counter() - start) * 1000)
+            own_statuses[response.status_code] = own_statuses.get(response.status_code, 0) + 1
+        with lock:
+            latencies.extend(own_latencies)
+            for status, count in own_statuses.items():
+                statuses[status] = statuses.get(status, 0) + count
+            errors[0] += own_errors
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, statuses, errors[0], time.perf_counter() - start
+
+def wait_for_replies(line, settle=1.0, timeout=30):
+    """Wait until the stand-in stops receiving replies (async mode finishes the queue)"""
+    deadline = time.monotonic() + timeout
+    last = -1
+    while time.monotonic() < deadline:
+        current = line.replies + line.pushes
+        if current == last:
+            return
+        last = current
+        time.sleep(settle)
+
+def run_config(spec, args, body, latitude, longitude):
+    """
+    Load-test one worker configuration
+
+    Returns:
+        Result dict
+    """
+    workers, threads, mode = parse_config(spec)
+    env = dict(item.split('=', 1) for item in args.env)
+    factory = EventFactory(latitude, longitude, users=args.users, seed=args.seed)
+
+    with StubOverpass(body, latency=args.overpass_latency, spatial=True) as overpass, \
+            StubLine(latency=args.line_latency) as line, \
+            AppServer(workers, threads, mode, overpass.url, line.base_url, env) as app:
+        if args.warmup:
+            drive(app.url, factory, args.clients, args.warmup, args.events_per_payload, args.timeout)
+            wait_for_replies(line)
+        overpass_before = overpass.calls
+        replies_before = line.replies + line.pushes
+
+        latencies, statuses, client_errors, elapsed = drive(
+            app.url, factory, args.clients, args.duration, args.events_per_payload, args.timeout
+        )
+        if mode:
+            # Events are still being handled after the last response
+            wait_for_replies(line)
+        overpass_calls = overpass.calls - overpass_before
+        replies = line.replies + line.pushes - replies_before
+
+    latencies.sort()
+    answered = len(latencies)
+    total = answered + client_errors
+    failed = client_errors + sum(count for status, count in statuses.items() if status != 200)
+    return {
+        'workers': workers,
+        'threads': threads,
+        'mode': mode or 'sync',
+        'clients': args.clients,
+        'requests': total,
+        'events': answered * args.events_per_payload,
+        'requests_per_sec': round(answered / elapsed, 1),
+        'events_per_sec': round(answered * args.events_per_payload / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50), 2) if latencies else None,
+        'p90_ms': round(percentile(latencies, 90), 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99), 2) if latencies else None,
+        'max_ms': round(latencies[-1], 2) if latencies else None,
+        'error_rate': round(failed / total, 4) if total else None,
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        'client_errors': client_errors,
+        'replies': replies,
+        'overpass_calls': overpass_calls,
+    }
+
+def print_report(report):
+    print(f"\n{'config':<12}{'req/s':>9}{'events/s':>10}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}"
+          f"{'max ms':>9}{'errors':>8}{'replies':>9}{'overpass':>10}")
+    for spec, result in report['configs'].items():
+        print(f"{spec:<12}{result['requests_per_sec']:>9}{result['events_per_sec']:>10}"
+              f"{result['p50_ms']:>9}{result['p90_ms']:>9}{result['p99_ms']:>9}{result['max_ms']:>9}"
+              f"{result['error_rate'] * 100:>7.1f}%{result['replies']:>9}{result['overpass_calls']:>10}")
+
+def compare(baseline, candidate, threshold):
+    """
+    Print per-configuration changes between two runs
+
+    A drop in throughput, or a rise in p99 latency, above threshold percent
+    is reported as a regression, as is a higher error rate.
+
+    Returns:
+        Number of regressions
+    """
+    regressions = 0
+    print(f"\n{'config':<12}{'req/s base':>12}{'req/s new':>11}{'change':>9}{'p99 change':>12}{'errors':>14}")
+    for spec, result in candidate['configs'].items():
+        base = baseline['configs'].get(spec)
+        if base is None:
+            continue
+        rps_change = (result['requests_per_sec'] / base['requests_per_sec'] - 1) * 100 if base['requests_per_sec'] else 0.0
+        p99_change = (result['p99_ms'] / base['p99_ms'] - 1) * 100 if base['p99_ms'] else 0.0
+        flag = ''
+        if -rps_change > threshold or p99_change > threshold or result['error_rate'] > base['error_rate']:
+            flag = '  REGRESSION'
+            regressions += 1
+        errors = f"{base['error_rate'] * 100:.1f}->{result['error_rate'] * 100:.1f}%"
+        print(f"{spec:<12}{base['requests_per_sec']:>12}{result['requests_per_sec']:>11}"
+              f"{rps_change:>+8.1f}%{p99_change:>+11.1f}%{errors:>14}{flag}")
+
+    print(f"\n{regressions} regression(s) above {threshold}%")
+    return regressions
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Load-test /callback under gunicorn")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help="Run the load test")
+    run_parser.add_argument('--config', action='append',
+                            help="Worker configuration WORKERSxTHREADS[:async] or WORKERS:aiohttp (default: 1x8, 2x8, 2x8:async)")
+    run_parser.add_argument('--duration', type=float, default=15.0, help="Measured seconds per configuration")
+    run_parser.add_argument('--warmup', type=float, default=3.0, help="Unmeasured seconds before measuring")
+    run_parser.add_argument('--clients', type=int, default=16, help="Concurrent clients")
+    run_parser.add_argument('--users', type=int, default=200, help="Distinct LINE user IDs")
+    run_parser.add_argument('--events-per-payload', type=int, default=1)
+    run_parser.add_argument('--scenario', choices=sorted(fixtures.SCENARIOS), default='taipei_main',
+                            help="Overpass fixture and location the events are sent from")
+    run_parser.add_argument('--overpass-latency', type=float, default=0.2,
+                            help="Seconds the stand-in Overpass server waits before answering")
+    run_parser.add_argument('--line-latency', type=float, default=0.05,
+                            help="Seconds the stand-in LINE API waits before answering")
+    run_parser.add_argument('--timeout', type=float, default=30.0, help="Client request timeout")
+    run_parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                            help="Extra environment for the app (e.g. REPLY_DEADLINE=1)")
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--output', help="Write the report as JSON")
+
+    compare_parser = commands.add_parser('compare', help="Compare two reports")
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('candidate')
+    compare_parser.add_argument('--threshold', type=float, default=10.0,
+                                help="Percent change reported as a regression")
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'compare':
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.candidate) as f:
+            candidate = json.load(f)
+        return 1 if compare(baseline, candidate, args.threshold) else 0
+
+    latitude, longitude, _ = fixtures.SCENARIOS[args.scenario]
+    body, source = fixtures.load(args.scenario)
+
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'scenario': args.scenario,
+        'fixture': source,
+        'overpass_latency': args.overpass_latency,
+        'line_latency': args.line_latency,
+        'duration': args.duration,
+        'env': args.env,
+        'configs': {},
+    }
+    for spec in args.config or ['1x8', '2x8', '2x8:async']:
+        print(f"Running {spec} for {args.duration:g}s with {args.clients} clients...")
+        report['configs'][spec] = run_config(spec, args, body, latitude, longitude)
+
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\nWrote {args.output}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,303 @@
+"""
+Per-stage benchmark of the recommendation pipeline
+
+Replays Overpass fixtures (see bench/fixtures.py) through a local stand-in
+server and reports latency percentiles, peak allocations and throughput for
+each stage. Results are written as JSON so two runs can be compared.
+
+Usage:
+    python -m bench.pipeline run [--scenario NAME ...] [--iterations N]
+                                 [--upstream-latency SECONDS] [--output FILE]
+    python -m bench.pipeline compare BASELINE.json CANDIDATE.json [--threshold PCT]
+"""
+import argparse
+import json
+import logging
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from bench import fixtures
+from bench.stub_server import StubOverpass
+from message_templates import column_cache, create_carousel_message
+from opening_hours import minute_of_week
+from overpass import OverpassClient, iter_elements
+from recommender import RestaurantRecommender
+from scoring import TopKScorer
+from utils import logger
+
+CATEGORY = '中式'
+
+class BodyResponse:
+    """Minimal stand-in for a streamed requests.Response over in-memory bytes"""
+
+    def __init__(self, body):
+        self.body = body
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.body), chunk_size):
+            yield self.body[i:i + chunk_size]
+
+def percentile(sorted_values, pct):
+    """Get a percentile of sorted values (nearest rank)"""
+    index = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def measure(fn, iterations, warmup=3):
+    """
+    Time a stage and trace its allocations
+
+    Args:
+        fn: Function running the stage once
+        iterations: Timed runs
+        warmup: Untimed runs before timing
+
+    Returns:
+        Dict of latency percentiles (ms), throughput and allocations
+    """
+    for _ in range(warmup):
+        fn()
+
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter_ns()
+        fn()
+        timings.append((time.perf_counter_ns() - start) / 1e6)
+    timings.sort()
+    mean = sum(timings) / len(timings)
+
+    # Allocations are traced in a separate run so tracing does not skew timings
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'iterations': iterations,
+        'mean_ms': round(mean, 4),
+        'p50_ms': round(percentile(timings, 50), 4),
+        'p90_ms': round(percentile(timings, 90), 4),
+        'p99_ms': round(percentile(timings, 99), 4),
+        'ops_per_sec': round(1000 / mean, 1) if mean else None,
+        'peak_alloc_kb': round(peak / 1024, 1),
+    }
+
+def make_recommender(url):
+    """Create a recommender that only talks to the stand-in server, with caches off"""
+    recommender = RestaurantRecommender()
+    recommender.client = OverpassClient([url], retries=0)
+    recommender.tile_cache = None
+    recommender.recommendation_cache = None
+    recommender.local_index = None
+    recommender.adaptive_radius = False
+    return recommender
+
+def run_scenario(name, iterations, threads, requests_per_run, latency=0.0):
+    """
+    Benchmark every stage for one scenario
+
+    Returns:
+        Dict with the fixture source, candidate count and per-stage results
+    """
+    latitude, longitude, _ = fixtures.SCENARIOS[name]
+    body, source = fixtures.load(name)
+
+    with StubOverpass(body, latency=latency) as stub:
+        recommender = make_recommender(stub.url)
+        query = recommender.build_overpass_query(latitude, longitude, CATEGORY)
+        restaurants, _ = recommender.fetch_restaurants(query)
+        minute = minute_of_week()
+
+        def top_k():
+            scorer = TopKScorer(latitude, longitude, CATEGORY, recommender.search_radius,
+                                recommender.max_results, minute=minute)
+            scorer.extend(restaurants)
+            return scorer.results()
+
+        recommendations = recommender.get_recommendations(latitude, longitude, CATEGORY)
+
+        def carousel_cold():
+            column_cache.clear()
+            create_carousel_message(recommendations).as_json_dict()
+
+        stages = {
+            'build_overpass_query': lambda: recommender.build_overpass_query(latitude, longitude, CATEGORY),
+            'parse': lambda: sum(1 for _ in iter_elements(BodyResponse(body))),
+            'fetch_parse': lambda: recommender.fetch_restaurants(query),
+            'calculate_score': lambda: [
+                recommender.calculate_score(r, latitude, longitude, CATEGORY, minute) for r in restaurants
+            ],
+            'top_k_scoring': top_k,
+            'get_recommendations': lambda: recommender.get_recommendations(latitude, longitude, CATEGORY),
+            'carousel_cold': carousel_cold,
+            'carousel_warm': lambda: create_carousel_message(recommendations).as_json_dict(),
+        }
+
+        results = {}
+        for stage, fn in stages.items():
+            results[stage] = measure(fn, iterations)
+
+        results['throughput'] = measure_throughput(
+            recommender, latitude, longitude, threads, requests_per_run
+        )
+
+    return {
+        'fixture': source,
+        'fixture_bytes': len(body),
+        'candidates': len(restaurants),
+        'stages': results,
+    }
+
+def measure_throughput(recommender, latitude, longitude, threads, requests_per_run):
+    """
+    Run concurrent get_recommendations calls at nearby, distinct points
+
+    Points are spread wider than the single-flight grid so calls are not
+    collapsed into one fetch.
+    """
+    rnd = random.Random(0)
+    grid = recommender.flight_grid
+    points = [
+        (latitude + rnd.randint(-20, 20) * grid * 1.5, longitude + rnd.randint(-20, 20) * grid * 1.5)
+        for _ in range(requests_per_run)
+    ]
+
+    latencies = []
+
+    def call(point):
+        start = time.perf_counter()
+        recommender.get_recommendations(point[0], point[1], CATEGORY)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(call, points))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+
+    return {
+        'threads': threads,
+        'requests': requests_per_run,
+        'requests_per_sec': round(requests_per_run / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50), 4),
+        'p99_ms': round(percentile(latencies, 99), 4),
+    }
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_report(report):
+    for name, scenario in report['scenarios'].items():
+        print(f"\n{name} ({scenario['fixture']}, {scenario['candidates']} candidates)")
+        print(f"  {'stage':<22}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'ops/s':>10}{'peak KB':>10}")
+        for stage, result in scenario['stages'].items():
+            if stage == 'throughput':
+                continue
+            print(f"  {stage:<22}{result['p50_ms']:>10.3f}{result['p90_ms']:>10.3f}"
+                  f"{result['p99_ms']:>10.3f}{result['ops_per_sec']:>10}{result['peak_alloc_kb']:>10}")
+        throughput = scenario['stages']['throughput']
+        print(f"  throughput: {throughput['requests_per_sec']} req/s with {throughput['threads']} threads "
+              f"(p50 {throughput['p50_ms']:.1f} ms, p99 {throughput['p99_ms']:.1f} ms)")
+
+def compare(baseline, candidate, threshold):
+    """
+    Print per-stage changes between two runs
+
+    Args:
+        baseline: Report dict of the reference run
+        candidate: Report dict of the new run
+        threshold: Percent slowdown of p50 or p99 reported as a regression
+
+    Returns:
+        Number of regressions
+    """
+    regressions = 0
+    for name, scenario in candidate['scenarios'].items():
+        base_scenario = baseline['scenarios'].get(name)
+        if base_scenario is None:
+            continue
+        print(f"\n{name}")
+        print(f"  {'stage':<22}{'p50 base':>10}{'p50 new':>10}{'change':>9}{'p99 change':>12}")
+        for stage, result in scenario['stages'].items():
+            base = base_scenario['stages'].get(stage)
+            if base is None or stage == 'throughput':
+                continue
+            p50_change = (result['p50_ms'] / base['p50_ms'] - 1) * 100 if base['p50_ms'] else 0.0
+            p99_change = (result['p99_ms'] / base['p99_ms'] - 1) * 100 if base['p99_ms'] else 0.0
+            flag = ''
+            if p50_change > threshold or p99_change > threshold:
+                flag = '  REGRESSION'
+                regressions += 1
+            print(f"  {stage:<22}{base['p50_ms']:>10.3f}{result['p50_ms']:>10.3f}"
+                  f"{p50_change:>+8.1f}%{p99_change:>+11.1f}%{flag}")
+
+        base_rps = base_scenario['stages']['throughput']['requests_per_sec']
+        new_rps = scenario['stages']['throughput']['requests_per_sec']
+        print(f"  throughput: {base_rps} -> {new_rps} req/s")
+
+    print(f"\n{regressions} regression(s) above {threshold}%")
+    return regressions
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark the recommendation pipeline")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help="Run the benchmarks")
+    run_parser.add_argument('--scenario', action='append', choices=sorted(fixtures.SCENARIOS),
+                            help="Scenario to run (default: all)")
+    run_parser.add_argument('--iterations', type=int, default=50)
+    run_parser.add_argument('--threads', type=int, default=8)
+    run_parser.add_argument('--requests', type=int, default=200,
+                            help="get_recommendations calls in the throughput run")
+    run_parser.add_argument('--upstream-latency', type=float, default=0.0,
+                            help="Seconds the stand-in Overpass server waits before answering")
+    run_parser.add_argument('--output', help="Write the report as JSON")
+
+    compare_parser = commands.add_parser('compare', help="Compare two reports")
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('candidate')
+    compare_parser.add_argument('--threshold', type=float, default=10.0,
+                                help="Percent slowdown reported as a regression")
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'compare':
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.candidate) as f:
+            candidate = json.load(f)
+        return 1 if compare(baseline, candidate, args.threshold) else 0
+
+    # Per-request log lines would dominate the timings
+    logger.setLevel(logging.WARNING)
+
+    report = {
+        'revision': git_revision(),
+        'upstream_latency': args.upstream_latency,
+        'python': platform.python_version(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'scenarios': {},
+    }
+    for name in args.scenario or list(fixtures.SCENARIOS):
+        report['scenarios'][name] = run_scenario(
+            name, args.iterations, args.threads, args.requests, args.upstream_latency
+        )
+
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\nWrote {args.output}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,239 @@
+"""Local stand-ins for the Overpass and LINE Messaging APIs and Redis"""
+import json
+import re
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils import calculate_distance
+
+# Areas and output limits of the queries built by RestaurantRecommender
+AROUND = re.compile(r'\(around:([\d.]+),([-\d.]+),([-\d.]+)\)')
+BBOX = re.compile(r'\(([-\d.]+),([-\d.]+),([-\d.]+),([-\d.]+)\)->')
+OUTPUT = re.compile(r'(node|way|relation)\.food;out [^;]*qt (\d+);')
+CELL_OUTPUT = re.compile(
+    r'node\.food\(([-\d.]+),([-\d.]+),([-\d.]+),([-\d.]+)\)->\.n;.*?out count;'
+    r'\.n out [^;]*qt (\d+);\.w out [^;]*qt (\d+);'
+)
+
+class StubServer:
+    """HTTP server answering every POST via respond(), after a fixed latency"""
+
+    def __init__(self, latency=0.0, host='127.0.0.1', port=0):
+        """
+        Args:
+            latency: Seconds to wait before answering
+            host: Interface to listen on
+            port: Port to listen on (0 picks a free port)
+        """
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body are written separately; avoid delayed-ACK stalls
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                request_body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                with stub._lock:
+                    stub.calls += 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+                content_type, body = stub.respond(self.path, request_body)
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self._thread = None
+
+    def respond(self, path, request_body):
+        """
+        Build the response to a POST
+
+        Returns:
+            Tuple of (content type, body bytes)
+        """
+        raise NotImplementedError
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+def position(element):
+    """Get the (lat, lon) of a node, or the center of a way or relation"""
+    if 'lat' in element:
+        return element['lat'], element['lon']
+    return element['center']['lat'], element['center']['lon']
+
+class StubOverpass(StubServer):
+    """
+    Overpass stand-in answering every query with the same response
+
+    With spatial=True it answers like Overpass instead: only the elements
+    inside the query's around or bbox area, each output capped at its limit
+    (per cell, after an 'out count' element, for tile queries). The tag
+    filter is ignored.
+
+    Usage:
+        with StubOverpass(body, latency=0.05) as stub:
+            client = OverpassClient([stub.url])
+    """
+
+    def __init__(self, body, latency=0.0, host='127.0.0.1', port=0, spatial=False):
+        """
+        Args:
+            body: Response body (bytes)
+            latency: Seconds to wait before answering
+            host: Interface to listen on
+            port: Port to listen on (0 picks a free port)
+            spatial: Filter the body's elements by area and limit per query
+        """
+        super().__init__(latency, host, port)
+        self.body = body
+        self.elements = json.loads(body)['elements'] if spatial else None
+        self._responses = {}
+
+    @property
+    def url(self):
+        return self.base_url + '/api/interpreter'
+
+    def respond(self, path, request_body):
+        if self.elements is None:
+            return 'application/json', self.body
+
+        query = urllib.parse.parse_qs(request_body.decode('utf-8'))['data'][0]
+        with self._lock:
+            body = self._responses.get(query)
+        if body is None:
+            body = json.dumps({'elements': self.select(query)}, ensure_ascii=False).encode('utf-8')
+            with self._lock:
+                self._responses[query] = body
+        return 'application/json', body
+
+    def select(self, query):
+        """
+        Get the elements Overpass would return for a query
+
+        Returns:
+            List of elements inside the query area, up to each output's
+            limit (per cell, after a 'count' element, for tile queries)
+        """
+        cells = CELL_OUTPUT.findall(query)
+        if cells:
+            selected = []
+            for *bbox, node_limit, way_limit in cells:
+                south, west, north, east = map(float, bbox)
+                inside = [element for element in self.elements
+                          if south <= position(element)[0] <= north and west <= position(element)[1] <= east]
+                nodes = [element for element in inside if element['type'] == 'node']
+                ways = [element for element in inside if element['type'] == 'way']
+                selected.append({'type': 'count', 'id': 0, 'tags': {
+                    'nodes': str(len(nodes)), 'ways': str(len(ways)), 'relations': '0',
+                    'total': str(len(nodes) + len(ways)),
+                }})
+                selected += nodes[:int(node_limit)] + ways[:int(way_limit)]
+            return selected
+
+        around = AROUND.search(query)
+        if around:
+            radius, latitude, longitude = map(float, around.groups())
+            inside = lambda lat, lon: calculate_distance(latitude, longitude, lat, lon) * 1000 <= radius
+        else:
+            south, west, north, east = map(float, BBOX.search(query).groups())
+            inside = lambda lat, lon: south <= lat <= north and west <= lon <= east
+
+        selected = []
+        for element_type, limit in OUTPUT.findall(query):
+            matches = [element for element in self.elements
+                       if element['type'] == element_type and inside(*position(element))]
+            selected += matches[:int(limit)]
+        return selected
+
+class StubLine(StubServer):
+    """
+    LINE Messaging API stand-in accepting reply and push messages
+
+    Usage:
+        with StubLine(latency=0.03) as line:
+            LineBotApi(token, endpoint=line.base_url)
+    """
+
+    def __init__(self, latency=0.0, host='127.0.0.1', port=0):
+        super().__init__(latency, host, port)
+        self.replies = 0
+        self.pushes = 0
+
+    def respond(self, path, request_body):
+        with self._lock:
+            if path.endswith('/message/reply'):
+                self.replies += 1
+            elif path.endswith('/message/push'):
+                self.pushes += 1
+        return 'application/json', b'{}'
+
+class StubRedis:
+    """
+    In-process stand-in for the Redis commands used by the session store
+    and the webhook event log (GET, SET with EX/NX, DELETE)
+
+    Usage:
+        RedisSessionStore(ttl, client=StubRedis())
+    """
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def _live(self, key):
+        entry = self._data.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= time.monotonic():
+            del self._data[key]
+            return None
+        return entry
+
+    def get(self, key):
+        with self._lock:
+            entry = self._live(key)
+            return entry[0] if entry is not None else None
+
+    def set(self, key, value, ex=None, nx=False):
+        if isinstance(value, str):
+            value = value.encode('utf-8')
+        elif not isinstance(value, bytes):
+            value = str(value).encode('utf-8')
+        with self._lock:
+            if nx and self._live(key) is not None:
+                return None
+            self._data[key] = (value, time.monotonic() + ex if ex else None)
+            return True
+
+    def delete(self, *keys):
+        with self._lock:
+            return sum(self._data.pop(key, None) is not None for key in keys)
@@ -0,0 +1,274 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+class TTLCache:
+    """Thread-safe LRU cache with per-entry time-to-live"""
+    
+    def __init__(self, max_size, ttl):
+        """
+        Args:
+            max_size: Maximum number of entries kept (least recently used are evicted)
+            ttl: Time-to-live in seconds for each entry
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, key, default=None):
+        """
+        Get a cached value
+        
+        Args:
+            key: Cache key
+            default: Value returned on miss or expiry
+        
+        Returns:
+            Cached value or default
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+    
+    def set(self, key, value, ttl=None):
+        """
+        Store a value, evicting the least recently used entries if full
+        
+        Args:
+            key: Cache key
+            value: Value to store
+            ttl: Optional TTL override in seconds
+        """
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+    
+    def pop(self, key, default=None):
+        """Remove a key and return its value (or default)"""
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return entry[1] if entry else default
+    
+    def clear(self):
+        """Remove all entries"""
+        with self._lock:
+            self._data.clear()
+    
+    def __len__(self):
+        return len(self._data)
+    
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            return entry is not None and entry[0] >= time.monotonic()
+    
+    def stats(self):
+        """Get cache statistics"""
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one execution"""
+    
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+            self.started = False
+            self.sinks = []
+    
+    def __init__(self):
+        self._calls = {}
+        self._streams = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.executions = 0
+        self.collapsed = 0
+    
+    def do(self, key, fn):
+        """
+        Run fn once per key at a time; concurrent callers share its result
+        
+        Args:
+            key: Hashable key identifying the work
+            fn: Function without arguments doing the work
+        
+        Returns:
+            The result of fn (raises its exception for every waiting caller)
+        """
+        with self._lock:
+            self.calls += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._Call()
+                self._calls[key] = call
+                self.executions += 1
+            else:
+                self.collapsed += 1
+        
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        
+        return call.result
+    
+    def stream(self, key, source, sink):
+        """
+        Feed the items of one shared iteration to every concurrent caller
+        
+        Callers that arrive before the leader has produced its first item
+        join the flight; later callers start a new flight of their own.
+        
+        Args:
+            key: Hashable key identifying the work
+            source: Function without arguments returning an iterable
+            sink: Function called with each item (runs on the leader's thread)
+        
+        Returns:
+            The return value of the source iterator (a generator's return
+            value), shared with every caller
+        """
+        with self._lock:
+            self.calls += 1
+            call = self._streams.get(key)
+            leader = call is None or call.started
+            if leader:
+                call = self._Call()
+                if key not in self._streams:
+                    self._streams[key] = call
+                self.executions += 1
+            else:
+                self.collapsed += 1
+            call.sinks.append(sink)
+        
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        
+        try:
+            sinks = None
+            iterator = iter(source())
+            while True:
+                try:
+                    item = next(iterator)
+                except StopIteration as stop:
+                    call.result = stop.value
+                    break
+                if sinks is None:
+                    with self._lock:
+                        call.started = True
+                        sinks = list(call.sinks)
+                for s in sinks:
+                    s(item)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                call.started = True
+                if self._streams.get(key) is call:
+                    del self._streams[key]
+            call.done.set()
+        
+        return call.result
+    
+    def stats(self):
+        """Get call statistics"""
+        with self._lock:
+            return {
+                'in_flight': len(self._calls) + len(self._streams),
+                'calls': self.calls,
+                'executions': self.executions,
+                'collapsed': self.collapsed,
+            }
+
+class AsyncSingleFlight:
+    """asyncio counterpart of SingleFlight.do for one event loop"""
+    
+    def __init__(self):
+        self._calls = {}
+        self.calls = 0
+        self.executions = 0
+        self.collapsed = 0
+    
+    async def do(self, key, fn):
+        """
+        Run fn once per key at a time; concurrent callers share its result
+        
+        The shared task keeps running if a caller is cancelled.
+        
+        Args:
+            key: Hashable key identifying the work
+            fn: Coroutine function without arguments doing the work
+        
+        Returns:
+            The result of fn (raises its exception for every waiting caller)
+        """
+        self.calls += 1
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            self.executions += 1
+            task.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            self.collapsed += 1
+        return await asyncio.shield(task)
+    
+    def _finish(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Retrieve the error so a task whose callers were all cancelled is not reported
+        if not task.cancelled():
+            task.exception()
+    
+    def stats(self):
+        """Get call statistics"""
+        return {
+            'in_flight': len(self._calls),
+            'calls': self.calls,
+            'executions': self.executions,
+            'collapsed': self.collapsed,
+        }
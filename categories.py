@@ -0,0 +1,199 @@
+import re
+import sys
+from functools import lru_cache
+from config import Config
+
+def split_tag_values(value):
+    """
+    Split a multi-valued OSM tag ('chinese;noodle') into its values
+
+    Args:
+        value: Raw tag value
+
+    Returns:
+        Tuple of stripped, non-empty values
+    """
+    if not value:
+        return ()
+    if ';' not in value:
+        return (value.strip(),)
+    return tuple(v.strip() for v in value.split(';') if v.strip())
+
+class CategoryMatcher:
+    """Amenity/cuisine filter for one category, compiled once at startup"""
+
+    def __init__(self, name, amenities, cuisines, scored=True):
+        """
+        Args:
+            name: Category name
+            amenities: Amenity values of the category
+            cuisines: Cuisine values of the category
+            scored: Whether matches add to the category score ('全部' does not)
+        """
+        self.name = name
+        self.amenities = frozenset(sys.intern(a) for a in amenities)
+        self.cuisines = frozenset(sys.intern(c) for c in cuisines)
+        self.scored = scored
+
+        # One alternation for partial cuisine matches ('hot_pot' in 'taiwanese_hot_pot')
+        self.partial_pattern = None
+        if self.cuisines:
+            alternatives = sorted(self.cuisines, key=len, reverse=True)
+            self.partial_pattern = re.compile('|'.join(re.escape(c) for c in alternatives))
+
+        # The Overpass filter and the local check use the same keys and value regex
+        self.filter_keys, filter_values = self._filter_parts(amenities, cuisines)
+        self.value_pattern = re.compile(filter_values)
+        if len(self.filter_keys) == 1:
+            self.tag_filter = f'["{self.filter_keys[0]}"~"{filter_values}"]'
+        else:
+            self.tag_filter = f'[~"^({"|".join(self.filter_keys)})$"~"{filter_values}"]'
+
+        # Per-value results are cached; the value vocabulary of OSM is small
+        self.cuisine_match = lru_cache(maxsize=4096)(self._cuisine_match)
+        self.value_match = lru_cache(maxsize=4096)(self._value_match)
+
+    @staticmethod
+    def _filter_parts(amenities, cuisines):
+        """
+        Get the tag keys and value regex of the category filter
+
+        Returns:
+            Tuple of (keys, value regex); a tag passes if one of the keys has
+            a value matching the regex
+        """
+        if not cuisines:
+            return ('amenity',), '^({})$'.format('|'.join(amenities))
+
+        # Either key may hold any value; values also match inside semicolon lists
+        values = '|'.join(dict.fromkeys(list(amenities) + list(cuisines)))
+        return ('amenity', 'cuisine'), f'(^|;) *({values}) *(;|$)'
+
+    def matches(self, tags):
+        """
+        Check whether tags pass the category filter (evaluates tag_filter locally)
+
+        Args:
+            tags: OSM tags of a restaurant
+
+        Returns:
+            True if the restaurant belongs to the category
+        """
+        return any(self.value_match(tags.get(key, '')) for key in self.filter_keys)
+
+    def matches_values(self, amenity, cuisine):
+        """
+        Check whether amenity/cuisine tag values pass the category filter
+
+        Args:
+            amenity: Amenity tag value
+            cuisine: Cuisine tag value
+
+        Returns:
+            True if the restaurant belongs to the category
+        """
+        if self.value_match(amenity or ''):
+            return True
+        return len(self.filter_keys) > 1 and self.value_match(cuisine or '')
+
+    def _value_match(self, value):
+        """Check whether one tag value matches the filter's value regex"""
+        return self.value_pattern.search(value) is not None
+
+    def amenity_match(self, amenity):
+        """Get the score match value of an amenity (1.0 or 0.0)"""
+        return 1.0 if self.scored and amenity in self.amenities else 0.0
+
+    def _cuisine_match(self, cuisine):
+        """Get the match value of a cuisine tag (1.0 full, 0.5 partial, 0.0 none)"""
+        values = split_tag_values(cuisine)
+        if any(v in self.cuisines for v in values):
+            return 1.0
+        if self.partial_pattern is not None and self.partial_pattern.search(cuisine):
+            return 0.5
+        return 0.0
+
+    def score_match(self, amenity, cuisine):
+        """
+        Get the category match used in scoring
+
+        Args:
+            amenity: Amenity tag value
+            cuisine: Cuisine tag value
+
+        Returns:
+            1.0 for a full match, 0.5 for a partial cuisine match, 0.0 otherwise
+        """
+        if not self.scored:
+            return 0.0
+        return max(self.amenity_match(amenity), self.cuisine_match(cuisine))
+
+def compile_category(name):
+    """
+    Compile a category of Config.CATEGORIES into a matcher
+
+    Entries like 'restaurant;chinese' mean a restaurant with that cuisine, so
+    their cuisine part is matched as a cuisine value.
+
+    Args:
+        name: Category name
+
+    Returns:
+        CategoryMatcher
+    """
+    amenities = []
+    cuisines = list(Config.CUISINE_TAGS.get(name, []))
+    for entry in Config.CATEGORIES[name]:
+        if ';' in entry:
+            cuisine = entry.split(';', 1)[1]
+            if cuisine not in cuisines:
+                cuisines.append(cuisine)
+        else:
+            amenities.append(entry)
+
+    return CategoryMatcher(name, amenities, cuisines, scored=(name != '全部'))
+
+def compile_all_food():
+    """
+    Compile a matcher covering every category
+
+    Returns:
+        CategoryMatcher for the union of all categories
+    """
+    amenities = []
+    cuisines = []
+    for matcher in MATCHERS.values():
+        amenities += [a for a in sorted(matcher.amenities) if a not in amenities]
+        cuisines += [c for c in sorted(matcher.cuisines) if c not in cuisines]
+    return CategoryMatcher('*', amenities, cuisines, scored=False)
+
+# Compiled once at import
+MATCHERS = {name: compile_category(name) for name in Config.CATEGORIES}
+ALL_FOOD = compile_all_food()
+
+def get_matcher(category=None):
+    """
+    Get the compiled matcher of a category
+
+    Args:
+        category: Category name (unknown or empty means '全部', ALL_FOOD.name
+            means every category)
+
+    Returns:
+        CategoryMatcher
+    """
+    if category == ALL_FOOD.name:
+        return ALL_FOOD
+    return MATCHERS.get(category) or MATCHERS['全部']
+
+def category_key(category=None):
+    """
+    Normalize a category for use in cache keys
+
+    Args:
+        category: Category name
+
+    Returns:
+        Name of the matcher get_matcher returns for the category
+    """
+    return get_matcher(category).name
@@ -10,17 +10,119 @@ class Config:
     # LINE Messaging API
     LINE_CHANNEL_ACCESS_TOKEN = os.getenv('LINE_CHANNEL_ACCESS_TOKEN')
     LINE_CHANNEL_SECRET = os.getenv('LINE_CHANNEL_SECRET')
+    LINE_API_ENDPOINT = os.getenv('LINE_API_ENDPOINT', 'https://api.line.me')  # overridden in load tests
+    
+    # Fraction of webhook bodies written to the log (0 = never, 1 = always)
+    LOG_WEBHOOK_BODY_SAMPLE_RATE = float(os.getenv('LOG_WEBHOOK_BODY_SAMPLE_RATE', 0.0))
+    
+    # Webhook processing: when enabled, /callback queues events and returns at once
+    ASYNC_WEBHOOK = os.getenv('ASYNC_WEBHOOK', 'false').lower() == 'true'
+    WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', 8))
+    WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', 100))
+    WEBHOOK_ENQUEUE_TIMEOUT = float(os.getenv('WEBHOOK_ENQUEUE_TIMEOUT', 0.5))  # seconds
+    EVENT_WORKERS = int(os.getenv('EVENT_WORKERS', 4))  # users of one payload handled concurrently
+    
+    # Reply deadline in seconds (0 = off): slower searches reply with a
+    # searching message and push the results later (uses push message quota)
+    REPLY_DEADLINE = float(os.getenv('REPLY_DEADLINE', 0))
+    PUSH_WORKERS = int(os.getenv('PUSH_WORKERS', 8))  # searches running in the background
+    
+    # Redelivered webhook events are dropped by webhookEventId (shared via Redis
+    # when SESSION_BACKEND is 'redis')
+    WEBHOOK_DEDUP_ENABLED = os.getenv('WEBHOOK_DEDUP_ENABLED', 'true').lower() == 'true'
+    WEBHOOK_DEDUP_TTL = int(os.getenv('WEBHOOK_DEDUP_TTL', 3600))  # seconds
+    WEBHOOK_DEDUP_MAX_EVENTS = int(os.getenv('WEBHOOK_DEDUP_MAX_EVENTS', 100000))
+    
+    # User sessions: 'memory' (per process) or 'redis' (shared between workers)
+    SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'memory')
+    REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+    SESSION_TTL = int(os.getenv('SESSION_TTL', 86400))  # seconds since last activity
+    SESSION_MAX_USERS = int(os.getenv('SESSION_MAX_USERS', 10000))
     
     # OpenStreetMap Overpass API
     OVERPASS_API_URL = os.getenv('OVERPASS_API_URL', 'https://overpass-api.de/api/interpreter')
+    OVERPASS_MIRRORS = [u.strip() for u in os.getenv('OVERPASS_MIRRORS', '').split(',') if u.strip()]
+    OVERPASS_TIMEOUT = float(os.getenv('OVERPASS_TIMEOUT', 30))  # seconds
+    OVERPASS_RETRIES = int(os.getenv('OVERPASS_RETRIES', 2))  # per endpoint, on 429/504
+    OVERPASS_BACKOFF = float(os.getenv('OVERPASS_BACKOFF', 0.5))  # retry backoff factor
+    OVERPASS_HEDGE_AFTER = float(os.getenv('OVERPASS_HEDGE_AFTER', 0))  # seconds, 0 = no hedging
+    OVERPASS_POOL_SIZE = int(os.getenv('OVERPASS_POOL_SIZE', 10))
+    OVERPASS_FAILURE_COOLDOWN = float(os.getenv('OVERPASS_FAILURE_COOLDOWN', 30))  # seconds
+    # Open connections of the shared aiohttp session of async_app (per upstream)
+    ASYNC_CONNECTION_LIMIT = int(os.getenv('ASYNC_CONNECTION_LIMIT', 100))
+    # Webhook events handled at once by async_app before it answers 503
+    ASYNC_MAX_EVENTS = int(os.getenv('ASYNC_MAX_EVENTS', 1000))
+    OVERPASS_MAX_ELEMENTS = int(os.getenv('OVERPASS_MAX_ELEMENTS', 1000))  # per output statement (tile cell) and element type
     
     # Recommendation settings
     SEARCH_RADIUS = int(os.getenv('SEARCH_RADIUS', 2000))  # meters (default: 2km)
     MAX_RESULTS = int(os.getenv('MAX_RESULTS', 5))  # number of restaurants to recommend
     
+    # Diverse results: one branch per chain, spaced apart, mixed amenity types
+    DIVERSITY_ENABLED = os.getenv('DIVERSITY_ENABLED', 'true').lower() == 'true'
+    DIVERSITY_POOL_FACTOR = int(os.getenv('DIVERSITY_POOL_FACTOR', 4))  # candidates kept per result
+    DIVERSITY_MIN_SPACING = int(os.getenv('DIVERSITY_MIN_SPACING', 50))  # meters (0 = off)
+    DIVERSITY_MAX_PER_AMENITY = int(os.getenv('DIVERSITY_MAX_PER_AMENITY', 3))  # 0 = off
+    
+    # Adaptive search radius: start small and double until MAX_RESULTS are found
+    ADAPTIVE_RADIUS = os.getenv('ADAPTIVE_RADIUS', 'false').lower() == 'true'
+    ADAPTIVE_RADIUS_MIN = int(os.getenv('ADAPTIVE_RADIUS_MIN', 500))  # meters; also the floor for searches shrunk at the element limit
+    ADAPTIVE_RADIUS_MAX = int(os.getenv('ADAPTIVE_RADIUS_MAX', 5000))  # meters
+    ADAPTIVE_SHRINK_RATIO = int(os.getenv('ADAPTIVE_SHRINK_RATIO', 8))  # results per MAX_RESULTS before shrinking
+    ADAPTIVE_DENSITY_PRECISION = int(os.getenv('ADAPTIVE_DENSITY_PRECISION', 5))  # geohash chars per area
+    ADAPTIVE_DENSITY_TTL = int(os.getenv('ADAPTIVE_DENSITY_TTL', 86400))  # seconds
+    ADAPTIVE_DENSITY_MAX_AREAS = int(os.getenv('ADAPTIVE_DENSITY_MAX_AREAS', 5000))
+    
+    # Finished recommendation lists cached per snapped location
+    RECOMMENDATION_CACHE_ENABLED = os.getenv('RECOMMENDATION_CACHE_ENABLED', 'true').lower() == 'true'
+    RECOMMENDATION_CACHE_GRID = float(os.getenv('RECOMMENDATION_CACHE_GRID', 0.0005))  # degrees (~55m)
+    RECOMMENDATION_CACHE_TTL = int(os.getenv('RECOMMENDATION_CACHE_TTL', 300))  # seconds
+    RECOMMENDATION_CACHE_MAX_ENTRIES = int(os.getenv('RECOMMENDATION_CACHE_MAX_ENTRIES', 10000))
+    
+    # Candidate prefetch after a location share (category taps are scored locally)
+    PREFETCH_ENABLED = os.getenv('PREFETCH_ENABLED', 'true').lower() == 'true'
+    PREFETCH_CONCURRENCY = int(os.getenv('PREFETCH_CONCURRENCY', 4))
+    PREFETCH_TTL = int(os.getenv('PREFETCH_TTL', 600))  # seconds
+    PREFETCH_MAX_USERS = int(os.getenv('PREFETCH_MAX_USERS', 500))
+    PREFETCH_WAIT = float(os.getenv('PREFETCH_WAIT', 10))  # seconds
+    
+    # Cached carousel columns (per restaurant)
+    CAROUSEL_CACHE_SIZE = int(os.getenv('CAROUSEL_CACHE_SIZE', 5000))
+    CAROUSEL_CACHE_TTL = int(os.getenv('CAROUSEL_CACHE_TTL', 86400))  # seconds
+    
+    # Overpass tile cache (results cached per geohash cell + category)
+    TILE_CACHE_ENABLED = os.getenv('TILE_CACHE_ENABLED', 'true').lower() == 'true'
+    TILE_GEOHASH_PRECISION = int(os.getenv('TILE_GEOHASH_PRECISION', 6))  # ~1.2km x 0.6km cells
+    TILE_CACHE_TTL = int(os.getenv('TILE_CACHE_TTL', 3600))  # seconds
+    TILE_CACHE_MAX_TILES = int(os.getenv('TILE_CACHE_MAX_TILES', 2000))
+    
+    # Concurrent searches within the same grid cell share one Overpass fetch
+    SINGLEFLIGHT_GRID = float(os.getenv('SINGLEFLIGHT_GRID', 0.001))  # degrees (~110m)
+    
+    # POI data source: 'overpass' (live API) or 'local' (offline index, Overpass fallback)
+    POI_BACKEND = os.getenv('POI_BACKEND', 'overpass')
+    POI_INDEX_PATH = os.getenv('POI_INDEX_PATH', 'data/poi_index.bin')
+    POI_INDEX_CELL_SIZE = float(os.getenv('POI_INDEX_CELL_SIZE', 0.01))  # degrees
+    # Cells holding places count as covered; searches touching other cells use Overpass
+    POI_INDEX_COVERAGE_CELL_SIZE = float(os.getenv('POI_INDEX_COVERAGE_CELL_SIZE', 0.05))  # degrees
+    
+    # Background refresh of the most queried regions into a warm-start snapshot
+    POI_REFRESH_ENABLED = os.getenv('POI_REFRESH_ENABLED', 'false').lower() == 'true'
+    POI_SNAPSHOT_PATH = os.getenv('POI_SNAPSHOT_PATH', 'data/poi_snapshot.bin')
+    POI_REFRESH_INTERVAL = int(os.getenv('POI_REFRESH_INTERVAL', 3600))  # seconds
+    POI_HOT_REGIONS = os.getenv('POI_HOT_REGIONS', '')  # always refreshed, 'lat,lon;lat,lon'
+    POI_HOT_REGION_COUNT = int(os.getenv('POI_HOT_REGION_COUNT', 20))
+    POI_HOT_REGION_PRECISION = int(os.getenv('POI_HOT_REGION_PRECISION', 5))  # geohash (~4.9km)
+    POI_SNAPSHOT_MAX_ELEMENTS = int(os.getenv('POI_SNAPSHOT_MAX_ELEMENTS', 20000))  # per region
+    
     # Scoring weights (no rating from OSM, so we adjust)
     WEIGHT_DISTANCE = float(os.getenv('WEIGHT_DISTANCE', 0.7))  # Increased from 0.3
     WEIGHT_CATEGORY = float(os.getenv('WEIGHT_CATEGORY', 0.3))  # Increased from 0.2
+    WEIGHT_OPEN = float(os.getenv('WEIGHT_OPEN', 0.1))  # Bonus for places open now
+    
+    # Opening hours: drop places whose opening_hours say they are closed now
+    OPEN_NOW_FILTER = os.getenv('OPEN_NOW_FILTER', 'true').lower() == 'true'
+    TIMEZONE = os.getenv('TIMEZONE', 'Asia/Taipei')
     
     # OSM amenity tags for restaurant categories (in Traditional Chinese)
     CATEGORIES = {
@@ -47,6 +149,12 @@ class Config:
         '小吃': ['street_food', 'noodle', 'dumpling']
     }
     
+    # OSM tags read by the recommender and message templates
+    OSM_TAGS = (
+        'name', 'amenity', 'cuisine', 'addr:city', 'addr:street',
+        'addr:housenumber', 'phone', 'website', 'opening_hours', 'brand'
+    )
+    
     @staticmethod
     def validate():
         """Validate required configuration"""
@@ -0,0 +1,199 @@
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from linebot.models import MessageEvent, TextMessage, LocationMessage, FollowEvent
+from utils import logger
+
+# Events the bot handles: (event type, message type or None) -> handler name
+EVENT_HANDLERS = {
+    (FollowEvent, None): 'follow',
+    (MessageEvent, TextMessage): 'text',
+    (MessageEvent, LocationMessage): 'location',
+}
+
+def event_handler_name(event):
+    """
+    Get the name of the handler for an event (see EVENT_HANDLERS)
+
+    Args:
+        event: Parsed webhook event
+
+    Returns:
+        Handler name, or None if the bot does not handle the event
+    """
+    message = getattr(event, 'message', None) if isinstance(event, MessageEvent) else None
+    return EVENT_HANDLERS.get((type(event), type(message) if message is not None else None))
+
+def event_source_key(event):
+    """
+    Get the key events are ordered by (the user, or the chat without one)
+
+    Args:
+        event: Parsed webhook event
+
+    Returns:
+        Hashable key, or None if the event has no source
+    """
+    source = getattr(event, 'source', None)
+    if source is None:
+        return None
+    return (getattr(source, 'user_id', None) or getattr(source, 'group_id', None)
+            or getattr(source, 'room_id', None))
+
+def group_events(events):
+    """
+    Split a payload into per-user groups, keeping event order within a group
+
+    Args:
+        events: List of parsed webhook events
+
+    Returns:
+        List of event lists, in order of each group's first event
+    """
+    groups = {}
+    for i, event in enumerate(events):
+        key = event_source_key(event)
+        groups.setdefault(i if key is None else key, []).append(event)
+    return list(groups.values())
+
+class EventBatchRunner:
+    """
+    Runs the events of one payload, one user per thread
+
+    A user's events run in order (a location share before the category tap
+    that follows it); different users run concurrently on a bounded pool,
+    so a payload takes about as long as its slowest user.
+    """
+
+    def __init__(self, handle_event, workers=4):
+        """
+        Args:
+            handle_event: Function called with each event
+            workers: Maximum number of users handled concurrently
+        """
+        self.handle_event = handle_event
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='webhook-event')
+
+    def run_group(self, events):
+        """
+        Handle one user's events in order
+
+        Returns:
+            Number of events that raised
+        """
+        failed = 0
+        for event in events:
+            try:
+                self.handle_event(event)
+            except Exception as e:
+                logger.error(f"Error handling webhook event: {e}")
+                failed += 1
+        return failed
+
+    def run(self, events):
+        """
+        Handle the events of a payload and wait for all of them
+
+        The first group runs on the calling thread.
+
+        Args:
+            events: List of parsed webhook events
+
+        Returns:
+            Number of events that raised
+        """
+        groups = group_events(events)
+        if not groups:
+            return 0
+
+        futures = [self._executor.submit(self.run_group, group) for group in groups[1:]]
+        failed = self.run_group(groups[0])
+        return failed + sum(future.result() for future in futures)
+
+class WebhookDispatcher:
+    """Bounded in-process worker pool for webhook payloads"""
+
+    def __init__(self, handle_events, workers=8, queue_size=100, enqueue_timeout=0.5):
+        """
+        Args:
+            handle_events: Function called with the events of each payload,
+                returning the number of events that failed
+            workers: Number of worker threads
+            queue_size: Maximum number of queued payloads
+            enqueue_timeout: Seconds to wait for queue space before rejecting
+        """
+        self.handle_events = handle_events
+        self.workers = workers
+        self.enqueue_timeout = enqueue_timeout
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._threads = []
+        self._pid = None
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.failed = 0
+
+    def _ensure_started(self):
+        """Start worker threads in the current process (lazily, so it is fork-safe)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._threads = []
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"webhook-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            self._pid = os.getpid()
+
+    def submit(self, events):
+        """
+        Queue the events of one webhook payload
+
+        Each payload is handed to handle_events by a single worker.
+
+        Args:
+            events: List of parsed webhook events
+
+        Raises:
+            queue.Full: If the queue stays full for enqueue_timeout seconds
+        """
+        self._ensure_started()
+        try:
+            self._queue.put(list(events), timeout=self.enqueue_timeout)
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            raise
+        with self._lock:
+            self.submitted += 1
+
+    def _run(self):
+        while True:
+            events = self._queue.get()
+            try:
+                failed = self.handle_events(events)
+            except Exception as e:
+                logger.error(f"Error handling webhook payload: {e}")
+                failed = len(events)
+            with self._lock:
+                self.failed += failed
+                self.completed += 1
+            self._queue.task_done()
+
+    def stats(self):
+        """Get queue depth and counters"""
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queue_depth': self._queue.qsize(),
+                'queue_size': self._queue.maxsize,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'failed': self.failed,
+            }
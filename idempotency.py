@@ -0,0 +1,143 @@
+import threading
+from config import Config
+from cache import TTLCache
+from utils import logger
+
+class MemoryEventLog:
+    """Per-process record of handled webhook event IDs with expiry"""
+
+    def __init__(self, ttl, max_events):
+        """
+        Args:
+            ttl: Seconds an event ID is remembered
+            max_events: Maximum number of event IDs kept
+        """
+        self._cache = TTLCache(max_events, ttl)
+        self._lock = threading.Lock()
+
+    def claim(self, event_id):
+        """
+        Record an event ID unless it was already seen
+
+        Returns:
+            True if the event is new and should be handled
+        """
+        with self._lock:
+            if self._cache.get(event_id) is not None:
+                return False
+            self._cache.set(event_id, True)
+            return True
+
+    def release(self, event_id):
+        """Forget an event ID so a redelivery is handled again"""
+        self._cache.pop(event_id)
+
+class RedisEventLog:
+    """Record of handled webhook event IDs shared between workers"""
+
+    def __init__(self, ttl, url=None, client=None, prefix='webhook-event:'):
+        """
+        Args:
+            ttl: Seconds an event ID is remembered
+            url: Redis URL (ignored when client is given)
+            client: Redis-compatible client (e.g. redis.Redis, or
+                bench.stub_server.StubRedis for local runs)
+            prefix: Key prefix for event entries
+        """
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def claim(self, event_id):
+        """
+        Record an event ID unless it was already seen
+
+        Returns:
+            True if the event is new and should be handled
+        """
+        return bool(self.client.set(self.prefix + event_id, 1, nx=True, ex=self.ttl))
+
+    def release(self, event_id):
+        """Forget an event ID so a redelivery is handled again"""
+        self.client.delete(self.prefix + event_id)
+
+class EventDeduplicator:
+    """Drops webhook events whose webhookEventId was already handled"""
+
+    def __init__(self, log):
+        """
+        Args:
+            log: MemoryEventLog or RedisEventLog
+        """
+        self.log = log
+        self._lock = threading.Lock()
+        self.accepted = 0
+        self.suppressed = 0
+        self.redeliveries = 0
+
+    def filter(self, events):
+        """
+        Keep only events not seen before
+
+        Events without a webhookEventId are always kept.
+
+        Args:
+            events: List of parsed webhook events
+
+        Returns:
+            List of new events
+        """
+        fresh = []
+        suppressed = redeliveries = 0
+        for event in events:
+            context = getattr(event, 'delivery_context', None)
+            if context is not None and context.is_redelivery:
+                redeliveries += 1
+
+            event_id = getattr(event, 'webhook_event_id', None)
+            if event_id and not self.log.claim(event_id):
+                suppressed += 1
+                continue
+            fresh.append(event)
+
+        with self._lock:
+            self.accepted += len(fresh)
+            self.suppressed += suppressed
+            self.redeliveries += redeliveries
+        if suppressed:
+            logger.info(f"Suppressed {suppressed} duplicate webhook event(s)")
+        return fresh
+
+    def release(self, events):
+        """Forget events that were claimed but could not be handled"""
+        for event in events:
+            event_id = getattr(event, 'webhook_event_id', None)
+            if event_id:
+                self.log.release(event_id)
+        with self._lock:
+            self.accepted -= len(events)
+
+    def stats(self):
+        """Get accepted/suppressed counters"""
+        with self._lock:
+            return {
+                'accepted': self.accepted,
+                'suppressed': self.suppressed,
+                'redeliveries': self.redeliveries,
+            }
+
+def create_event_deduplicator():
+    """
+    Create a deduplicator backed by the store selected by Config.SESSION_BACKEND
+
+    Returns:
+        EventDeduplicator
+    """
+    if Config.SESSION_BACKEND == 'redis':
+        log = RedisEventLog(Config.WEBHOOK_DEDUP_TTL, url=Config.REDIS_URL)
+    else:
+        log = MemoryEventLog(Config.WEBHOOK_DEDUP_TTL, Config.WEBHOOK_DEDUP_MAX_EVENTS)
+    return EventDeduplicator(log)
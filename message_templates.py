@@ -2,12 +2,49 @@ from linebot.models import (
     TextSendMessage, TemplateSendMessage, CarouselTemplate, CarouselColumn,
     URIAction, MessageAction, QuickReply, QuickReplyButton, LocationAction
 )
+from linebot.models.base import Base
 from utils import format_distance
 from config import Config
+from cache import TTLCache
 import urllib.parse
 
-def create_welcome_message():
-    """Create welcome message with quick reply buttons"""
+# Distance-independent parts of carousel columns, keyed by OSM id
+column_cache = TTLCache(Config.CAROUSEL_CACHE_SIZE, Config.CAROUSEL_CACHE_TTL)
+
+class PrerenderedMessage(Base):
+    """
+    Message sent as a JSON payload that was built beforehand
+    
+    LineBotApi serializes each message with as_json_dict(), which here returns
+    the payload as is instead of walking the model objects on every reply.
+    The payload may be shared between replies and must not be modified.
+    """
+    
+    def __init__(self, payload, **kwargs):
+        """
+        Args:
+            payload: Message JSON dict (as built by as_json_dict)
+        """
+        super().__init__(**kwargs)
+        self.payload = payload
+    
+    def as_json_dict(self):
+        return self.payload
+
+def prerender(message):
+    """
+    Serialize a message once for sending in many replies
+    
+    Args:
+        message: LINE message object
+    
+    Returns:
+        PrerenderedMessage holding the message's payload
+    """
+    return PrerenderedMessage(message.as_json_dict())
+
+def build_welcome_message():
+    """Build welcome message with quick reply buttons"""
     quick_reply = QuickReply(items=[
         QuickReplyButton(action=LocationAction(label="📍 分享我的位置")),
         QuickReplyButton(action=MessageAction(label="🍽️ 全部", text="全部")),
@@ -23,8 +60,8 @@ def create_welcome_message():
     
     return message
 
-def create_category_selection_message():
-    """Create category selection message with quick reply"""
+def build_category_selection_message():
+    """Build category selection message with quick reply"""
     quick_reply = QuickReply(items=[
         QuickReplyButton(action=MessageAction(label="🍽️ 全部", text="全部")),
         QuickReplyButton(action=MessageAction(label="☕ 飲料", text="飲料")),
@@ -52,73 +89,38 @@ def create_carousel_message(recommendations):
         recommendations: List of recommended restaurants
     
     Returns:
-        TemplateSendMessage with CarouselTemplate
+        PrerenderedMessage of a carousel template message
     """
     if not recommendations:
-        return TextSendMessage(text="抱歉，附近沒有找到符合條件的餐廳。請試試其他類別或位置。")
+        return NO_RESULTS_MESSAGE
     
     columns = []
     for restaurant in recommendations:
-        # Format distance
-        distance_text = format_distance(restaurant['distance_km'])
-        
-        # Create Google Maps URL (using restaurant name for better results)
-        # We use the name + address (city/street) to make it more accurate
-        search_query = f"{restaurant['name']}"
-        if restaurant.get('address') and restaurant['address'] != '地址未提供':
-             # Extract just the city part if possible, or use full address
-             # This helps find the specific branch
-             search_query += f" {restaurant['address']}"
-             
-        encoded_query = urllib.parse.quote(search_query)
-        maps_url = f"https://www.google.com/maps/search/?api=1&query={encoded_query}"
-        
-        # Truncate name if too long
-        name = restaurant['name']
-        if len(name) > 40:
-            name = name[:37] + "..."
-        
-        # Truncate address if too long
-        address = restaurant['address']
-        if len(address) > 60:
-            address = address[:57] + "..."
+        title, details, actions = get_column_parts(restaurant)
         
-        # Build info text (distance + address + cuisine if available)
-        info_parts = [f"📍 {distance_text}"]
-        if address != '地址未提供':
-            info_parts.append(address)
-        if restaurant.get('cuisine'):
-            info_parts.append(f"🍽️ {restaurant['cuisine']}")
+        # Only the distance differs between users
+        info_parts = [f"📍 {format_distance(restaurant['distance_km'])}"]
+        if details:
+            info_parts.append(details)
         
-        info_text = '\n'.join(info_parts)
-        
-        # Create column
+        # Create column; the cached action payloads are attached as is
         column = CarouselColumn(
-            title=name,
-            text=info_text,
-            actions=[
-                URIAction(
-                    label="🗺️ 開啟地圖導航",
-                    uri=maps_url
-                ),
-                URIAction(
-                    label="📱 查看位置",
-                    uri=f"https://www.google.com/maps/search/?api=1&query={encoded_query}"
-                )
-            ]
-        )
+            title=title,
+            text='\n'.join(info_parts)
+        ).as_json_dict()
+        column['actions'] = actions
         columns.append(column)
     
-    carousel_template = CarouselTemplate(columns=columns)
     message = TemplateSendMessage(
         alt_text=f"為您推薦 {len(recommendations)} 家餐廳",
-        template=carousel_template
-    )
+        template=CarouselTemplate(columns=[])
+    ).as_json_dict()
+    message['template']['columns'] = columns
     
-    return message
+    return PrerenderedMessage(message)
 
-def create_location_request_message():
-    """Create message requesting user location"""
+def build_location_request_message():
+    """Build message requesting user location"""
     quick_reply = QuickReply(items=[
         QuickReplyButton(action=LocationAction(label="📍 分享我的位置"))
     ])
@@ -130,16 +132,16 @@ def create_location_request_message():
     
     return message
 
-def create_error_message():
-    """Create error message"""
+def build_error_message():
+    """Build error message"""
     message = TextSendMessage(
         text="抱歉，系統發生錯誤。請稍後再試。😔"
     )
     
     return message
 
-def create_searching_message(category=None):
-    """Create searching message"""
+def build_searching_message(category=None):
+    """Build searching message"""
     if category and category != '全部':
         text = f"正在搜尋附近的{category}餐廳...🔍"
     else:
@@ -147,3 +149,105 @@ def create_searching_message(category=None):
     
     message = TextSendMessage(text=text)
     return message
+
+def build_column_parts(restaurant):
+    """
+    Build the distance-independent parts of a carousel column
+    
+    Args:
+        restaurant: Recommended restaurant
+    
+    Returns:
+        Tuple of (title, details text, action payloads)
+    """
+    # Create Google Maps URL (using restaurant name for better results)
+    # We use the name + address (city/street) to make it more accurate
+    search_query = f"{restaurant['name']}"
+    if restaurant.get('address') and restaurant['address'] != '地址未提供':
+         # Extract just the city part if possible, or use full address
+         # This helps find the specific branch
+         search_query += f" {restaurant['address']}"
+         
+    encoded_query = urllib.parse.quote(search_query)
+    maps_url = f"https://www.google.com/maps/search/?api=1&query={encoded_query}"
+    
+    # Truncate name if too long
+    name = restaurant['name']
+    if len(name) > 40:
+        name = name[:37] + "..."
+    
+    # Truncate address if too long
+    address = restaurant['address']
+    if len(address) > 60:
+        address = address[:57] + "..."
+    
+    # Build info text (address + cuisine if available)
+    detail_parts = []
+    if address != '地址未提供':
+        detail_parts.append(address)
+    if restaurant.get('cuisine'):
+        detail_parts.append(f"🍽️ {restaurant['cuisine']}")
+    
+    actions = [
+        URIAction(
+            label="🗺️ 開啟地圖導航",
+            uri=maps_url
+        ).as_json_dict(),
+        URIAction(
+            label="📱 查看位置",
+            uri=maps_url
+        ).as_json_dict()
+    ]
+    
+    return name, '\n'.join(detail_parts), actions
+
+def get_column_parts(restaurant):
+    """
+    Get the carousel column parts of a restaurant, from cache if possible
+    
+    Args:
+        restaurant: Recommended restaurant
+    
+    Returns:
+        Tuple of (title, details text, action payloads)
+    """
+    key = restaurant.get('osm_id') or (restaurant['name'], restaurant['address'])
+    parts = column_cache.get(key)
+    if parts is None:
+        parts = build_column_parts(restaurant)
+        column_cache.set(key, parts)
+    return parts
+
+# Static messages are built once and shared between replies
+WELCOME_MESSAGE = prerender(build_welcome_message())
+CATEGORY_SELECTION_MESSAGE = prerender(build_category_selection_message())
+LOCATION_REQUEST_MESSAGE = prerender(build_location_request_message())
+ERROR_MESSAGE = prerender(build_error_message())
+NO_RESULTS_MESSAGE = prerender(TextSendMessage(text="抱歉，附近沒有找到符合條件的餐廳。請試試其他類別或位置。"))
+SEARCHING_MESSAGES = {
+    category: prerender(build_searching_message(category)) for category in Config.CATEGORIES
+}
+SEARCHING_MESSAGES[None] = SEARCHING_MESSAGES['全部']
+
+def create_welcome_message():
+    """Create welcome message with quick reply buttons"""
+    return WELCOME_MESSAGE
+
+def create_category_selection_message():
+    """Create category selection message with quick reply"""
+    return CATEGORY_SELECTION_MESSAGE
+
+def create_location_request_message():
+    """Create message requesting user location"""
+    return LOCATION_REQUEST_MESSAGE
+
+def create_error_message():
+    """Create error message"""
+    return ERROR_MESSAGE
+
+def create_searching_message(category=None):
+    """Create searching message"""
+    message = SEARCHING_MESSAGES.get(category)
+    if message is None:
+        message = build_searching_message(category)
+    return message
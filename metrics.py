@@ -0,0 +1,243 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _format_labels(pairs):
+    """Format (name, value) label pairs as '{name="value",...}'"""
+    if not pairs:
+        return ''
+    escaped = [
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    ]
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+def _format_value(value):
+    return repr(value) if isinstance(value, float) else str(value)
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        """Increase the counter of a label combination"""
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield self.name, _format_labels(list(zip(self.labelnames, labels))), value
+
+class Histogram:
+    """Cumulative histogram with optional labels"""
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        """Record one observation"""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                entry[index] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        """Observe the duration of a block in seconds"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def samples(self):
+        with self._lock:
+            values = {labels: list(entry) for labels, entry in self._values.items()}
+        for labels, entry in sorted(values.items()):
+            pairs = list(zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets, entry):
+                cumulative += count
+                yield self.name + '_bucket', _format_labels(pairs + [('le', _format_value(bound))]), cumulative
+            yield self.name + '_bucket', _format_labels(pairs + [('le', '+Inf')]), entry[-1]
+            yield self.name + '_sum', _format_labels(pairs), entry[-2]
+            yield self.name + '_count', _format_labels(pairs), entry[-1]
+
+class Registry:
+    """Metric registry rendered in the Prometheus text exposition format"""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collect):
+        """
+        Register a function read at scrape time
+
+        Args:
+            collect: Function returning (name, type, documentation, labels
+                dict, value) tuples, for values kept elsewhere (cache stats)
+        """
+        self._collectors.append(collect)
+
+    def render(self):
+        """
+        Render every metric
+
+        Returns:
+            Exposition text
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+
+        # Samples of one metric must be grouped, even across collectors
+        families = {}
+        for collect in self._collectors:
+            for name, metric_type, documentation, labels, value in collect():
+                if value is None:
+                    continue
+                family = families.setdefault(name, [
+                    f"# HELP {name} {documentation}",
+                    f"# TYPE {name} {metric_type}",
+                ])
+                family.append(f"{name}{_format_labels(list(labels.items()))} {_format_value(value)}")
+        for family in families.values():
+            lines += family
+
+        return '\n'.join(lines) + '\n'
+
+# Metrics of this process (per gunicorn worker)
+registry = Registry()
+
+STAGE_SECONDS = registry.histogram(
+    'food_bot_stage_seconds', "Time spent in each request stage", ['stage']
+)
+UPSTREAM_ERRORS = registry.counter(
+    'food_bot_upstream_errors_total', "Failed calls to upstream services", ['upstream']
+)
+WEBHOOK_REQUESTS = registry.counter(
+    'food_bot_webhook_requests_total', "Webhook requests by response status", ['status']
+)
+
+def timed(stage):
+    """
+    Time a block as one request stage
+
+    Usage:
+        with timed('scoring'):
+            ...
+    """
+    return STAGE_SECONDS.time(stage)
+
+def cache_samples(name, stats):
+    """
+    Convert TTLCache.stats() into collector samples
+
+    Args:
+        name: Cache label
+        stats: Dict with size, hits, misses (and optionally evictions)
+
+    Returns:
+        List of collector sample tuples
+    """
+    labels = {'cache': name}
+    samples = [
+        ('food_bot_cache_hits_total', 'counter', "Cache hits", labels, stats.get('hits')),
+        ('food_bot_cache_misses_total', 'counter', "Cache misses", labels, stats.get('misses')),
+        ('food_bot_cache_entries', 'gauge', "Entries currently cached", labels, stats.get('size')),
+    ]
+    if 'evictions' in stats:
+        samples.append(('food_bot_cache_evictions_total', 'counter', "Cache evictions", labels, stats['evictions']))
+    return samples
+
+def service_samples(recommender, flights, client, column_cache=None, prefetcher=None,
+                    refresher=None, deduplicator=None):
+    """
+    Collector samples of the parts both webhook apps share
+
+    Args:
+        recommender: RestaurantRecommender holding the caches
+        flights: SingleFlight or AsyncSingleFlight of the Overpass fetches
+        client: OverpassClient or AsyncOverpassClient
+        column_cache: Carousel column cache (optional)
+        prefetcher: CandidatePrefetcher (optional)
+        refresher: POIRefresher (optional)
+        deduplicator: Webhook event deduplicator (optional)
+
+    Returns:
+        List of collector sample tuples
+    """
+    samples = []
+    for name, cache in (('tile', recommender.tile_cache),
+                        ('recommendation', recommender.recommendation_cache),
+                        ('density', recommender.density_cache),
+                        ('carousel_column', column_cache)):
+        if cache is not None:
+            samples += cache_samples(name, cache.stats())
+    if prefetcher is not None:
+        samples += cache_samples('prefetch', prefetcher.stats())
+
+    samples.append(('food_bot_overpass_collapsed_total', 'counter',
+                    "Searches answered by another in-flight Overpass fetch", {}, flights.stats()['collapsed']))
+
+    overpass = client.stats()
+    samples.append(('food_bot_overpass_hedged_total', 'counter',
+                    "Overpass queries sent to a second endpoint", {}, overpass['hedged']))
+    for url, health in overpass['endpoints'].items():
+        samples.append(('food_bot_overpass_endpoint_healthy', 'gauge',
+                        "Whether an Overpass endpoint is in use", {'endpoint': url}, int(health['healthy'])))
+
+    if refresher is not None:
+        snapshot = refresher.stats()
+        samples.append(('food_bot_poi_snapshot_places', 'gauge',
+                        "Places in the hot-region snapshot", {}, snapshot['places']))
+        samples.append(('food_bot_poi_snapshot_age_seconds', 'gauge',
+                        "Seconds since the hot-region snapshot was built", {}, snapshot['age_seconds']))
+
+    if deduplicator is not None:
+        dedup = deduplicator.stats()
+        samples.append(('food_bot_webhook_duplicate_events_total', 'counter',
+                        "Webhook events dropped as already handled", {}, dedup['suppressed']))
+        samples.append(('food_bot_webhook_redeliveries_total', 'counter',
+                        "Webhook events marked as redelivered by LINE", {}, dedup['redeliveries']))
+    return samples
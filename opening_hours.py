@@ -0,0 +1,189 @@
+import re
+from bisect import bisect_right
+from datetime import datetime
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+from config import Config
+
+# Open-state values used in scoring
+OPEN = 1.0
+CLOSED = 0.0
+UNKNOWN = 0.5
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+WEEKDAYS = ('Mo', 'Tu', 'We', 'Th', 'Fr', 'Sa', 'Su')
+HOLIDAYS = ('PH', 'SH')
+
+DAY_TOKEN = r'(?:Mo|Tu|We|Th|Fr|Sa|Su|PH|SH)'
+DAY_LIST = re.compile(rf'{DAY_TOKEN}(?:\s*[-,]\s*{DAY_TOKEN})*')
+DAY_SELECTOR = re.compile(rf'^({DAY_LIST.pattern})(?=\s|$)\s*')
+TIME_SPAN = re.compile(r'^(\d{1,2}):(\d{2})\s*(?:-\s*(\d{1,2}):(\d{2})\+?|\+)$')
+
+class OpeningHours:
+    """Weekly opening intervals, in minutes since Monday 00:00"""
+
+    __slots__ = ('starts', 'ends')
+
+    def __init__(self, intervals):
+        """
+        Args:
+            intervals: Iterable of (start, end) minute-of-week pairs
+        """
+        merged = []
+        for start, end in sorted(intervals):
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        self.starts = tuple(start for start, _ in merged)
+        self.ends = tuple(end for _, end in merged)
+
+    def is_open(self, minute):
+        """Check whether a minute of the week falls in an opening interval"""
+        i = bisect_right(self.starts, minute) - 1
+        return i >= 0 and minute < self.ends[i]
+
+def minute_of_week(when=None):
+    """
+    Get the minute of the week (Monday 00:00 = 0) in Config.TIMEZONE
+
+    Args:
+        when: Aware datetime (default: now)
+
+    Returns:
+        Minute of the week
+    """
+    when = when or datetime.now(ZoneInfo(Config.TIMEZONE))
+    return when.weekday() * MINUTES_PER_DAY + when.hour * 60 + when.minute
+
+def _split_rules(value):
+    """
+    Split an opening_hours value into (rule, additional) pairs
+
+    Rules separated by ';' or '||' replace earlier rules for the days they
+    name; a rule after ',' that starts with a weekday adds to them.
+    """
+    rules = []
+    for part in re.split(r';|\|\|', value):
+        current = []
+        additional = False
+        for segment in part.split(','):
+            segment = segment.strip()
+            if not segment:
+                continue
+            # 'Mo,We 10:00-12:00' is one day list, 'Mo 10:00-12:00, We 09:00-11:00' two rules
+            if current and DAY_SELECTOR.match(segment) and not DAY_LIST.fullmatch(current[-1]):
+                rules.append((','.join(current), additional))
+                current = []
+                additional = True
+            current.append(segment)
+        if current:
+            rules.append((','.join(current), additional))
+    return rules
+
+def _parse_days(selector):
+    """Get the weekday numbers named by a selector like 'Mo-Fr,Su' (None for holidays only)"""
+    days = []
+    for item in re.split(r'\s*,\s*', selector):
+        bounds = re.split(r'\s*-\s*', item)
+        if any(bound in HOLIDAYS for bound in bounds):
+            continue
+        first = WEEKDAYS.index(bounds[0])
+        last = WEEKDAYS.index(bounds[-1])
+        days += [(first + i) % 7 for i in range((last - first) % 7 + 1)]
+    return days or None
+
+def _parse_times(spec):
+    """Get (start, end) minute-of-day pairs; end may pass midnight"""
+    spans = []
+    for item in spec.split(','):
+        match = TIME_SPAN.match(item.strip())
+        if not match:
+            raise ValueError(f"Unsupported opening_hours time: {item!r}")
+        start = int(match.group(1)) * 60 + int(match.group(2))
+        if match.group(3) is None:
+            end = MINUTES_PER_DAY  # open end ('18:00+')
+        else:
+            end = int(match.group(3)) * 60 + int(match.group(4))
+            if end <= start:
+                end += MINUTES_PER_DAY
+        spans.append((start, end))
+    return spans
+
+@lru_cache(maxsize=8192)
+def compile_opening_hours(value):
+    """
+    Compile an OSM opening_hours value into weekly intervals
+
+    Supports '24/7', weekday selectors (ranges, lists, wrapping ranges),
+    time spans including past midnight and open ends, 'off'/'closed', and
+    holiday rules (ignored). Month, week and date selectors, sunrise/sunset
+    and comments are not supported.
+
+    Args:
+        value: opening_hours tag value
+
+    Returns:
+        OpeningHours, or None if the value is empty or unsupported
+    """
+    value = (value or '').strip()
+    if not value:
+        return None
+    if value == '24/7':
+        return OpeningHours([(0, MINUTES_PER_WEEK)])
+
+    week = {day: [] for day in range(7)}
+    try:
+        for rule, additional in _split_rules(value):
+            days = list(range(7))
+            match = DAY_SELECTOR.match(rule)
+            if match:
+                days = _parse_days(match.group(1))
+                if days is None:
+                    continue  # public/school holiday rule
+                rule = rule[match.end():]
+
+            spec = rule.strip()
+            if spec in ('', 'open', '24/7'):
+                spans = [(0, MINUTES_PER_DAY)]
+            elif spec in ('off', 'closed'):
+                spans = []
+            else:
+                spans = _parse_times(spec)
+
+            for day in days:
+                if not additional:
+                    week[day] = []
+                week[day] += spans
+    except ValueError:
+        return None
+
+    intervals = []
+    for day, spans in week.items():
+        for start, end in spans:
+            start += day * MINUTES_PER_DAY
+            end += day * MINUTES_PER_DAY
+            if end > MINUTES_PER_WEEK:
+                # Sunday night spills into Monday morning
+                intervals.append((0, end - MINUTES_PER_WEEK))
+                end = MINUTES_PER_WEEK
+            intervals.append((start, end))
+    return OpeningHours(intervals)
+
+def open_state(value, minute):
+    """
+    Evaluate an opening_hours value at a minute of the week
+
+    Args:
+        value: opening_hours tag value
+        minute: Minute of the week (see minute_of_week)
+
+    Returns:
+        OPEN, CLOSED, or UNKNOWN if the value is missing or unsupported
+    """
+    hours = compile_opening_hours(value)
+    if hours is None:
+        return UNKNOWN
+    return OPEN if hours.is_open(minute) else CLOSED
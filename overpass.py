@@ -0,0 +1,602 @@
+import asyncio
+import codecs
+import json
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from config import Config
+from metrics import STAGE_SECONDS, UPSTREAM_ERRORS
+from utils import logger
+
+# Start of the element array in an Overpass JSON response
+ELEMENTS_START = re.compile(r'"elements"\s*:\s*\[')
+
+# Characters kept after the element array (the rest of the top-level object)
+MAX_TAIL = 65536
+
+class OverpassError(ValueError):
+    """Overpass answered with an error instead of a complete result"""
+
+class ElementStreamParser:
+    """
+    Incremental parser of the 'elements' array of an Overpass JSON response
+
+    Only the unparsed tail of the data fed so far is held in memory, so the
+    full payload is never materialized. The rest of the top-level object is
+    kept after the array, since Overpass reports runtime errors (e.g. a
+    timeout) in a 'remark' key following the elements.
+    """
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = ''
+        self._tail = ''
+        self._in_array = False
+        self.done = False
+
+    def feed(self, chunk):
+        """
+        Parse the next chunk of the response
+
+        Args:
+            chunk: Response bytes
+
+        Returns:
+            List of element dicts completed by this chunk
+        """
+        if self.done:
+            self._keep_tail(self._text_decoder.decode(chunk))
+            return []
+
+        buffer = self._buffer + self._text_decoder.decode(chunk)
+
+        if not self._in_array:
+            match = ELEMENTS_START.search(buffer)
+            if not match:
+                # Keep a tail in case the key is split across chunks
+                self._buffer = buffer[-32:]
+                return []
+            buffer = buffer[match.end():]
+            self._in_array = True
+
+        elements = []
+        pos = 0
+        while True:
+            # Skip separators between elements
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos == len(buffer):
+                break
+            if buffer[pos] == ']':
+                self.done = True
+                self._keep_tail(buffer[pos + 1:])
+                break
+            try:
+                element, pos = self._decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # Element is incomplete; wait for the next chunk
+                break
+            elements.append(element)
+
+        self._buffer = '' if self.done else buffer[pos:]
+        return elements
+
+    def _keep_tail(self, text):
+        if len(self._tail) < MAX_TAIL:
+            self._tail += text[:MAX_TAIL - len(self._tail)]
+
+    def close(self):
+        """
+        Check that the response ended cleanly
+
+        Raises:
+            OverpassError: If Overpass reported a runtime error
+            ValueError: If the response had no elements array or ended
+                before the top-level object was closed
+        """
+        if not self._in_array:
+            raise ValueError("Overpass response has no elements array")
+        if not self.done:
+            raise ValueError("Overpass response ended inside the elements array")
+
+        # The keys after the array, e.g. ',"remark": "..."}'
+        try:
+            rest = json.loads('{' + self._tail.lstrip().lstrip(','))
+        except json.JSONDecodeError:
+            raise ValueError("Overpass response ended after the elements array")
+
+        remark = rest.get('remark') if isinstance(rest, dict) else None
+        if remark and 'error' in remark:
+            raise OverpassError(f"Overpass reported: {remark}")
+        if remark:
+            logger.warning(f"Overpass remark: {remark}")
+
+def iter_elements(response, chunk_size=65536):
+    """
+    Parse the 'elements' array of an Overpass JSON response incrementally
+
+    Args:
+        response: Streamed requests.Response (stream=True)
+        chunk_size: Bytes read per chunk
+
+    Yields:
+        Element dicts in response order
+
+    Raises:
+        OverpassError: If Overpass reported a runtime error after the elements
+        ValueError: If the response is not a complete element array
+    """
+    parser = ElementStreamParser()
+    for chunk in response.iter_content(chunk_size):
+        yield from parser.feed(chunk)
+    parser.close()
+
+def count_element(counts, element):
+    """
+    Count a raw element under its type
+
+    Each output statement of a food query returns one element type, so the
+    counts tell whether a statement reached its limit (see is_truncated).
+    """
+    element_type = element.get('type')
+    counts[element_type] = counts.get(element_type, 0) + 1
+
+def merge_counts(target, counts):
+    """Keep the highest count per type of several queries in target"""
+    for element_type, count in counts.items():
+        if count > target.get(element_type, 0):
+            target[element_type] = count
+
+def is_truncated(counts, limit):
+    """
+    Check whether an output statement may have been cut at its limit
+
+    Args:
+        counts: Raw elements per type, before unnamed ones are dropped
+        limit: Elements per output statement of the query
+
+    Returns:
+        True if any type reached the limit
+    """
+    return any(count >= limit for count in counts.values())
+
+def _close_response(future):
+    """Release the connection of a hedged request that lost the race"""
+    if future.exception() is None:
+        future.result().close()
+
+class EndpointHealth:
+    """Success/failure tracking for one Overpass endpoint"""
+
+    def __init__(self, url):
+        self.url = url
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.down_until = 0.0
+        self.latency = None  # exponentially weighted average, seconds
+
+    def record_success(self, elapsed):
+        self.successes += 1
+        self.consecutive_failures = 0
+        self.down_until = 0.0
+        self.latency = elapsed if self.latency is None else 0.8 * self.latency + 0.2 * elapsed
+
+    def record_failure(self, cooldown):
+        self.failures += 1
+        self.consecutive_failures += 1
+        # Back off exponentially on repeated failures (capped at 10 cooldowns)
+        backoff = cooldown * min(2 ** (self.consecutive_failures - 1), 10)
+        self.down_until = time.monotonic() + backoff
+
+    def is_healthy(self):
+        return time.monotonic() >= self.down_until
+
+    def stats(self):
+        return {
+            'healthy': self.is_healthy(),
+            'successes': self.successes,
+            'failures': self.failures,
+            'latency_ms': round(self.latency * 1000) if self.latency is not None else None,
+        }
+
+class OverpassClient:
+    """
+    Overpass API client with a pooled HTTP session
+
+    Each endpoint gets retries with backoff on 429/504. Requests fail over to
+    mirror endpoints, and can optionally be hedged: if the first endpoint has
+    not answered within hedge_after seconds, the same query is sent to the
+    next endpoint and whichever answers first wins.
+    """
+
+    def __init__(self, endpoints, timeout=30, retries=2, backoff=0.5,
+                 hedge_after=0, pool_size=10, cooldown=30):
+        """
+        Args:
+            endpoints: Overpass interpreter URLs in order of preference
+            timeout: Request timeout in seconds
+            retries: Retries per endpoint on connection errors, 429 and 504
+            backoff: Retry backoff factor in seconds
+            hedge_after: Seconds before a hedged request is sent (0 disables hedging)
+            pool_size: Connections kept per endpoint
+            cooldown: Seconds an endpoint is skipped after a failure
+        """
+        self.endpoints = list(endpoints)
+        self.timeout = timeout
+        self.hedge_after = hedge_after
+        self.cooldown = cooldown
+        self.health = {url: EndpointHealth(url) for url in self.endpoints}
+        self.hedged = 0
+        self.hedge_wins = 0
+        self._lock = threading.Lock()
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=(429, 504),
+            allowed_methods=frozenset(['POST']),
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(
+            pool_connections=len(self.endpoints),
+            pool_maxsize=pool_size,
+            max_retries=retry
+        )
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._executor = None
+        if hedge_after and len(self.endpoints) > 1:
+            self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='overpass')
+
+    @classmethod
+    def from_config(cls):
+        """Create a client from Config"""
+        return cls(
+            [Config.OVERPASS_API_URL] + Config.OVERPASS_MIRRORS,
+            timeout=Config.OVERPASS_TIMEOUT,
+            retries=Config.OVERPASS_RETRIES,
+            backoff=Config.OVERPASS_BACKOFF,
+            hedge_after=Config.OVERPASS_HEDGE_AFTER,
+            pool_size=Config.OVERPASS_POOL_SIZE,
+            cooldown=Config.OVERPASS_FAILURE_COOLDOWN
+        )
+
+    def ordered_endpoints(self):
+        """Get endpoints with healthy ones first, keeping configured order"""
+        with self._lock:
+            healthy = [url for url in self.endpoints if self.health[url].is_healthy()]
+        return healthy + [url for url in self.endpoints if url not in healthy]
+
+    def post_to(self, url, query, stream=False):
+        """
+        Send a query to one endpoint
+
+        Args:
+            url: Overpass interpreter URL
+            query: Overpass QL query string
+            stream: Leave the body unread for incremental parsing
+
+        Returns:
+            requests.Response
+
+        Raises:
+            requests.exceptions.RequestException: If the request fails
+        """
+        start = time.monotonic()
+        try:
+            response = self.session.post(url, data={'data': query}, timeout=self.timeout, stream=stream)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            self.record_failure(url, e)
+            raise
+
+        elapsed = time.monotonic() - start
+        with self._lock:
+            self.health[url].record_success(elapsed)
+        STAGE_SECONDS.observe(elapsed, 'overpass_request')
+        return response
+
+    def record_failure(self, url, error):
+        """
+        Mark an endpoint as failed, e.g. when its response body was an error
+
+        Later queries go to the other endpoints first until its cooldown ends.
+
+        Args:
+            url: Overpass interpreter URL
+            error: Exception describing the failure
+        """
+        with self._lock:
+            health = self.health.get(url)
+            if health is not None:
+                health.record_failure(self.cooldown)
+        UPSTREAM_ERRORS.inc('overpass')
+        logger.warning(f"Overpass endpoint {url} failed: {error}")
+
+    def post(self, query, stream=False):
+        """
+        Run a query, failing over (and optionally hedging) across endpoints
+
+        Args:
+            query: Overpass QL query string
+            stream: Leave the body unread for incremental parsing (see iter_elements)
+
+        Returns:
+            requests.Response
+
+        Raises:
+            requests.exceptions.RequestException: If every endpoint fails
+        """
+        endpoints = self.ordered_endpoints()
+
+        if self._executor is not None:
+            response, endpoints = self._post_hedged(query, endpoints, stream)
+            if response is not None:
+                return response
+
+        last_error = None
+        for url in endpoints:
+            try:
+                return self.post_to(url, query, stream)
+            except requests.exceptions.RequestException as e:
+                last_error = e
+
+        raise last_error or requests.exceptions.RequestException("No Overpass endpoint available")
+
+    def _post_hedged(self, query, endpoints, stream):
+        """
+        Race the first endpoint against a delayed request to the second
+
+        Returns:
+            Tuple of (response or None, endpoints left to fail over to)
+        """
+        primary = self._executor.submit(self.post_to, endpoints[0], query, stream)
+        try:
+            return primary.result(timeout=self.hedge_after), []
+        except FutureTimeoutError:
+            pass
+        except requests.exceptions.RequestException:
+            return None, endpoints[1:]
+
+        with self._lock:
+            self.hedged += 1
+        hedge = self._executor.submit(self.post_to, endpoints[1], query, stream)
+
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        with self._lock:
+                            self.hedge_wins += 1
+                    # The slower request finishes in the background and is discarded
+                    for loser in pending:
+                        loser.add_done_callback(_close_response)
+                    return future.result(), []
+
+        return None, endpoints[2:]
+
+    def stats(self):
+        """Get per-endpoint health and hedging counters"""
+        with self._lock:
+            return {
+                'endpoints': {url: h.stats() for url, h in self.health.items()},
+                'hedged': self.hedged,
+                'hedge_wins': self.hedge_wins,
+            }
+
+class AsyncOverpassClient:
+    """
+    asyncio counterpart of OverpassClient sharing one aiohttp session
+
+    Failover, retries on connection errors, 429 and 504, endpoint health and
+    hedging behave like OverpassClient, but a request in flight only holds a
+    connection and a coroutine, so one process can keep hundreds of queries
+    outstanding. The session is created on first use inside the running
+    event loop; close() it on shutdown.
+    """
+
+    def __init__(self, endpoints, timeout=30, retries=2, backoff=0.5,
+                 hedge_after=0, connections=100, cooldown=30):
+        """
+        Args:
+            endpoints: Overpass interpreter URLs in order of preference
+            timeout: Request timeout in seconds
+            retries: Retries per endpoint on connection errors, 429 and 504
+            backoff: Retry backoff factor in seconds
+            hedge_after: Seconds before a hedged request is sent (0 disables hedging)
+            connections: Maximum open connections of the session
+            cooldown: Seconds an endpoint is skipped after a failure
+        """
+        self.endpoints = list(endpoints)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.hedge_after = hedge_after if len(self.endpoints) > 1 else 0
+        self.connections = connections
+        self.cooldown = cooldown
+        self.health = {url: EndpointHealth(url) for url in self.endpoints}
+        self.hedged = 0
+        self.hedge_wins = 0
+        self._session = None
+
+    @classmethod
+    def from_config(cls):
+        """Create a client from Config"""
+        return cls(
+            [Config.OVERPASS_API_URL] + Config.OVERPASS_MIRRORS,
+            timeout=Config.OVERPASS_TIMEOUT,
+            retries=Config.OVERPASS_RETRIES,
+            backoff=Config.OVERPASS_BACKOFF,
+            hedge_after=Config.OVERPASS_HEDGE_AFTER,
+            connections=Config.ASYNC_CONNECTION_LIMIT,
+            cooldown=Config.OVERPASS_FAILURE_COOLDOWN
+        )
+
+    def session(self):
+        """Get the shared aiohttp session, creating it in the running loop"""
+        if self._session is None or self._session.closed:
+            import aiohttp
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.connections),
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+        return self._session
+
+    async def close(self):
+        """Close the shared session"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def ordered_endpoints(self):
+        """Get endpoints with healthy ones first, keeping configured order"""
+        healthy = [url for url in self.endpoints if self.health[url].is_healthy()]
+        return healthy + [url for url in self.endpoints if url not in healthy]
+
+    async def fetch_from(self, url, query, transform=None):
+        """
+        Run a query against one endpoint and parse the response as it arrives
+
+        Args:
+            url: Overpass interpreter URL
+            query: Overpass QL query string
+            transform: Function applied to each element; None results are dropped
+
+        Returns:
+            Tuple of (list of (transformed) elements, raw elements per type)
+
+        Raises:
+            aiohttp.ClientError, asyncio.TimeoutError or ValueError: If the request fails
+        """
+        import aiohttp
+
+        start = time.monotonic()
+        attempt = 0
+        while True:
+            try:
+                async with self.session().post(url, data={'data': query}) as response:
+                    if response.status in (429, 504) and attempt < self.retries:
+                        retry_after = response.headers.get('Retry-After', '')
+                        delay = float(retry_after) if retry_after.isdigit() else self.backoff * 2 ** attempt
+                        attempt += 1
+                        await asyncio.sleep(delay)
+                        continue
+                    response.raise_for_status()
+                    STAGE_SECONDS.observe(time.monotonic() - start, 'overpass_request')
+
+                    parser = ElementStreamParser()
+                    items = []
+                    counts = {}
+                    async for chunk in response.content.iter_chunked(65536):
+                        for element in parser.feed(chunk):
+                            count_element(counts, element)
+                            item = element if transform is None else transform(element)
+                            if item is not None:
+                                items.append(item)
+                    parser.close()
+                break
+            except aiohttp.ClientConnectionError as e:
+                if attempt < self.retries:
+                    await asyncio.sleep(self.backoff * 2 ** attempt)
+                    attempt += 1
+                    continue
+                self._record_failure(url, e)
+                raise
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                self._record_failure(url, e)
+                raise
+
+        self.health[url].record_success(time.monotonic() - start)
+        return items, counts
+
+    def _record_failure(self, url, error):
+        self.health[url].record_failure(self.cooldown)
+        UPSTREAM_ERRORS.inc('overpass')
+        logger.warning(f"Overpass endpoint {url} failed: {error!r}")
+
+    async def fetch(self, query, transform=None):
+        """
+        Run a query, failing over (and optionally hedging) across endpoints
+
+        Args:
+            query: Overpass QL query string
+            transform: Function applied to each element; None results are dropped
+
+        Returns:
+            Tuple of (list of (transformed) elements, raw elements per type)
+
+        Raises:
+            aiohttp.ClientError, asyncio.TimeoutError or ValueError: If every endpoint fails
+        """
+        import aiohttp
+
+        endpoints = self.ordered_endpoints()
+
+        if self.hedge_after:
+            result, endpoints = await self._fetch_hedged(query, endpoints, transform)
+            if result is not None:
+                return result
+
+        last_error = None
+        for url in endpoints:
+            try:
+                return await self.fetch_from(url, query, transform)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                last_error = e
+
+        raise last_error or aiohttp.ClientError("No Overpass endpoint available")
+
+    async def _fetch_hedged(self, query, endpoints, transform):
+        """
+        Race the first endpoint against a delayed request to the second
+
+        Returns:
+            Tuple of (fetch_from result or None, endpoints left to fail over to)
+        """
+        primary = asyncio.ensure_future(self.fetch_from(endpoints[0], query, transform))
+        done, _ = await asyncio.wait({primary}, timeout=self.hedge_after)
+        if done:
+            if primary.exception() is None:
+                return primary.result(), []
+            return None, endpoints[1:]
+
+        self.hedged += 1
+        hedge = asyncio.ensure_future(self.fetch_from(endpoints[1], query, transform))
+
+        pending = {primary, hedge}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.hedge_wins += 1
+                        return task.result(), []
+        finally:
+            # The slower request is cancelled, releasing its connection
+            for task in pending:
+                task.cancel()
+
+        return None, endpoints[2:]
+
+    def stats(self):
+        """Get per-endpoint health and hedging counters"""
+        return {
+            'endpoints': {url: h.stats() for url, h in self.health.items()},
+            'hedged': self.hedged,
+            'hedge_wins': self.hedge_wins,
+        }
@@ -0,0 +1,116 @@
+import sys
+
+# Tags kept only for display; read when a place makes the final results
+DETAIL_TAGS = ('addr:city', 'addr:street', 'addr:housenumber', 'phone', 'website', 'brand')
+
+class Place:
+    """
+    Compact record of one food place
+
+    Candidates are created per Overpass element and most never reach the
+    reply, so a place keeps its scoring fields in slots (category and hours
+    values interned) and the display-only tags in one tuple, instead of an
+    element dict with a nested tags dict. City, street and brand names repeat
+    across places and are interned too.
+    """
+
+    __slots__ = ('type', 'id', 'lat', 'lon', 'name', 'amenity', 'cuisine', 'opening_hours', 'details')
+
+    def __init__(self, osm_type, osm_id, lat, lon, name, amenity='', cuisine='',
+                 opening_hours='', details=None):
+        """
+        Args:
+            osm_type: 'node', 'way' or 'relation'
+            osm_id: OSM element ID
+            lat: Latitude (center for ways)
+            lon: Longitude (center for ways)
+            name: Place name
+            amenity: Amenity tag value
+            cuisine: Cuisine tag value
+            opening_hours: opening_hours tag value
+            details: Values of DETAIL_TAGS in order, or None if none is set
+        """
+        self.type = osm_type
+        self.id = osm_id
+        self.lat = lat
+        self.lon = lon
+        self.name = name
+        self.amenity = amenity
+        self.cuisine = cuisine
+        self.opening_hours = opening_hours
+        self.details = details
+
+    @classmethod
+    def from_tags(cls, osm_type, osm_id, lat, lon, tags):
+        """
+        Create a place from OSM tags
+
+        Returns:
+            Place
+        """
+        details = (
+            sys.intern(tags.get('addr:city', '')),
+            sys.intern(tags.get('addr:street', '')),
+            tags.get('addr:housenumber', ''),
+            tags.get('phone', ''),
+            tags.get('website', ''),
+            sys.intern(tags.get('brand', '')),
+        )
+        return cls(
+            osm_type, osm_id, lat, lon, tags['name'],
+            sys.intern(tags.get('amenity', '')),
+            sys.intern(tags.get('cuisine', '')),
+            sys.intern(tags.get('opening_hours', '')),
+            details if any(details) else None
+        )
+
+    @classmethod
+    def from_element(cls, element):
+        """
+        Create a place from an Overpass element (or POIIndex.element)
+
+        Ways use their center as coordinates.
+
+        Returns:
+            Place, or None for unnamed elements and elements without coordinates
+        """
+        tags = element.get('tags')
+        if not tags or not tags.get('name'):
+            return None
+
+        if 'lat' in element:
+            lat, lon = element['lat'], element['lon']
+        elif 'center' in element:
+            lat, lon = element['center']['lat'], element['center']['lon']
+        else:
+            return None
+
+        return cls.from_tags(element.get('type', 'node'), element.get('id'), lat, lon, tags)
+
+    def detail(self, key):
+        """Get a display tag (one of DETAIL_TAGS), or '' if not set"""
+        if self.details is None:
+            return ''
+        return self.details[DETAIL_TAGS.index(key)]
+
+    @property
+    def address(self):
+        """Address built from the addr:* tags, or '' if none is set"""
+        if self.details is None:
+            return ''
+        return ' '.join(part for part in self.details[:3] if part)
+
+    @property
+    def tags(self):
+        """The place's tags as an OSM tags dict (built on each access)"""
+        tags = {'name': self.name}
+        for key, value in (('amenity', self.amenity), ('cuisine', self.cuisine),
+                           ('opening_hours', self.opening_hours)):
+            if value:
+                tags[key] = value
+        if self.details is not None:
+            tags.update((key, value) for key, value in zip(DETAIL_TAGS, self.details) if value)
+        return tags
+
+    def __repr__(self):
+        return f"Place({self.type}/{self.id}, {self.name!r})"
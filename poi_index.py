@@ -0,0 +1,420 @@
+"""
+Offline POI index built from an OpenStreetMap extract
+
+Build once from an Overpass JSON export or an OSM PBF file:
+
+    python poi_index.py build taiwan-latest.osm.pbf data/poi_index.bin
+
+The index is a single binary file holding named food amenities bucketed into
+a fixed lat/lon grid. It is memory-mapped on load, so opening it at worker
+start is effectively free and pages are shared between gunicorn workers.
+Optional JSON metadata may follow the tag blob (see write_index).
+"""
+import json
+import math
+import mmap
+import struct
+import sys
+from array import array
+
+from config import Config
+from categories import ALL_FOOD
+from utils import calculate_distance, radius_bbox, logger
+
+MAGIC = b'POIX'
+VERSION = 2
+
+# Element types, stored in the low bits of each record's id
+ELEMENT_TYPES = ('node', 'way', 'relation')
+TYPE_BITS = 2
+
+# magic, version, cell size (e7 degrees), south, west, north, east (e7), rows, cols, count, blob size
+HEADER = struct.Struct('<4sHxxiiiiiIIIQ')
+
+# Fixed-point scale for coordinates stored as int32
+COORD_SCALE = 10_000_000
+
+# Separators used in the packed tag blob
+KEY_SEP = '\x1f'
+TAG_SEP = '\x1e'
+
+def encode_id(osm_type, osm_id):
+    """Pack an element type and OSM id into one stored id"""
+    return (osm_id << TYPE_BITS) | ELEMENT_TYPES.index(osm_type)
+
+def decode_id(stored_id):
+    """
+    Unpack a stored id
+
+    Returns:
+        Tuple of (osm_type, osm_id)
+    """
+    return ELEMENT_TYPES[stored_id & ((1 << TYPE_BITS) - 1)], stored_id >> TYPE_BITS
+
+def is_food_place(tags):
+    """Check whether an element's tags describe a named food place"""
+    return bool(tags.get('name')) and ALL_FOOD.matches(tags)
+
+def pack_tags(tags):
+    """Pack the tags we read into a compact string"""
+    return TAG_SEP.join(
+        f"{key}{KEY_SEP}{tags[key]}" for key in Config.OSM_TAGS if tags.get(key)
+    )
+
+def unpack_tags(packed):
+    """Unpack a tag string produced by pack_tags"""
+    tags = {}
+    if packed:
+        for item in packed.split(TAG_SEP):
+            key, _, value = item.partition(KEY_SEP)
+            tags[key] = value
+    return tags
+
+def read_json_extract(path):
+    """
+    Read food places from an Overpass/OSM JSON extract
+
+    Nodes use their own coordinates, ways and relations use their 'center'
+    (as returned by `out center`).
+
+    Args:
+        path: Path to the JSON file
+
+    Yields:
+        Tuples of (osm_type, osm_id, lat, lon, tags)
+    """
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+
+    for element in data.get('elements', []):
+        tags = element.get('tags', {})
+        if not is_food_place(tags):
+            continue
+
+        if 'lat' in element:
+            lat, lon = element['lat'], element['lon']
+        elif 'center' in element:
+            lat, lon = element['center']['lat'], element['center']['lon']
+        else:
+            continue
+
+        osm_type = element.get('type', 'node')
+        if osm_type not in ELEMENT_TYPES:
+            continue
+        yield osm_type, element['id'], lat, lon, tags
+
+def read_pbf_extract(path):
+    """
+    Read food places from an OSM PBF extract (requires the `osmium` package)
+
+    Args:
+        path: Path to the PBF file
+
+    Yields:
+        Tuples of (osm_type, osm_id, lat, lon, tags)
+    """
+    try:
+        import osmium
+    except ImportError:
+        raise RuntimeError("Reading PBF extracts requires the 'osmium' package (pip install osmium)")
+
+    places = []
+
+    class FoodHandler(osmium.SimpleHandler):
+        def node(self, n):
+            tags = {t.k: t.v for t in n.tags}
+            if is_food_place(tags) and n.location.valid():
+                places.append(('node', n.id, n.location.lat, n.location.lon, tags))
+
+        def way(self, w):
+            tags = {t.k: t.v for t in w.tags}
+            if not is_food_place(tags):
+                return
+            coords = [(nd.lat, nd.lon) for nd in w.nodes if nd.location.valid()]
+            if coords:
+                lat = sum(c[0] for c in coords) / len(coords)
+                lon = sum(c[1] for c in coords) / len(coords)
+                places.append(('way', w.id, lat, lon, tags))
+
+    FoodHandler().apply_file(path, locations=True)
+    return iter(places)
+
+def coverage_cells(places, cell_size):
+    """
+    Get the cells of an absolute lat/lon grid holding at least one place
+
+    Args:
+        places: Iterable of (type, id, lat, lon, tags) tuples
+        cell_size: Coverage cell size in degrees
+
+    Returns:
+        Sorted list of (row, col) cells, row = floor(lat / cell_size)
+    """
+    return sorted({(math.floor(p[2] / cell_size), math.floor(p[3] / cell_size)) for p in places})
+
+def build_index(source_path, output_path, cell_size=None, coverage_cell_size=None):
+    """
+    Build an on-disk POI index from an OSM extract
+
+    The index covers the coverage cells holding places from the extract,
+    not its bounding box, so searches near the extract but outside it
+    (e.g. the mainland coast opposite Kinmen) still go to Overpass.
+
+    Args:
+        source_path: Path to an Overpass JSON export or an .osm.pbf file
+        output_path: Path of the index file to write
+        cell_size: Grid cell size in degrees (default: Config.POI_INDEX_CELL_SIZE)
+        coverage_cell_size: Coverage cell size in degrees
+            (default: Config.POI_INDEX_COVERAGE_CELL_SIZE)
+
+    Returns:
+        Number of places written
+    """
+    if source_path.endswith('.pbf'):
+        places = list(read_pbf_extract(source_path))
+    else:
+        places = list(read_json_extract(source_path))
+
+    if not places:
+        raise ValueError(f"No named food places found in {source_path}")
+
+    coverage_cell_size = coverage_cell_size or Config.POI_INDEX_COVERAGE_CELL_SIZE
+    coverage = {'cell_size': coverage_cell_size, 'cells': coverage_cells(places, coverage_cell_size)}
+    return write_index(places, output_path, cell_size, metadata={'coverage': coverage})
+
+def write_index(places, output_path, cell_size=None, metadata=None):
+    """
+    Write places to an on-disk POI index
+
+    Args:
+        places: List of (type, id, lat, lon, tags) tuples
+        output_path: Path of the index file to write
+        cell_size: Grid cell size in degrees (default: Config.POI_INDEX_CELL_SIZE)
+        metadata: Optional JSON-serializable dict stored after the tags; a
+            'regions' list of (south, west, north, east) boxes or a
+            'coverage' dict of cell_size and (row, col) cells sets what the
+            index claims to cover (see POIIndex.covers)
+
+    Returns:
+        Number of places written
+    """
+    cell_size = cell_size or Config.POI_INDEX_CELL_SIZE
+    places = list(places)
+
+    if places:
+        south = min(p[2] for p in places)
+        west = min(p[3] for p in places)
+        north = max(p[2] for p in places)
+        east = max(p[3] for p in places)
+    else:
+        south = west = north = east = 0.0
+    rows = int((north - south) / cell_size) + 1
+    cols = int((east - west) / cell_size) + 1
+
+    def cell_of(place):
+        row = int((place[2] - south) / cell_size)
+        col = int((place[3] - west) / cell_size)
+        return row * cols + col
+
+    places.sort(key=cell_of)
+
+    # Prefix offsets of each grid cell into the record arrays
+    cell_start = array('I', [0] * (rows * cols + 1))
+    for place in places:
+        cell_start[cell_of(place) + 1] += 1
+    for i in range(1, len(cell_start)):
+        cell_start[i] += cell_start[i - 1]
+
+    lats = array('i', (round(p[2] * COORD_SCALE) for p in places))
+    lons = array('i', (round(p[3] * COORD_SCALE) for p in places))
+    ids = array('q', (encode_id(p[0], p[1]) for p in places))
+
+    blob = bytearray()
+    tag_offsets = array('I', [0])
+    for place in places:
+        blob += pack_tags(place[4]).encode('utf-8')
+        tag_offsets.append(len(blob))
+
+    arrays = [cell_start, lats, lons, ids, tag_offsets]
+    if sys.byteorder != 'little':
+        for arr in arrays:
+            arr.byteswap()
+
+    with open(output_path, 'wb') as f:
+        f.write(HEADER.pack(
+            MAGIC, VERSION, round(cell_size * COORD_SCALE),
+            round(south * COORD_SCALE), round(west * COORD_SCALE),
+            round(north * COORD_SCALE), round(east * COORD_SCALE),
+            rows, cols, len(places), len(blob)
+        ))
+        # ids are 8-byte values; pad so every section stays aligned
+        for arr in arrays:
+            f.write(arr.tobytes())
+            if f.tell() % 8:
+                f.write(b'\0' * (8 - f.tell() % 8))
+        f.write(bytes(blob))
+        if metadata:
+            f.write(json.dumps(metadata, ensure_ascii=False).encode('utf-8'))
+
+    logger.info(f"Wrote {len(places)} places ({rows}x{cols} grid) to {output_path}")
+    return len(places)
+
+class POIIndex:
+    """Read-only, memory-mapped spatial index of food places"""
+
+    def __init__(self, path):
+        """
+        Args:
+            path: Path to an index file written by build_index
+        """
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version, cell_size, south, west, north, east,
+         self.rows, self.cols, self.count, blob_size) = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a POI index (version {VERSION})")
+
+        self.cell_size = cell_size / COORD_SCALE
+        self.bbox = (south / COORD_SCALE, west / COORD_SCALE,
+                     north / COORD_SCALE, east / COORD_SCALE)
+
+        view = memoryview(self._mmap)
+        offset = HEADER.size
+        sections = []
+        for typecode, length in (('I', self.rows * self.cols + 1), ('i', self.count),
+                                 ('i', self.count), ('q', self.count), ('I', self.count + 1)):
+            offset += -offset % 8
+            size = array(typecode).itemsize * length
+            section = view[offset:offset + size].cast(typecode)
+            if sys.byteorder != 'little':
+                section = array(typecode, section)
+                section.byteswap()
+            sections.append(section)
+            offset += size
+
+        self._cell_start, self._lats, self._lons, self._ids, self._tag_offsets = sections
+        offset += -offset % 8
+        self._blob = view[offset:offset + blob_size]
+
+        # Optional metadata after the blob
+        self.metadata = {}
+        if len(self._mmap) > offset + blob_size:
+            self.metadata = json.loads(bytes(view[offset + blob_size:]).decode('utf-8'))
+        self.regions = [tuple(region) for region in self.metadata.get('regions', [])]
+        coverage = self.metadata.get('coverage', {})
+        self.coverage_cell_size = coverage.get('cell_size')
+        self.coverage = {tuple(cell) for cell in coverage.get('cells', [])}
+
+        logger.info(f"Loaded POI index {path} with {self.count} places")
+
+    def covers(self, latitude, longitude, radius_m):
+        """
+        Check whether a search circle lies entirely inside the indexed area
+
+        The area is the index's regions or, for an extract, its coverage
+        cells. An index with neither covers nothing.
+        """
+        south, west, north, east = radius_bbox(latitude, longitude, radius_m)
+        for region in self.regions:
+            if (region[0] <= south and north <= region[2] and
+                    region[1] <= west and east <= region[3]):
+                return True
+
+        if not self.coverage:
+            return False
+        size = self.coverage_cell_size
+        return all(
+            (row, col) in self.coverage
+            for row in range(math.floor(south / size), math.floor(north / size) + 1)
+            for col in range(math.floor(west / size), math.floor(east / size) + 1)
+        )
+
+    def element(self, i):
+        """Get record i as an Overpass-style element dict"""
+        osm_type, osm_id = decode_id(self._ids[i])
+        packed = bytes(self._blob[self._tag_offsets[i]:self._tag_offsets[i + 1]])
+        return {
+            'type': osm_type,
+            'id': osm_id,
+            'lat': self._lats[i] / COORD_SCALE,
+            'lon': self._lons[i] / COORD_SCALE,
+            'tags': unpack_tags(packed.decode('utf-8')),
+        }
+
+    def search(self, latitude, longitude, radius_m):
+        """
+        Find places within a radius
+
+        Args:
+            latitude: Center latitude
+            longitude: Center longitude
+            radius_m: Radius in meters
+
+        Returns:
+            List of Overpass-style element dicts
+        """
+        max_distance_km = radius_m / 1000.0
+        results = []
+        for i in self._records_in_bbox(*radius_bbox(latitude, longitude, radius_m)):
+            lat = self._lats[i] / COORD_SCALE
+            lon = self._lons[i] / COORD_SCALE
+            if calculate_distance(latitude, longitude, lat, lon) <= max_distance_km:
+                results.append(self.element(i))
+
+        return results
+
+    def search_bbox(self, south, west, north, east):
+        """
+        Find places inside a bounding box
+
+        Returns:
+            List of Overpass-style element dicts
+        """
+        results = []
+        for i in self._records_in_bbox(south, west, north, east):
+            lat = self._lats[i] / COORD_SCALE
+            lon = self._lons[i] / COORD_SCALE
+            if south <= lat <= north and west <= lon <= east:
+                results.append(self.element(i))
+        return results
+
+    def _records_in_bbox(self, south, west, north, east):
+        """Yield record numbers in the grid cells overlapping a bounding box"""
+        if self.count == 0:
+            return
+        row_min = max(int((south - self.bbox[0]) / self.cell_size), 0)
+        row_max = min(int((north - self.bbox[0]) / self.cell_size), self.rows - 1)
+        col_min = max(int((west - self.bbox[1]) / self.cell_size), 0)
+        col_max = min(int((east - self.bbox[1]) / self.cell_size), self.cols - 1)
+        if row_min > row_max or col_min > col_max:
+            return
+
+        for row in range(row_min, row_max + 1):
+            # Cells in a row are contiguous, so each row is one record range
+            start = self._cell_start[row * self.cols + col_min]
+            end = self._cell_start[row * self.cols + col_max + 1]
+            yield from range(start, end)
+
+def load_index(path):
+    """
+    Load a POI index, returning None if it is missing or invalid
+
+    Args:
+        path: Path to the index file
+
+    Returns:
+        POIIndex or None
+    """
+    try:
+        return POIIndex(path)
+    except (OSError, ValueError, struct.error, UnicodeDecodeError) as e:
+        logger.error(f"Could not load POI index {path}: {e}")
+        return None
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4 or sys.argv[1] != 'build':
+        print("Usage: python poi_index.py build <extract.json|extract.osm.pbf> <index.bin>")
+        sys.exit(1)
+    build_index(sys.argv[2], sys.argv[3])
@@ -0,0 +1,134 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from config import Config
+from cache import TTLCache
+from utils import logger
+
+class CandidatePrefetcher:
+    """
+    Per-user candidate sets fetched in the background after a location share
+
+    One search for every food place around the shared location answers the
+    category taps that usually follow, so switching categories re-filters
+    and re-scores the set locally instead of calling Overpass again.
+    """
+
+    def __init__(self, recommender, concurrency=4, ttl=600, max_users=500, wait=10):
+        """
+        Args:
+            recommender: RestaurantRecommender used to fetch and score
+            concurrency: Maximum number of prefetches running at once
+            ttl: Seconds a user's candidate set is kept
+            max_users: Maximum number of candidate sets kept
+            wait: Seconds a search waits for an unfinished prefetch
+        """
+        self.recommender = recommender
+        self.wait = wait
+        self._entries = TTLCache(max_users, ttl)  # user_id -> (latitude, longitude, future)
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='prefetch')
+        self._lock = threading.Lock()
+        self.scheduled = 0
+        self.skipped = 0
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_config(cls, recommender):
+        """Create a prefetcher from Config"""
+        return cls(
+            recommender,
+            concurrency=Config.PREFETCH_CONCURRENCY,
+            ttl=Config.PREFETCH_TTL,
+            max_users=Config.PREFETCH_MAX_USERS,
+            wait=Config.PREFETCH_WAIT
+        )
+
+    def prefetch(self, user_id, latitude, longitude):
+        """
+        Start fetching the candidate set of a user's location
+
+        The prefetch is skipped when the user's set for this location already
+        exists or every prefetch slot is busy.
+
+        Args:
+            user_id: LINE user ID
+            latitude: Shared latitude
+            longitude: Shared longitude
+
+        Returns:
+            True if a prefetch was started
+        """
+        entry = self._entries.get(user_id)
+        if entry is not None and entry[:2] == (latitude, longitude):
+            return False
+
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.skipped += 1
+            logger.info(f"Prefetch slots busy, skipping prefetch for {user_id}")
+            return False
+
+        try:
+            future = self._executor.submit(self.recommender.collect_candidates, latitude, longitude)
+        except RuntimeError:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        self._entries.set(user_id, (latitude, longitude, future))
+        with self._lock:
+            self.scheduled += 1
+        return True
+
+    def recommend(self, user_id, latitude, longitude, category=None):
+        """
+        Answer a search from the user's prefetched candidate set
+
+        Args:
+            user_id: LINE user ID
+            latitude: User's latitude
+            longitude: User's longitude
+            category: Restaurant category filter
+
+        Returns:
+            List of recommended restaurants, or None if the search has to go
+            to the recommender (no set for this location, fetch failed or
+            incomplete)
+        """
+        recommendations = None
+        entry = self._entries.get(user_id)
+        if entry is not None and entry[:2] == (latitude, longitude):
+            try:
+                candidates, complete = entry[2].result(timeout=self.wait)
+            except FutureTimeoutError:
+                complete = False
+            except Exception as e:
+                logger.error(f"Prefetch failed: {e}")
+                complete = False
+
+            if complete:
+                recommendations = self.recommender.recommend_from_candidates(
+                    latitude, longitude, category, candidates
+                )
+            else:
+                # Let the next location share try again
+                self._entries.pop(user_id)
+
+        with self._lock:
+            if recommendations is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return recommendations
+
+    def stats(self):
+        """Get prefetch counters"""
+        with self._lock:
+            return {
+                'users': len(self._entries),
+                'scheduled': self.scheduled,
+                'skipped': self.skipped,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
@@ -0,0 +1,127 @@
+import math
+import re
+from functools import lru_cache
+from utils import calculate_distance
+
+# Parenthesized parts: 'Starbucks (Xinyi)', '鼎泰豐（信義店）'
+PARENTHESES_PATTERN = re.compile(r'[(（［\[].*?[)）］\]]')
+
+# Branch suffix after a separator: '麥當勞 中山店', 'Subway - Taipei Main'
+BRANCH_PATTERN = re.compile(r'[\s\-－–·・]+[^\s\-－–·・]*(店|分店|門市|門店|branch)$', re.IGNORECASE)
+
+@lru_cache(maxsize=8192)
+def chain_key(name, brand=''):
+    """
+    Get the key under which branches of one chain are treated as duplicates
+
+    The brand tag is used when set; otherwise the name is normalized by
+    dropping parenthesized parts and a separated branch suffix, case and
+    punctuation.
+
+    Args:
+        name: Place name
+        brand: Brand tag value (optional)
+
+    Returns:
+        Normalized key
+    """
+    value = brand or name
+    normalized = PARENTHESES_PATTERN.sub(' ', value).strip()
+    normalized = BRANCH_PATTERN.sub('', normalized) or normalized
+    normalized = re.sub(r'\W+', '', normalized.casefold())
+    return normalized or value.casefold()
+
+def place_chain_key(restaurant):
+    """Get the chain key of a Place (see chain_key)"""
+    return chain_key(restaurant.name, restaurant.detail('brand'))
+
+class SpacingGrid:
+    """Spatial hash answering 'is any kept place closer than the minimum spacing'"""
+
+    def __init__(self, spacing_m, latitude):
+        """
+        Args:
+            spacing_m: Minimum spacing in meters
+            latitude: Latitude the longitude cell width is computed at
+        """
+        self.spacing_km = spacing_m / 1000.0
+        self.lat_cell = spacing_m / 111320.0
+        self.lon_cell = self.lat_cell / max(math.cos(math.radians(latitude)), 0.01)
+        self._cells = {}
+
+    def _cell(self, lat, lon):
+        return int(lat // self.lat_cell), int(lon // self.lon_cell)
+
+    def too_close(self, lat, lon):
+        """Check whether a kept place lies within the spacing of a point"""
+        row, col = self._cell(lat, lon)
+        for r in (row - 1, row, row + 1):
+            for c in (col - 1, col, col + 1):
+                for other_lat, other_lon in self._cells.get((r, c), ()):
+                    if calculate_distance(lat, lon, other_lat, other_lon) < self.spacing_km:
+                        return True
+        return False
+
+    def add(self, lat, lon):
+        """Keep a place"""
+        self._cells.setdefault(self._cell(lat, lon), []).append((lat, lon))
+
+# Reasons a candidate was passed over, in the order they are relaxed
+AMENITY_CAP, TOO_CLOSE, DUPLICATE_CHAIN = 1, 2, 3
+
+def select_diverse(ranked, k, min_spacing_m=0, max_per_amenity=0):
+    """
+    Pick k results from a best-first pool while keeping them diverse
+
+    One pass keeps a candidate unless its chain is already picked, a picked
+    place is within min_spacing_m, or its amenity type has max_per_amenity
+    picks. If fewer than k pass, the passed-over candidates fill the rest,
+    those breaking the mildest constraint (amenity cap, then spacing, then
+    chain) first. The pool is a bounded top-K (see TopKScorer, which can
+    already keep one candidate per chain), so this stays linear in its size.
+
+    Args:
+        ranked: List of (restaurant, score, distance_km) tuples, best first
+        k: Number of results
+        min_spacing_m: Minimum distance between results in meters (0 = off)
+        max_per_amenity: Maximum results of one amenity type (0 = off)
+
+    Returns:
+        List of (restaurant, score, distance_km) tuples, best first
+    """
+    if len(ranked) <= 1:
+        return ranked[:k]
+
+    grid = None
+    if min_spacing_m > 0:
+        grid = SpacingGrid(min_spacing_m, ranked[0][0].lat)
+
+    chains = set()
+    amenity_counts = {}
+    picked = []
+    passed_over = []
+
+    for rank, entry in enumerate(ranked):
+        if len(picked) == k:
+            break
+        restaurant = entry[0]
+        chain = place_chain_key(restaurant)
+
+        if chain in chains:
+            passed_over.append((DUPLICATE_CHAIN, rank))
+        elif grid is not None and grid.too_close(restaurant.lat, restaurant.lon):
+            passed_over.append((TOO_CLOSE, rank))
+        elif max_per_amenity and amenity_counts.get(restaurant.amenity, 0) >= max_per_amenity:
+            passed_over.append((AMENITY_CAP, rank))
+        else:
+            picked.append(rank)
+            chains.add(chain)
+            amenity_counts[restaurant.amenity] = amenity_counts.get(restaurant.amenity, 0) + 1
+            if grid is not None:
+                grid.add(restaurant.lat, restaurant.lon)
+
+    if len(picked) < k:
+        passed_over.sort()
+        picked += [rank for _, rank in passed_over[:k - len(picked)]]
+
+    return [ranked[rank] for rank in sorted(picked)]
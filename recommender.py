@@ -1,59 +1,178 @@
+import math
+import time
 import requests
 from config import Config
-from utils import calculate_distance, logger
+from cache import TTLCache, SingleFlight
+from metrics import STAGE_SECONDS
+from categories import ALL_FOOD, get_matcher, category_key
+from opening_hours import minute_of_week, open_state
+from overpass import OverpassClient, iter_elements, count_element, merge_counts, is_truncated
+from places import Place
+from poi_index import load_index
+from ranking import place_chain_key, select_diverse
+from scoring import TopKScorer
+from utils import (
+    calculate_distance, logger, encode_geohash, decode_geohash_bbox,
+    geohash_cells_for_radius
+)
+
+def tile_item(element):
+    """
+    Turn a raw element of a tiles response into a Place, keeping the
+    'count' elements that separate the cell outputs (see tiles_query)
+    """
+    if element.get('type') == 'count':
+        return element
+    return Place.from_element(element)
 
 class RestaurantRecommender:
     """Restaurant recommendation engine using OpenStreetMap Overpass API"""
     
     def __init__(self):
         self.api_url = Config.OVERPASS_API_URL
+        self.client = OverpassClient.from_config()
         self.search_radius = Config.SEARCH_RADIUS
         self.max_results = Config.MAX_RESULTS
+        # Scorers keep a larger pool when the results are diversified
+        self.diversity = Config.DIVERSITY_ENABLED
+        self.pool_factor = Config.DIVERSITY_POOL_FACTOR if self.diversity else 1
+        self.max_elements = Config.OVERPASS_MAX_ELEMENTS
+        self.tile_precision = Config.TILE_GEOHASH_PRECISION
+        
+        # Overpass results cached per (geohash cell, category) tile
+        self.tile_cache = None
+        if Config.TILE_CACHE_ENABLED:
+            self.tile_cache = TTLCache(Config.TILE_CACHE_MAX_TILES, Config.TILE_CACHE_TTL)
+        
+        # Offline POI index (falls back to Overpass outside its region)
+        self.local_index = None
+        if Config.POI_BACKEND == 'local':
+            self.local_index = load_index(Config.POI_INDEX_PATH)
+        
+        # Snapshot of hot regions kept up to date by refresher.POIRefresher
+        self.snapshot = None
+        
+        # Adaptive search radius, remembered per area
+        self.adaptive_radius = Config.ADAPTIVE_RADIUS
+        self.radius_min = Config.ADAPTIVE_RADIUS_MIN
+        self.radius_max = Config.ADAPTIVE_RADIUS_MAX
+        self.density_cache = TTLCache(Config.ADAPTIVE_DENSITY_MAX_AREAS, Config.ADAPTIVE_DENSITY_TTL)
         
-    def build_overpass_query(self, latitude, longitude, category=None):
+        # Concurrent searches snapped to the same grid point share one fetch;
+        # the fetch radius is padded so it still covers every snapped caller
+        self.flights = SingleFlight()
+        self.flight_grid = Config.SINGLEFLIGHT_GRID
+        self.flight_padding = math.ceil(self.flight_grid * 111320 * math.sqrt(2) / 2)
+        
+        # Finished recommendation lists per snapped location; data_version is
+        # part of the key, so bumping it invalidates every cached list
+        self.data_version = 0
+        self.recommendation_cache = None
+        if Config.RECOMMENDATION_CACHE_ENABLED:
+            self.recommendation_cache = TTLCache(
+                Config.RECOMMENDATION_CACHE_MAX_ENTRIES, Config.RECOMMENDATION_CACHE_TTL
+            )
+        
+    def invalidate_recommendations(self):
+        """Drop cached recommendations after the underlying POI data changed"""
+        self.data_version += 1
+        if self.recommendation_cache is not None:
+            self.recommendation_cache.clear()
+        logger.info(f"POI data version is now {self.data_version}")
+    
+    def set_snapshot(self, snapshot):
+        """
+        Replace the hot-region snapshot and drop results built from the old one
+        
+        Args:
+            snapshot: POIIndex or None
+        """
+        self.snapshot = snapshot
+        self.invalidate_recommendations()
+    
+    def index_for(self, latitude, longitude, radius):
+        """
+        Get the local index (offline index or snapshot) covering a search
+        
+        Args:
+            latitude: User's latitude
+            longitude: User's longitude
+            radius: Search radius in meters
+        
+        Returns:
+            POIIndex, or None if the search has to go to Overpass
+        """
+        for index in (self.local_index, self.snapshot):
+            if index is not None and index.covers(latitude, longitude, radius):
+                return index
+        return None
+    
+    def recommendation_key(self, latitude, longitude, category=None):
+        """
+        Get the recommendation cache key of a search
+        
+        Args:
+            latitude: User's latitude
+            longitude: User's longitude
+            category: Restaurant category filter
+        
+        Returns:
+            Hashable cache key
+        """
+        grid = Config.RECOMMENDATION_CACHE_GRID
+        return (
+            round(latitude / grid), round(longitude / grid),
+            category_key(category),
+            'adaptive' if self.adaptive_radius else self.search_radius,
+            self.max_results, Config.WEIGHT_DISTANCE, Config.WEIGHT_CATEGORY,
+            self.data_version,
+        )
+    
+    def build_tag_filter(self, category=None):
+        """
+        Build a single Overpass tag filter for a category
+        
+        Args:
+            category: Restaurant category filter (optional)
+        
+        Returns:
+            Overpass QL tag filter string
+        """
+        return get_matcher(category).tag_filter
+    
+    def build_overpass_query(self, latitude, longitude, category=None, bbox=None, radius=None, limit=None):
         """
         Build Overpass QL query for nearby restaurants
         
+        Nodes are returned with coordinates and tags, ways with their center
+        point and tags only; each output is capped at OVERPASS_MAX_ELEMENTS.
+        
         Args:
             latitude: User's latitude
             longitude: User's longitude
             category: Restaurant category filter (optional)
+            bbox: Optional (south, west, north, east) to search instead of the radius
+            radius: Search radius in meters (default: SEARCH_RADIUS)
+            limit: Elements per output (default: OVERPASS_MAX_ELEMENTS)
         
         Returns:
             Overpass QL query string
         """
-        # Get amenity tags based on category
-        if category and category in Config.CATEGORIES:
-            amenities = Config.CATEGORIES[category]
+        if bbox:
+            area = '({},{},{},{})'.format(*bbox)
         else:
-            amenities = Config.CATEGORIES['全部']
-        
-        # Build amenity filter
-        amenity_filters = []
-        for amenity in amenities:
-            amenity_filters.append(f'["amenity"="{amenity}"]')
+            area = f'(around:{radius or self.search_radius},{latitude},{longitude})'
         
-        # Also search by cuisine tag if category specified
-        cuisine_filters = []
-        if category and category in Config.CUISINE_TAGS:
-            cuisines = Config.CUISINE_TAGS[category]
-            for cuisine in cuisines:
-                cuisine_filters.append(f'["cuisine"="{cuisine}"]')
-        
-        # Combine filters
-        all_filters = amenity_filters + cuisine_filters
-        filter_query = ''.join([f'node{f}(around:{self.search_radius},{latitude},{longitude});' for f in all_filters])
+        tag_filter = self.build_tag_filter(category)
+        limit = limit or self.max_elements
         
         # Overpass QL query
-        query = f"""
-        [out:json][timeout:25];
-        (
-            {filter_query}
-        );
-        out body;
-        >;
-        out skel qt;
-        """
+        query = (
+            f'[out:json][timeout:25];'
+            f'nw{tag_filter}{area}->.food;'
+            f'node.food;out qt {limit};'
+            f'way.food;out tags center qt {limit};'
+        )
         
         return query
     
@@ -67,87 +186,426 @@ class RestaurantRecommender:
             category: Restaurant category filter (optional)
         
         Returns:
-            List of restaurant data
+            List of restaurant data within the search radius
+        """
+        restaurants = []
+        self.stream_nearby_restaurants(latitude, longitude, category, restaurants.append)
+        
+        # Clip to the search radius around the user's own position
+        max_distance_km = self.search_radius / 1000.0
+        restaurants = [
+            r for r in restaurants
+            if calculate_distance(latitude, longitude, r.lat, r.lon) <= max_distance_km
+        ]
+        
+        logger.info(f"Found {len(restaurants)} restaurants")
+        return restaurants
+    
+    def stream_nearby_restaurants(self, latitude, longitude, category, sink, radius=None, counts=None):
+        """
+        Pass nearby restaurants to a callback as they become available
+        
+        Concurrent searches snapped to the same grid point share one fetch.
+        Without the tile cache the Overpass response is parsed incrementally
+        and its elements are fed to every waiting caller, so no caller holds
+        the full result. Restaurants may lie slightly outside the search
+        radius; callers clip.
+        
+        Args:
+            latitude: User's latitude
+            longitude: User's longitude
+            category: Restaurant category filter (optional)
+            sink: Function called with each restaurant
+            radius: Search radius in meters (default: SEARCH_RADIUS)
+            counts: Dict updated with the highest raw element count per type
+                of the Overpass queries behind the result (see is_truncated;
+                left untouched for local index searches)
+        
+        Returns:
+            False if the Overpass call failed, True otherwise
         """
-        query = self.build_overpass_query(latitude, longitude, category)
+        radius = radius or self.search_radius
+        logger.info(f"Searching restaurants near ({latitude}, {longitude}) "
+                    f"within {radius}m with category: {category}")
+        
+        index = self.index_for(latitude, longitude, radius)
+        if index is not None:
+            for restaurant in self.search_local(latitude, longitude, category, radius, index):
+                sink(restaurant)
+            return True
+        
+        key, center_lat, center_lon, fetch_radius, category_name = self.flight_plan(
+            latitude, longitude, category, radius
+        )
         
         try:
-            logger.info(f"Searching restaurants near ({latitude}, {longitude}) with category: {category}")
+            if self.tile_cache is not None:
+                restaurants, fetched = self.flights.do(
+                    key, lambda: self.search_tiles(center_lat, center_lon, fetch_radius, category_name)
+                )
+                for restaurant in restaurants:
+                    sink(restaurant)
+            else:
+                query = self.build_overpass_query(center_lat, center_lon, category_name, radius=fetch_radius)
+                fetched = self.flights.stream(key, lambda: self.iter_restaurants(query), sink)
             
-            response = requests.post(
-                self.api_url,
-                data={'data': query},
-                timeout=30
-            )
-            response.raise_for_status()
-            data = response.json()
-            
-            # Extract elements (nodes)
-            elements = data.get('elements', [])
-            
-            # Filter to only include nodes with names
-            restaurants = []
-            for element in elements:
-                if element.get('type') == 'node' and element.get('tags', {}).get('name'):
-                    restaurants.append(element)
-            
-            logger.info(f"Found {len(restaurants)} restaurants from OSM")
-            return restaurants
+            if counts is not None:
+                merge_counts(counts, fetched)
             
         except requests.exceptions.RequestException as e:
             logger.error(f"Error calling Overpass API: {e}")
-            return []
+            return False
         except Exception as e:
             logger.error(f"Error processing Overpass data: {e}")
-            return []
+            return False
+        
+        return True
+    
+    def flight_plan(self, latitude, longitude, category, radius):
+        """
+        Snap a search to the single-flight grid
+        
+        Args:
+            latitude: User's latitude
+            longitude: User's longitude
+            category: Restaurant category filter (optional)
+            radius: Search radius in meters
+        
+        Returns:
+            Tuple of (flight key, fetch latitude, fetch longitude, fetch
+            radius covering every caller snapped to the same point, category key)
+        """
+        category_name = category_key(category)
+        grid_lat = round(latitude / self.flight_grid)
+        grid_lon = round(longitude / self.flight_grid)
+        center_lat = round(grid_lat * self.flight_grid, 6)
+        center_lon = round(grid_lon * self.flight_grid, 6)
+        fetch_radius = radius + self.flight_padding
+        key = (grid_lat, grid_lon, category_name, radius)
+        return key, center_lat, center_lon, fetch_radius, category_name
+    
+    def iter_restaurants(self, query, transform=Place.from_element):
+        """
+        Run an Overpass query and stream its named places
+        
+        The response is parsed incrementally. Unnamed elements are dropped as
+        they arrive and the rest become compact Place records. Time spent
+        reading and parsing (not in the consumer) is recorded as the
+        'overpass_parse' stage.
+        
+        Args:
+            query: Overpass QL query string
+            transform: Function applied to each raw element; None results
+                are dropped (default: Place.from_element)
+        
+        Yields:
+            Place (or what transform returns)
+        
+        Returns:
+            Raw elements per type, counted before unnamed ones are dropped
+            (the generator's return value; see is_truncated)
+        
+        Raises:
+            requests.exceptions.RequestException: If the Overpass call fails
+            ValueError: If the response is not a complete result (OverpassError
+                if Overpass reported a runtime error); the endpoint is marked
+                as failed
+        """
+        response = self.client.post(query, stream=True)
+        parse_seconds = 0.0
+        counts = {}
+        
+        with response:
+            start = time.perf_counter()
+            try:
+                for element in iter_elements(response):
+                    count_element(counts, element)
+                    restaurant = transform(element)
+                    if restaurant is None:
+                        continue
+                    parse_seconds += time.perf_counter() - start
+                    yield restaurant
+                    start = time.perf_counter()
+            except (ValueError, requests.exceptions.RequestException) as e:
+                self.client.record_failure(response.url, e)
+                raise
+            parse_seconds += time.perf_counter() - start
+        
+        STAGE_SECONDS.observe(parse_seconds, 'overpass_parse')
+        return counts
+    
+    def fetch_restaurants(self, query, transform=Place.from_element):
+        """
+        Run an Overpass query and collect its named places
+        
+        A response that turns out to be an error is retried on the next
+        endpoint (iter_restaurants marked the failing one), up to one attempt
+        per endpoint.
+        
+        Args:
+            query: Overpass QL query string
+            transform: Function applied to each raw element (see iter_restaurants)
+        
+        Returns:
+            Tuple of (list of restaurant data, raw elements per type)
+        
+        Raises:
+            requests.exceptions.RequestException or ValueError: If the Overpass call fails
+        """
+        attempts = len(self.client.endpoints)
+        for attempt in range(1, attempts + 1):
+            restaurants = []
+            iterator = self.iter_restaurants(query, transform)
+            try:
+                while True:
+                    restaurants.append(next(iterator))
+            except StopIteration as stop:
+                return restaurants, stop.value
+            except ValueError as e:
+                if attempt == attempts:
+                    raise
+                logger.warning(f"Retrying Overpass query on another endpoint: {e}")
+    
+    def search_local(self, latitude, longitude, category=None, radius=None, index=None):
+        """
+        Search for nearby restaurants in the offline POI index
+        
+        Args:
+            latitude: User's latitude
+            longitude: User's longitude
+            category: Restaurant category filter (optional)
+            radius: Search radius in meters (default: SEARCH_RADIUS)
+            index: POIIndex to search (default: the offline index)
+        
+        Returns:
+            List of restaurant data within the search radius
+        """
+        index = index or self.local_index
+        elements = index.search(latitude, longitude, radius or self.search_radius)
+        restaurants = [
+            Place.from_element(e) for e in elements if self.matches_category(e['tags'], category)
+        ]
+        
+        logger.info(f"Found {len(restaurants)} restaurants in local index")
+        return restaurants
+    
+    def matches_category(self, tags, category=None):
+        """
+        Check whether tags pass the same filter as build_overpass_query
+        
+        Args:
+            tags: OSM tags of a restaurant
+            category: Restaurant category filter (optional)
+        
+        Returns:
+            True if the restaurant belongs to the category
+        """
+        return get_matcher(category).matches(tags)
+    
+    def search_tiles(self, latitude, longitude, radius, category):
+        """
+        Search for nearby restaurants through the geohash tile cache
+        
+        Missing tiles are fetched with a single Overpass query (see
+        fetch_tiles). If that fetch fails the cached tiles are used, or the
+        error is raised when no tile was cached.
+        
+        Args:
+            latitude: Center latitude
+            longitude: Center longitude
+            radius: Radius in meters
+            category: Category key
+        
+        Returns:
+            Tuple of (list of restaurant data in the tiles covering the
+            radius, highest raw element count per type of the cell outputs)
+        """
+        cells = geohash_cells_for_radius(latitude, longitude, radius, self.tile_precision)
+        restaurants, missing = self.cached_tiles(cells, category)
+        counts = {}
+        
+        if missing:
+            try:
+                fetched, counts = self.fetch_tiles(missing, category)
+                for tile in fetched.values():
+                    restaurants.extend(tile)
+            except Exception as e:
+                if len(missing) == len(cells):
+                    raise
+                logger.error(f"Error fetching tiles, using cached tiles only: {e}")
+        
+        logger.info(f"{len(cells) - len(missing)}/{len(cells)} tiles cached")
+        return restaurants, counts
+    
+    def cached_tiles(self, cells, category):
+        """
+        Collect the cached tiles of geohash cells
+        
+        Args:
+            cells: List of geohash cells
+            category: Category key of the tiles
+        
+        Returns:
+            Tuple of (restaurants in cached tiles, cells not cached)
+        """
+        restaurants = []
+        missing = []
+        for cell in cells:
+            tile = self.tile_cache.get((cell, category))
+            if tile is None:
+                missing.append(cell)
+            else:
+                restaurants.extend(tile)
+        return restaurants, missing
+    
+    def tiles_query(self, cells, category):
+        """
+        Build one Overpass query for the tiles of geohash cells
+        
+        Places are selected once over the cells' combined bounding box, then
+        output cell by cell, each output capped at max_elements. An
+        'out count' before each cell's output gives the cell's full totals,
+        so a cell that does not fit is detected without cutting the others.
+        Ways crossing cells are output once per cell they touch.
+        
+        Args:
+            cells: List of geohash cells
+            category: Category key of the tiles
+        
+        Returns:
+            Overpass QL query string
+        """
+        boxes = [decode_geohash_bbox(cell) for cell in cells]
+        bbox = (
+            min(b[0] for b in boxes),
+            min(b[1] for b in boxes),
+            max(b[2] for b in boxes),
+            max(b[3] for b in boxes),
+        )
+        limit = self.max_elements
+        query = (
+            f'[out:json][timeout:25];'
+            f'nw{self.build_tag_filter(category)}({bbox[0]},{bbox[1]},{bbox[2]},{bbox[3]})->.food;'
+        )
+        for south, west, north, east in boxes:
+            area = f'({south},{west},{north},{east})'
+            query += (
+                f'node.food{area}->.n;way.food{area}->.w;(.n;.w;);out count;'
+                f'.n out qt {limit};.w out tags center qt {limit};'
+            )
+        return query
     
-    def calculate_score(self, restaurant, user_lat, user_lon, category=None):
+    def fetch_tiles(self, cells, category):
+        """
+        Fetch and cache tiles for the given geohash cells
+        
+        A capped output returns elements in quadtile order, not by distance,
+        so a cell whose output was cut may miss places anywhere in it. Such a
+        cell is returned but not cached; the other cells of the same response
+        are complete and cached.
+        
+        Args:
+            cells: List of geohash cells to fetch
+            category: Category key of the tiles
+        
+        Returns:
+            Tuple of (dict mapping each cell to its list of restaurants,
+            highest raw element count per type of the cell outputs)
+        """
+        items, _ = self.fetch_restaurants(self.tiles_query(cells, category), transform=tile_item)
+        return self.store_tiles(cells, category, items)
+    
+    def store_tiles(self, cells, category, items):
+        """
+        Bucket a tiles response by cell and cache each complete tile
+        
+        Args:
+            cells: List of geohash cells, in tiles_query order
+            category: Category key of the tiles
+            items: Restaurants and 'count' elements of the response (see tile_item)
+        
+        Returns:
+            Tuple of (dict mapping each cell to its list of restaurants,
+            highest raw element count per type of the cell outputs)
+        
+        Raises:
+            ValueError: If the response does not have one output per cell
+        """
+        totals = [item['tags'] for item in items if isinstance(item, dict)]
+        if len(totals) != len(cells):
+            raise ValueError(f"Tiles response has {len(totals)} outputs for {len(cells)} tiles")
+        
+        # A cell's output holds min(total, limit) elements of each type
+        counts = {}
+        cut = set()
+        for cell, cell_totals in zip(cells, totals):
+            output = {
+                'node': min(int(cell_totals.get('nodes', 0)), self.max_elements),
+                'way': min(int(cell_totals.get('ways', 0)), self.max_elements),
+            }
+            merge_counts(counts, output)
+            if is_truncated(output, self.max_elements):
+                cut.add(cell)
+        
+        # Bucket by cell; ways output for several cells are kept once and
+        # cells outside the requested set are dropped
+        tiles = {cell: [] for cell in cells}
+        seen = set()
+        for item in items:
+            if isinstance(item, dict) or (item.type, item.id) in seen:
+                continue
+            seen.add((item.type, item.id))
+            cell = encode_geohash(item.lat, item.lon, self.tile_precision)
+            if cell in tiles:
+                tiles[cell].append(item)
+        
+        for cell, tile in tiles.items():
+            if cell not in cut:
+                self.tile_cache.set((cell, category), tile)
+        if cut:
+            logger.warning(f"Tiles {', '.join(sorted(cut))} reached the element limit, not caching")
+        
+        return tiles, counts
+    
+    def calculate_score(self, restaurant, user_lat, user_lon, category=None, minute=None):
         """
         Calculate recommendation score for a restaurant
         
         Since OSM doesn't have ratings, we focus on:
         - Distance (70% weight)
         - Category match (30% weight)
+        - Open now (small bonus, half for unknown opening hours)
         
         Args:
-            restaurant: Restaurant data from Overpass API
+            restaurant: Place
             user_lat: User's latitude
             user_lon: User's longitude
             category: User's preferred category
+            minute: Minute of the week for opening hours (default: now)
         
         Returns:
             Tuple of (score, distance_km)
         """
         # Calculate distance
-        rest_lat = restaurant.get('lat')
-        rest_lon = restaurant.get('lon')
-        distance_km = calculate_distance(user_lat, user_lon, rest_lat, rest_lon)
+        distance_km = calculate_distance(user_lat, user_lon, restaurant.lat, restaurant.lon)
         
         # Normalize distance (0 = closest, 1 = farthest within radius)
         max_distance_km = self.search_radius / 1000.0
         distance_normalized = min(distance_km / max_distance_km, 1.0)
         
         # Category match
-        category_match = 0.0
-        if category and category != '全部':
-            tags = restaurant.get('tags', {})
-            amenity = tags.get('amenity', '')
-            cuisine = tags.get('cuisine', '')
-            
-            # Check if amenity or cuisine matches category
-            category_amenities = Config.CATEGORIES.get(category, [])
-            category_cuisines = Config.CUISINE_TAGS.get(category, [])
-            
-            if amenity in category_amenities or cuisine in category_cuisines:
-                category_match = 1.0
-            # Partial match for cuisine tags
-            elif any(c in cuisine for c in category_cuisines):
-                category_match = 0.5
+        category_match = get_matcher(category).score_match(restaurant.amenity, restaurant.cuisine)
+        
+        # Open now
+        if minute is None:
+            minute = minute_of_week()
+        is_open = open_state(restaurant.opening_hours, minute)
         
         # Calculate final score (distance-focused since no ratings)
         score = (
             Config.WEIGHT_DISTANCE * (1 - distance_normalized) +
-            Config.WEIGHT_CATEGORY * category_match
+            Config.WEIGHT_CATEGORY * category_match +
+            Config.WEIGHT_OPEN * is_open
         )
         
         return score, distance_km
@@ -164,51 +622,308 @@ class RestaurantRecommender:
         Returns:
             List of recommended restaurants with scores
         """
-        # Search nearby restaurants
-        restaurants = self.search_nearby_restaurants(latitude, longitude, category)
+        cache_key, cached = self.cached_recommendations(latitude, longitude, category)
+        if cached is not None:
+            return cached
         
-        if not restaurants:
-            return []
+        if self.adaptive_radius:
+            scorer, complete = self.score_adaptive(latitude, longitude, category)
+        else:
+            # Stream nearby restaurants into a bounded top-N scorer
+            scorer, complete, _ = self.score_nearby(latitude, longitude, category, self.search_radius)
         
-        # Calculate scores for each restaurant
-        scored_restaurants = []
-        for restaurant in restaurants:
-            tags = restaurant.get('tags', {})
-            score, distance = self.calculate_score(restaurant, latitude, longitude, category)
-            
-            # Extract address components
-            addr_street = tags.get('addr:street', '')
-            addr_housenumber = tags.get('addr:housenumber', '')
-            addr_city = tags.get('addr:city', '')
-            
-            # Build address string
-            address_parts = []
-            if addr_city:
-                address_parts.append(addr_city)
-            if addr_street:
-                address_parts.append(addr_street)
-            if addr_housenumber:
-                address_parts.append(addr_housenumber)
-            
-            address = ' '.join(address_parts) if address_parts else '地址未提供'
-            
-            scored_restaurants.append({
-                'name': tags.get('name', 'Unknown'),
-                'address': address,
-                'distance_km': distance,
-                'score': score,
-                'latitude': restaurant.get('lat'),
-                'longitude': restaurant.get('lon'),
-                'amenity': tags.get('amenity', ''),
-                'cuisine': tags.get('cuisine', ''),
-                'phone': tags.get('phone', ''),
-                'website': tags.get('website', ''),
-                'opening_hours': tags.get('opening_hours', ''),
-            })
-        
-        # Sort by score (highest first) and return top N
-        scored_restaurants.sort(key=lambda x: x['score'], reverse=True)
-        top_recommendations = scored_restaurants[:self.max_results]
+        return self.finish_recommendations(scorer, complete, cache_key)
+    
+    def cached_recommendations(self, latitude, longitude, category=None):
+        """
+        Look up a search in the recommendation cache
+        
+        Args:
+            latitude: User's latitude
+            longitude: User's longitude
+            category: Restaurant category filter
+        
+        Returns:
+            Tuple of (cache key or None if caching is off, relocated
+            recommendations or None on a miss)
+        """
+        if self.recommendation_cache is None:
+            return None, None
+        
+        cache_key = self.recommendation_key(latitude, longitude, category)
+        cached = self.recommendation_cache.get(cache_key)
+        if cached is None:
+            return cache_key, None
+        
+        logger.info(f"Returning {len(cached)} cached recommendations")
+        return cache_key, self.relocate_recommendations(cached, latitude, longitude)
+    
+    def new_scorer(self, latitude, longitude, category, radius):
+        """Create the bounded scorer of a search (see pool_size and scorer_key)"""
+        return TopKScorer(latitude, longitude, category, radius, self.pool_size, key=self.scorer_key)
+    
+    def finish_recommendations(self, scorer, complete, cache_key=None):
+        """
+        Build (and cache) the recommendations of a finished search
+        
+        Args:
+            scorer: TopKScorer holding the search's candidates
+            complete: False if the Overpass call failed or its result may
+                have been cut (the result is not cached)
+            cache_key: Recommendation cache key (None to skip caching)
+        
+        Returns:
+            List of recommended restaurants with scores
+        """
+        results = self.select_results(scorer)
+        STAGE_SECONDS.observe(scorer.seconds, 'scoring')
+        top_recommendations = [
+            self.build_recommendation(restaurant, score, distance)
+            for restaurant, score, distance in results
+        ]
+        
+        # Results of failed or cut upstream calls are not cached
+        if cache_key is not None and complete:
+            self.recommendation_cache.set(cache_key, top_recommendations)
         
         logger.info(f"Returning {len(top_recommendations)} recommendations")
         return top_recommendations
+    
+    def relocate_recommendations(self, recommendations, latitude, longitude):
+        """
+        Copy cached recommendations with distances from the user's position
+        
+        Scores and order are kept from the cached search; the cache grid is
+        small enough that only the displayed distance needs updating.
+        
+        Args:
+            recommendations: Cached recommendation dicts
+            latitude: User's latitude
+            longitude: User's longitude
+        
+        Returns:
+            List of recommendation dicts
+        """
+        relocated = []
+        for recommendation in recommendations:
+            recommendation = dict(recommendation)
+            recommendation['distance_km'] = calculate_distance(
+                latitude, longitude, recommendation['latitude'], recommendation['longitude']
+            )
+            relocated.append(recommendation)
+        return relocated
+    
+    def score_nearby(self, latitude, longitude, category, radius):
+        """
+        Score nearby restaurants, shrinking the radius while the fetch is cut
+        
+        An Overpass output that reaches the element limit holds an arbitrary
+        (quadtile ordered) part of its area and may miss the nearest places.
+        Such a search is repeated at half the radius, down to
+        ADAPTIVE_RADIUS_MIN.
+        
+        Args:
+            latitude: User's latitude
+            longitude: User's longitude
+            category: Restaurant category filter
+            radius: Search radius in meters to start with
+        
+        Returns:
+            Tuple of (TopKScorer holding the best restaurants, False if the
+            Overpass call failed or its result may still be cut, radius
+            searched)
+        """
+        while True:
+            scorer = self.new_scorer(latitude, longitude, category, radius)
+            counts = {}
+            found = self.stream_nearby_restaurants(latitude, longitude, category, scorer.add,
+                                                   radius=radius, counts=counts)
+            scorer.flush()
+            cut = is_truncated(counts, self.max_elements)
+            if not found or not cut or radius <= self.radius_min:
+                break
+            radius = max(radius // 2, self.radius_min)
+            logger.info(f"Search reached the element limit, retrying within {radius}m")
+        
+        return scorer, found and not cut, radius
+    
+    def score_adaptive(self, latitude, longitude, category=None):
+        """
+        Score nearby restaurants, growing the radius until enough are found
+        
+        The search starts at the radius that last sufficed in the same area
+        (or ADAPTIVE_RADIUS_MIN) and doubles until MAX_RESULTS restaurants
+        are found or ADAPTIVE_RADIUS_MAX is reached. A search shrunk because
+        it reached the element limit (see score_nearby) does not grow again.
+        Areas with far more results than needed start at half the radius
+        next time.
+        
+        Args:
+            latitude: User's latitude
+            longitude: User's longitude
+            category: Restaurant category filter
+        
+        Returns:
+            Tuple of (TopKScorer holding the best restaurants, False if the
+            Overpass call failed or its result may be cut)
+        """
+        area, radius = self.adaptive_start(latitude, longitude, category)
+        
+        while True:
+            scorer, complete, searched = self.score_nearby(latitude, longitude, category, radius)
+            # Stop on upstream errors and cut results rather than retrying with a larger radius
+            if not complete or searched < radius or scorer.matched >= self.max_results or radius >= self.radius_max:
+                break
+            radius = min(radius * 2, self.radius_max)
+        
+        self.remember_radius(area, searched, scorer, complete)
+        return scorer, complete
+    
+    def adaptive_start(self, latitude, longitude, category=None):
+        """
+        Get the density area of a search and the radius to start it with
+        
+        Returns:
+            Tuple of (area key, radius in meters)
+        """
+        area = (encode_geohash(latitude, longitude, Config.ADAPTIVE_DENSITY_PRECISION), category_key(category))
+        return area, self.density_cache.get(area) or self.radius_min
+    
+    def remember_radius(self, area, radius, scorer, found):
+        """
+        Remember the radius an adaptive search ended with for its area
+        
+        Areas with far more results than needed start at half the radius
+        next time. Nothing is remembered when the Overpass call failed or
+        its result may be cut.
+        """
+        if found:
+            next_radius = radius
+            if scorer.matched >= self.max_results * Config.ADAPTIVE_SHRINK_RATIO:
+                next_radius = max(radius // 2, self.radius_min)
+            self.density_cache.set(area, next_radius)
+        
+        logger.info(f"Adaptive search used {radius}m ({scorer.matched} restaurants)")
+    
+    def collect_candidates(self, latitude, longitude, radius=None):
+        """
+        Fetch every food place near a location, regardless of category
+        
+        The result can answer any category locally (see
+        recommend_from_candidates).
+        
+        Args:
+            latitude: User's latitude
+            longitude: User's longitude
+            radius: Search radius in meters (default: SEARCH_RADIUS)
+        
+        Returns:
+            Tuple of (list of restaurant data within the radius, False if the
+            Overpass call failed or a query reached the element limit for a
+            type)
+        """
+        radius = radius or self.search_radius
+        max_distance_km = radius / 1000.0
+        candidates = []
+        counts = {}
+        
+        def keep(restaurant):
+            if calculate_distance(latitude, longitude, restaurant.lat, restaurant.lon) <= max_distance_km:
+                candidates.append(restaurant)
+        
+        found = self.stream_nearby_restaurants(latitude, longitude, ALL_FOOD.name, keep,
+                                               radius=radius, counts=counts)
+        # Local index searches leave counts empty and are always complete
+        complete = found and not is_truncated(counts, self.max_elements)
+        
+        logger.info(f"Collected {len(candidates)} candidates near ({latitude}, {longitude})")
+        return candidates, complete
+    
+    def recommend_from_candidates(self, latitude, longitude, category, candidates, radius=None):
+        """
+        Re-filter and re-score a set from collect_candidates for a category
+        
+        Args:
+            latitude: User's latitude
+            longitude: User's longitude
+            category: Restaurant category filter
+            candidates: Restaurants returned by collect_candidates
+            radius: Radius the candidates were collected with
+        
+        Returns:
+            List of recommended restaurants, or None if the set is too small
+            and adaptive search should expand the radius instead
+        """
+        matcher = get_matcher(category)
+        scorer = self.new_scorer(latitude, longitude, category, radius or self.search_radius)
+        for restaurant in candidates:
+            if matcher.matches_values(restaurant.amenity, restaurant.cuisine):
+                scorer.add(restaurant)
+        scorer.flush()
+        STAGE_SECONDS.observe(scorer.seconds, 'scoring')
+        
+        if self.adaptive_radius and scorer.matched < self.max_results:
+            return None
+        
+        return [
+            self.build_recommendation(restaurant, score, distance)
+            for restaurant, score, distance in self.select_results(scorer)
+        ]
+    
+    @property
+    def pool_size(self):
+        """Number of best candidates kept by a scorer"""
+        return self.max_results * self.pool_factor
+    
+    @property
+    def scorer_key(self):
+        """Key a scorer keeps one candidate of (one branch per chain), if diversified"""
+        return place_chain_key if self.diversity else None
+    
+    def select_results(self, scorer):
+        """
+        Pick the final results from a scorer's pool
+        
+        Args:
+            scorer: TopKScorer created with pool_size
+        
+        Returns:
+            List of (restaurant, score, distance_km) tuples, best first
+        """
+        results = scorer.results()
+        if not self.diversity:
+            return results[:self.max_results]
+        
+        with STAGE_SECONDS.time('ranking'):
+            return select_diverse(
+                results, self.max_results,
+                min_spacing_m=Config.DIVERSITY_MIN_SPACING,
+                max_per_amenity=Config.DIVERSITY_MAX_PER_AMENITY
+            )
+    
+    def build_recommendation(self, restaurant, score, distance):
+        """
+        Build the recommendation dict for a scored restaurant
+        
+        Args:
+            restaurant: Place
+            score: Recommendation score
+            distance: Distance from the user in kilometers
+        
+        Returns:
+            Recommendation dict used by the message templates
+        """
+        return {
+            'osm_id': f"{restaurant.type}/{restaurant.id}",
+            'name': restaurant.name,
+            'address': restaurant.address or '地址未提供',
+            'distance_km': distance,
+            'score': score,
+            'latitude': restaurant.lat,
+            'longitude': restaurant.lon,
+            'amenity': restaurant.amenity,
+            'cuisine': restaurant.cuisine,
+            'phone': restaurant.detail('phone'),
+            'website': restaurant.detail('website'),
+            'opening_hours': restaurant.opening_hours,
+        }
@@ -0,0 +1,383 @@
+"""
+Background refresh of hot regions into a warm-start POI snapshot
+
+Regions are geohash cells. The busiest cells (learned from queries, plus
+POI_HOT_REGIONS) are fetched from Overpass on a schedule and written to a
+memory-mapped snapshot in the poi_index format. New workers load the
+snapshot at startup, so a deploy starts with the busy areas already local.
+One worker per host refreshes at a time (file lock); the others reload the
+snapshot when the file changes. Every worker adds its query counts to a
+counts file next to the snapshot, so the refreshing worker ranks regions by
+the queries of all workers on the host.
+"""
+import fcntl
+import json
+import math
+import os
+import threading
+import time
+
+from config import Config
+from categories import ALL_FOOD
+from overpass import is_truncated
+from places import Place
+from poi_index import load_index, write_index
+from utils import logger, encode_geohash, decode_geohash_bbox
+
+# Weight kept by query counts of earlier snapshots at each refresh
+COUNT_DECAY = 0.5
+
+def top_counts(counts, max_regions):
+    """Keep the max_regions // 2 most queried regions if there are more than max_regions"""
+    if len(counts) <= max_regions:
+        return counts
+    ranked = sorted(counts.items(), key=lambda item: item[1], reverse=True)
+    return dict(ranked[:max_regions // 2])
+
+def update_counts_file(path, counts, max_regions, take=False):
+    """
+    Add query counts to a counts file shared by the workers of a host
+
+    Args:
+        path: Counts file path
+        counts: Dict mapping region to queries to add
+        max_regions: Regions kept before the least queried are dropped
+        take: Empty the file instead of writing the new total
+
+    Returns:
+        Dict mapping region to total queries in the file
+    """
+    with open(path, 'a+', encoding='utf-8') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            f.seek(0)
+            content = f.read()
+            try:
+                total = json.loads(content) if content else {}
+            except ValueError:
+                logger.warning(f"Discarding unreadable query counts in {path}")
+                total = {}
+            for region, count in counts.items():
+                total[region] = total.get(region, 0) + count
+            total = top_counts(total, max_regions)
+
+            f.seek(0)
+            f.truncate()
+            if not take:
+                json.dump(total, f)
+            f.flush()
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+    return total
+
+def parse_regions(value, precision):
+    """
+    Parse 'lat,lon;lat,lon' into geohash cells
+
+    Args:
+        value: Configured region centers
+        precision: Geohash precision
+
+    Returns:
+        List of geohashes
+    """
+    regions = []
+    for item in value.split(';'):
+        if item.strip():
+            lat, lon = (float(v) for v in item.split(','))
+            regions.append(encode_geohash(lat, lon, precision))
+    return regions
+
+def padded_bbox(geohash, padding_m):
+    """
+    Get a geohash cell's bounding box grown by a distance on every side
+
+    Any search centered in the cell with a radius up to padding_m lies inside.
+    """
+    south, west, north, east = decode_geohash_bbox(geohash)
+    # Widest longitude span is at the edge nearer the pole
+    lat_delta = padding_m / 111320.0
+    lon_delta = padding_m / (111320.0 * max(math.cos(math.radians(max(abs(south), abs(north)))), 0.01))
+    return (
+        round(max(south - lat_delta, -90.0), 6),
+        round(max(west - lon_delta, -180.0), 6),
+        round(min(north + lat_delta, 90.0), 6),
+        round(min(east + lon_delta, 180.0), 6),
+    )
+
+class HotRegionTracker:
+    """Query counts per geohash cell"""
+
+    def __init__(self, precision=5, max_regions=10000):
+        """
+        Args:
+            precision: Geohash precision of a region (5 = ~4.9km x 4.9km)
+            max_regions: Regions tracked before the least queried are dropped
+        """
+        self.precision = precision
+        self.max_regions = max_regions
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def record(self, latitude, longitude):
+        """Count a query"""
+        region = encode_geohash(latitude, longitude, self.precision)
+        with self._lock:
+            self._counts[region] = self._counts.get(region, 0) + 1
+            self._counts = top_counts(self._counts, self.max_regions)
+
+    def merge(self, counts):
+        """Add counts (e.g. drained ones that could not be stored) back"""
+        with self._lock:
+            for region, count in counts.items():
+                self._counts[region] = self._counts.get(region, 0) + count
+            self._counts = top_counts(self._counts, self.max_regions)
+
+    def drain(self):
+        """Get the counts recorded since the last drain"""
+        with self._lock:
+            counts, self._counts = self._counts, {}
+        return counts
+
+class POIRefresher:
+    """Keeps the hot-region snapshot fresh and loaded"""
+
+    def __init__(self, recommender, path, interval=3600, regions=(), max_regions=20,
+                 precision=5, max_elements=20000, check_interval=30):
+        """
+        Args:
+            recommender: RestaurantRecommender the snapshot is installed in
+            path: Snapshot file path
+            interval: Seconds between refreshes
+            regions: Geohashes always kept in the snapshot
+            max_regions: Maximum number of regions in the snapshot
+            precision: Geohash precision of a region
+            max_elements: Elements per output of a region's Overpass query
+            check_interval: Seconds between checks for a new or stale snapshot
+        """
+        self.recommender = recommender
+        self.path = path
+        self.interval = interval
+        self.regions = list(regions)
+        self.max_regions = max_regions
+        self.max_elements = max_elements
+        self.check_interval = check_interval
+        self.tracker = HotRegionTracker(precision)
+        self.counts_path = path + '.counts'
+        self.refreshes = 0
+        self.failures = 0
+        self._mtime = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+        # Warm start from the snapshot left by a previous worker
+        self.reload()
+
+    @classmethod
+    def from_config(cls, recommender):
+        """Create a refresher from Config"""
+        return cls(
+            recommender,
+            Config.POI_SNAPSHOT_PATH,
+            interval=Config.POI_REFRESH_INTERVAL,
+            regions=parse_regions(Config.POI_HOT_REGIONS, Config.POI_HOT_REGION_PRECISION),
+            max_regions=Config.POI_HOT_REGION_COUNT,
+            precision=Config.POI_HOT_REGION_PRECISION,
+            max_elements=Config.POI_SNAPSHOT_MAX_ELEMENTS
+        )
+
+    def record_query(self, latitude, longitude):
+        """Count a search toward its region's hotness"""
+        self.tracker.record(latitude, longitude)
+
+    def share_counts(self, take=False):
+        """
+        Move the queries counted in this worker to the shared counts file
+
+        Args:
+            take: Empty the file and return the counts of every worker
+
+        Returns:
+            Dict mapping region to queries in the file (before emptying it)
+        """
+        counts = self.tracker.drain()
+        if not counts and not take:
+            return {}
+        os.makedirs(os.path.dirname(self.counts_path) or '.', exist_ok=True)
+        try:
+            return update_counts_file(self.counts_path, counts, self.tracker.max_regions, take)
+        except OSError as e:
+            logger.warning(f"Could not share query counts: {e}")
+            if not take:
+                # Keep them for the next attempt
+                self.tracker.merge(counts)
+            return counts
+
+    def ensure_started(self):
+        """Start the refresh thread in the current process (lazily, so it is fork-safe)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            threading.Thread(target=self._run, name='poi-refresher', daemon=True).start()
+            self._pid = os.getpid()
+
+    def reload(self):
+        """
+        Load the snapshot file if it changed since the last load
+
+        Returns:
+            True if a new snapshot was installed
+        """
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return False
+        if mtime == self._mtime:
+            return False
+
+        snapshot = load_index(self.path)
+        if snapshot is None:
+            return False
+        self._mtime = mtime
+        self.recommender.set_snapshot(snapshot)
+        logger.info(f"Installed POI snapshot with {snapshot.count} places "
+                    f"in {len(snapshot.regions)} regions")
+        return True
+
+    def is_stale(self):
+        """Check whether the snapshot is missing or older than the refresh interval"""
+        snapshot = self.recommender.snapshot
+        if snapshot is None:
+            return True
+        return time.time() - snapshot.metadata.get('created', 0) >= self.interval
+
+    def _run(self):
+        while True:
+            try:
+                self.share_counts()
+                self.reload()
+                if self.is_stale():
+                    self.refresh_locked()
+            except Exception as e:
+                logger.error(f"POI refresh failed: {e}")
+                self.failures += 1
+            time.sleep(self.check_interval)
+
+    def refresh_locked(self):
+        """
+        Refresh unless another worker on this host is already refreshing
+
+        Returns:
+            True if this worker wrote a new snapshot
+        """
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path + '.lock', 'w') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+            try:
+                # Another worker may have finished while we waited for the check
+                self.reload()
+                if not self.is_stale():
+                    return False
+                self.refresh()
+                return True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def hot_regions(self, previous_counts):
+        """
+        Rank regions by decayed past counts plus queries seen since by any worker
+
+        Returns:
+            Tuple of (regions to fetch, merged counts)
+        """
+        counts = {region: count * COUNT_DECAY for region, count in previous_counts.items()}
+        for region, count in self.share_counts(take=True).items():
+            counts[region] = counts.get(region, 0) + count
+        counts = {region: count for region, count in counts.items() if count >= 1}
+
+        ranked = sorted(counts, key=counts.get, reverse=True)
+        regions = list(dict.fromkeys(self.regions + ranked))[:max(self.max_regions, len(self.regions))]
+        return regions, counts
+
+    def refresh(self):
+        """
+        Fetch every hot region and atomically replace the snapshot
+
+        A region whose fetch fails keeps its places from the previous
+        snapshot; a region where any element type reached max_elements is
+        left out, so searches there still go to Overpass.
+
+        Raises:
+            RuntimeError: If every region fetch failed
+        """
+        previous = self.recommender.snapshot
+        previous_meta = previous.metadata if previous is not None else {}
+        regions, counts = self.hot_regions(previous_meta.get('counts', {}))
+
+        padding = max(self.recommender.search_radius, self.recommender.radius_max
+                      if self.recommender.adaptive_radius else 0)
+        places = {}
+        covered = []
+        covered_regions = []
+        failed = 0
+
+        for region in regions:
+            bbox = padded_bbox(region, padding)
+            try:
+                query = self.recommender.build_overpass_query(
+                    0, 0, ALL_FOOD.name, bbox=bbox, limit=self.max_elements
+                )
+                restaurants, elements = self.recommender.fetch_restaurants(query)
+            except Exception as e:
+                logger.warning(f"Could not refresh region {region}: {e}")
+                failed += 1
+                if previous is not None and tuple(bbox) in previous.regions:
+                    # Only complete regions were stored
+                    restaurants = [Place.from_element(e) for e in previous.search_bbox(*bbox)]
+                    elements = {}
+                else:
+                    continue
+
+            if is_truncated(elements, self.max_elements):
+                logger.warning(f"Region {region} hit the element limit, leaving it out")
+                continue
+
+            for r in restaurants:
+                places[(r.type, r.id)] = (r.type, r.id, r.lat, r.lon, r.tags)
+            covered.append(bbox)
+            covered_regions.append(region)
+
+        if regions and failed == len(regions):
+            # Keep the old snapshot and its age so the next check retries
+            raise RuntimeError(f"Could not refresh any of {len(regions)} regions")
+
+        metadata = {
+            'created': time.time(),
+            'regions': covered,
+            'geohashes': covered_regions,
+            'counts': counts,
+        }
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        write_index(places.values(), tmp_path, metadata=metadata)
+        os.replace(tmp_path, self.path)
+
+        self.refreshes += 1
+        logger.info(f"Refreshed POI snapshot: {len(places)} places in {len(covered)} regions")
+        self.reload()
+
+    def stats(self):
+        """Get snapshot and refresh counters"""
+        snapshot = self.recommender.snapshot
+        return {
+            'places': snapshot.count if snapshot is not None else 0,
+            'regions': len(snapshot.regions) if snapshot is not None else 0,
+            'age_seconds': round(time.time() - snapshot.metadata.get('created', 0))
+                           if snapshot is not None else None,
+            'refreshes': self.refreshes,
+            'failures': self.failures,
+        }
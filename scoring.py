@@ -0,0 +1,296 @@
+import heapq
+import time
+import numpy as np
+from config import Config
+from categories import get_matcher
+from opening_hours import CLOSED, minute_of_week, open_state
+
+# Earth radius in kilometers
+EARTH_RADIUS_KM = 6371.0
+
+def haversine_km(latitude, longitude, lats, lons):
+    """
+    Vectorized Haversine distance from one point to many
+
+    Args:
+        latitude: Origin latitude
+        longitude: Origin longitude
+        lats: Array of latitudes
+        lons: Array of longitudes
+
+    Returns:
+        Array of distances in kilometers
+    """
+    lat1 = np.radians(latitude)
+    lat2 = np.radians(lats)
+    dlat = lat2 - lat1
+    dlon = np.radians(lons) - np.radians(longitude)
+
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+def top_k_indices(scores, k):
+    """
+    Select the indices of the k highest scores, best first
+
+    Uses a partial selection so only the k winners are sorted; ties keep
+    their original order.
+
+    Args:
+        scores: Array of scores
+        k: Number of indices to return
+
+    Returns:
+        Array of indices
+    """
+    if k <= 0 or len(scores) == 0:
+        return np.empty(0, dtype=np.intp)
+
+    if len(scores) > k:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores))
+
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order]
+
+class CandidateBatch:
+    """Restaurant candidates converted to arrays for batched scoring"""
+
+    def __init__(self, restaurants):
+        """
+        Args:
+            restaurants: List of Place records
+        """
+        self.restaurants = restaurants
+        count = len(restaurants)
+
+        self.lats = np.empty(count, dtype=np.float64)
+        self.lons = np.empty(count, dtype=np.float64)
+        amenity_codes = np.empty(count, dtype=np.int32)
+        cuisine_codes = np.empty(count, dtype=np.int32)
+        hours_codes = np.empty(count, dtype=np.int32)
+
+        # Intern tag values so category matching and opening hours run once
+        # per distinct value
+        self.amenities = {}
+        self.cuisines = {}
+        self.hours = {}
+        for i, restaurant in enumerate(restaurants):
+            self.lats[i] = restaurant.lat
+            self.lons[i] = restaurant.lon
+            amenity_codes[i] = self.amenities.setdefault(restaurant.amenity, len(self.amenities))
+            cuisine_codes[i] = self.cuisines.setdefault(restaurant.cuisine, len(self.cuisines))
+            hours_codes[i] = self.hours.setdefault(restaurant.opening_hours, len(self.hours))
+
+        self.amenity_codes = amenity_codes
+        self.cuisine_codes = cuisine_codes
+        self.hours_codes = hours_codes
+
+    def __len__(self):
+        return len(self.restaurants)
+
+    def distances(self, latitude, longitude):
+        """Get distances in kilometers from a point to every candidate"""
+        return haversine_km(latitude, longitude, self.lats, self.lons)
+
+    def category_match(self, category=None):
+        """
+        Get category match values (1=full, 0.5=partial cuisine, 0=none)
+
+        Uses the compiled category matcher once per distinct amenity/cuisine
+        value instead of once per candidate.
+
+        Args:
+            category: User's preferred category
+
+        Returns:
+            Array of match values
+        """
+        matcher = get_matcher(category)
+        if not matcher.scored:
+            return np.zeros(len(self), dtype=np.float64)
+
+        amenity_match = np.array([matcher.amenity_match(v) for v in self.amenities])
+        cuisine_match = np.array([matcher.cuisine_match(v) for v in self.cuisines])
+        return np.maximum(amenity_match[self.amenity_codes], cuisine_match[self.cuisine_codes])
+
+    def open_states(self, minute):
+        """
+        Get open states (1=open, 0=closed, 0.5=unknown) at a minute of the week
+
+        Args:
+            minute: Minute of the week (see opening_hours.minute_of_week)
+
+        Returns:
+            Array of open states
+        """
+        states = np.array([open_state(v, minute) for v in self.hours])
+        return states[self.hours_codes]
+
+    def score(self, latitude, longitude, category, search_radius, minute=None):
+        """
+        Score every candidate
+
+        Args:
+            latitude: User's latitude
+            longitude: User's longitude
+            category: User's preferred category
+            search_radius: Search radius in meters
+            minute: Minute of the week for opening hours (default: now)
+
+        Returns:
+            Tuple of (scores, distances_km, open_states) arrays
+        """
+        distances = self.distances(latitude, longitude)
+        max_distance_km = search_radius / 1000.0
+        distance_normalized = np.minimum(distances / max_distance_km, 1.0)
+        open_states = self.open_states(minute_of_week() if minute is None else minute)
+
+        scores = (
+            Config.WEIGHT_DISTANCE * (1 - distance_normalized) +
+            Config.WEIGHT_CATEGORY * self.category_match(category) +
+            Config.WEIGHT_OPEN * open_states
+        )
+        return scores, distances, open_states
+
+class TopKScorer:
+    """
+    Bounded top-K selection over a stream of candidates
+
+    Candidates are scored in fixed-size vectorized batches and only the best
+    k seen so far are kept, so memory stays proportional to k plus one batch.
+    With a key function only the best candidate per key is kept (e.g. one
+    branch per chain); keys are computed only for candidates that would
+    enter the top k.
+    """
+
+    def __init__(self, latitude, longitude, category, search_radius, k, batch_size=512,
+                 minute=None, open_now=None, key=None):
+        """
+        Args:
+            latitude: User's latitude
+            longitude: User's longitude
+            category: User's preferred category
+            search_radius: Search radius in meters (farther candidates are dropped)
+            k: Number of candidates to keep
+            batch_size: Candidates scored per vectorized batch
+            minute: Minute of the week for opening hours (default: now)
+            open_now: Drop candidates known to be closed (default: OPEN_NOW_FILTER)
+            key: Function of a candidate; at most one candidate per key is kept
+        """
+        self.latitude = latitude
+        self.longitude = longitude
+        self.category = category
+        self.search_radius = search_radius
+        self.k = k
+        self.batch_size = batch_size
+        self.minute = minute_of_week() if minute is None else minute
+        self.open_now = Config.OPEN_NOW_FILTER if open_now is None else open_now
+        self.key = key
+        self.count = 0
+        self.matched = 0  # candidates within the search radius (and open)
+        self.seconds = 0.0  # time spent scoring
+        self._pending = []
+        self._heap = []  # min-heap of [score, -sequence, restaurant, distance, key]
+        self._best = {}  # key -> its heap entry (entries no longer here are stale)
+        self._alive = 0
+
+    def add(self, restaurant):
+        """Add one candidate"""
+        self._pending.append(restaurant)
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def extend(self, restaurants):
+        """Add many candidates"""
+        for restaurant in restaurants:
+            self.add(restaurant)
+
+    def flush(self):
+        """Score all pending candidates"""
+        if not self._pending:
+            return
+
+        start = time.perf_counter()
+        batch = CandidateBatch(self._pending)
+        scores, distances, open_states = batch.score(
+            self.latitude, self.longitude, self.category, self.search_radius, self.minute
+        )
+        dropped = distances > self.search_radius / 1000.0
+        if self.open_now:
+            dropped |= open_states == CLOSED
+        scores[dropped] = -np.inf
+        self.matched += len(self._pending) - int(np.count_nonzero(dropped))
+
+        if self.key is None:
+            for i in top_k_indices(scores, self.k):
+                if scores[i] == -np.inf:
+                    break
+                entry = [float(scores[i]), -(self.count + int(i)), self._pending[i], float(distances[i]), None]
+                if len(self._heap) < self.k:
+                    heapq.heappush(self._heap, entry)
+                elif entry[:2] > self._heap[0][:2]:
+                    heapq.heapreplace(self._heap, entry)
+        elif self.k > 0:
+            # Duplicate keys can push any number of batch entries out, so walk
+            # the batch best first until nothing more can enter
+            for i in top_k_indices(scores, len(scores)):
+                if scores[i] == -np.inf:
+                    break
+                entry = [float(scores[i]), -(self.count + int(i)), self._pending[i], float(distances[i]), None]
+                if self._alive >= self.k and entry[:2] < self._min_alive()[:2]:
+                    break
+                entry[4] = self.key(entry[2])
+                self._offer(entry)
+
+        self.count += len(self._pending)
+        self._pending = []
+        self.seconds += time.perf_counter() - start
+
+    def _min_alive(self):
+        """Get the lowest entry still kept, dropping stale entries above it"""
+        heap = self._heap
+        while self._best.get(heap[0][4]) is not heap[0]:
+            heapq.heappop(heap)
+        return heap[0]
+
+    def _offer(self, entry):
+        """Keep an entry if it is the best of its key and within the top k"""
+        key = entry[4]
+        current = self._best.get(key)
+        if current is not None:
+            if entry[:2] <= current[:2]:
+                return
+            # The old entry stays in the heap as stale
+            self._best[key] = entry
+            heapq.heappush(self._heap, entry)
+        elif self._alive < self.k:
+            self._best[key] = entry
+            heapq.heappush(self._heap, entry)
+            self._alive += 1
+        elif entry[:2] > self._min_alive()[:2]:
+            dropped = heapq.heapreplace(self._heap, entry)
+            del self._best[dropped[4]]
+            self._best[key] = entry
+        else:
+            return
+
+        # Keep stale entries from growing the heap past a constant factor
+        if len(self._heap) > 2 * self.k + 16:
+            self._heap = [e for e in self._heap if self._best.get(e[4]) is e]
+            heapq.heapify(self._heap)
+
+    def results(self):
+        """
+        Get the best candidates, best first
+
+        Returns:
+            List of (restaurant, score, distance_km) tuples
+        """
+        self.flush()
+        entries = self._heap
+        if self.key is not None:
+            entries = [e for e in entries if self._best.get(e[4]) is e]
+        ranked = sorted(entries, key=lambda entry: entry[:2], reverse=True)
+        return [(restaurant, score, distance) for score, _, restaurant, distance, _ in ranked]
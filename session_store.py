@@ -0,0 +1,129 @@
+import json
+from config import Config
+from cache import TTLCache
+from utils import logger
+
+def encode_session(session):
+    """
+    Encode a session dict into a compact string
+
+    Args:
+        session: Dict with optional 'category' and 'location' keys
+
+    Returns:
+        Compact JSON string
+    """
+    compact = {}
+    if 'category' in session:
+        compact['c'] = session['category']
+    if 'location' in session:
+        location = session['location']
+        compact['l'] = [location['latitude'], location['longitude']]
+    return json.dumps(compact, ensure_ascii=False, separators=(',', ':'))
+
+def decode_session(raw):
+    """
+    Decode a string produced by encode_session
+
+    Args:
+        raw: Compact JSON string (or bytes)
+
+    Returns:
+        Session dict
+    """
+    if isinstance(raw, bytes):
+        raw = raw.decode('utf-8')
+    compact = json.loads(raw)
+
+    session = {}
+    if 'c' in compact:
+        session['category'] = compact['c']
+    if 'l' in compact:
+        session['location'] = {
+            'latitude': compact['l'][0],
+            'longitude': compact['l'][1]
+        }
+    return session
+
+class MemorySessionStore:
+    """Per-process session store with idle expiry and LRU eviction"""
+
+    def __init__(self, ttl, max_users):
+        """
+        Args:
+            ttl: Seconds a session is kept after its last save
+            max_users: Maximum number of sessions kept
+        """
+        self._cache = TTLCache(max_users, ttl)
+
+    def get(self, user_id):
+        """Get a copy of a user's session (empty dict if none)"""
+        raw = self._cache.get(user_id)
+        return decode_session(raw) if raw else {}
+
+    def save(self, user_id, session):
+        """Store a user's session and reset its expiry"""
+        self._cache.set(user_id, encode_session(session))
+
+    def delete(self, user_id):
+        """Remove a user's session"""
+        self._cache.pop(user_id)
+
+class RedisSessionStore:
+    """
+    Session store shared between workers through a Redis-protocol server
+
+    Events without a user ID (group and room sources) share one session kept
+    in this process, as they do with MemorySessionStore.
+    """
+
+    def __init__(self, ttl, url=None, client=None, prefix='session:'):
+        """
+        Args:
+            ttl: Seconds a session is kept after its last save
+            url: Redis URL (ignored when client is given)
+            client: Redis-compatible client (e.g. redis.Redis, or
+                bench.stub_server.StubRedis for local runs)
+            prefix: Key prefix for session entries
+        """
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self._anonymous = MemorySessionStore(ttl, 1)
+
+    def get(self, user_id):
+        """Get a copy of a user's session (empty dict if none)"""
+        if user_id is None:
+            return self._anonymous.get(None)
+        raw = self.client.get(f"{self.prefix}{user_id}")
+        return decode_session(raw) if raw else {}
+
+    def save(self, user_id, session):
+        """Store a user's session and reset its expiry"""
+        if user_id is None:
+            self._anonymous.save(None, session)
+            return
+        self.client.set(f"{self.prefix}{user_id}", encode_session(session), ex=self.ttl)
+
+    def delete(self, user_id):
+        """Remove a user's session"""
+        if user_id is None:
+            self._anonymous.delete(None)
+            return
+        self.client.delete(f"{self.prefix}{user_id}")
+
+def create_session_store():
+    """
+    Create the session store selected by Config.SESSION_BACKEND
+
+    Returns:
+        MemorySessionStore or RedisSessionStore
+    """
+    if Config.SESSION_BACKEND == 'redis':
+        logger.info("Using Redis session store")
+        return RedisSessionStore(Config.SESSION_TTL, url=Config.REDIS_URL)
+
+    return MemorySessionStore(Config.SESSION_TTL, Config.SESSION_MAX_USERS)
@@ -91,3 +91,151 @@ def safe_get(data, *keys, default=None):
         except (KeyError, TypeError, IndexError):
             return default
     return data
+
+# Base32 alphabet used by geohash
+GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+def encode_geohash(latitude, longitude, precision=6):
+    """
+    Encode a coordinate into a geohash string
+    
+    Args:
+        latitude: Latitude value
+        longitude: Longitude value
+        precision: Number of geohash characters
+    
+    Returns:
+        Geohash string
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    geohash = []
+    bits = 0
+    bit_count = 0
+    even = True
+    
+    while len(geohash) < precision:
+        if even:
+            mid = (lon_range[0] + lon_range[1]) / 2
+            if longitude >= mid:
+                bits = (bits << 1) | 1
+                lon_range[0] = mid
+            else:
+                bits = bits << 1
+                lon_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if latitude >= mid:
+                bits = (bits << 1) | 1
+                lat_range[0] = mid
+            else:
+                bits = bits << 1
+                lat_range[1] = mid
+        even = not even
+        bit_count += 1
+        
+        if bit_count == 5:
+            geohash.append(GEOHASH_BASE32[bits])
+            bits = 0
+            bit_count = 0
+    
+    return ''.join(geohash)
+
+def decode_geohash_bbox(geohash):
+    """
+    Decode a geohash string into its bounding box
+    
+    Args:
+        geohash: Geohash string
+    
+    Returns:
+        Tuple of (south, west, north, east)
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even = True
+    
+    for char in geohash:
+        value = GEOHASH_BASE32.index(char)
+        for shift in range(4, -1, -1):
+            bit = (value >> shift) & 1
+            target = lon_range if even else lat_range
+            mid = (target[0] + target[1]) / 2
+            if bit:
+                target[0] = mid
+            else:
+                target[1] = mid
+            even = not even
+    
+    return lat_range[0], lon_range[0], lat_range[1], lon_range[1]
+
+def geohash_cell_size(precision):
+    """
+    Get the size of a geohash cell in degrees
+    
+    Args:
+        precision: Number of geohash characters
+    
+    Returns:
+        Tuple of (lat_degrees, lon_degrees)
+    """
+    total_bits = precision * 5
+    lon_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    return 180.0 / (2 ** lat_bits), 360.0 / (2 ** lon_bits)
+
+def radius_bbox(latitude, longitude, radius_m):
+    """
+    Get the bounding box of a circle around a coordinate
+    
+    Args:
+        latitude: Center latitude
+        longitude: Center longitude
+        radius_m: Radius in meters
+    
+    Returns:
+        Tuple of (south, west, north, east)
+    """
+    lat_delta = radius_m / 111320.0
+    lon_delta = radius_m / (111320.0 * max(math.cos(math.radians(latitude)), 0.01))
+    return (
+        max(latitude - lat_delta, -90.0),
+        max(longitude - lon_delta, -180.0),
+        min(latitude + lat_delta, 90.0),
+        min(longitude + lon_delta, 180.0),
+    )
+
+def geohash_cells_for_radius(latitude, longitude, radius_m, precision=6):
+    """
+    Get the geohash cells covering a circle around a coordinate
+    
+    Args:
+        latitude: Center latitude
+        longitude: Center longitude
+        radius_m: Radius in meters
+        precision: Number of geohash characters
+    
+    Returns:
+        List of geohash strings
+    """
+    south, west, north, east = radius_bbox(latitude, longitude, radius_m)
+    lat_step, lon_step = geohash_cell_size(precision)
+    
+    cells = []
+    seen = set()
+    lat = south
+    while True:
+        lon = west
+        while True:
+            cell = encode_geohash(min(lat, north), min(lon, east), precision)
+            if cell not in seen:
+                seen.add(cell)
+                cells.append(cell)
+            if lon >= east:
+                break
+            lon += lon_step
+        if lat >= north:
+            break
+        lat += lat_step
+    
+    return cells